@@ -0,0 +1,169 @@
+"""Overhead of the auth middleware on plain and streamed responses.
+
+Serves a small Starlette app with uvicorn, once behind ``AuthMiddleware``
+(pure ASGI) and once behind the same checks run through Starlette's
+``BaseHTTPMiddleware`` (how ``AuthMiddleware`` used to be built), and
+reports for each:
+
+- requests/s of a small JSON endpoint under ``--concurrency`` clients
+- time to the first event of a server-sent event stream, and to its last one
+
+Both run the dev identity path (``COGNITO_INTEGRATE=false``), so the
+numbers are the middleware's own cost; verifying a token costs the same
+either way.
+
+    PYTHONPATH=src python -m benchmarks.bench_auth
+    PYTHONPATH=src python -m benchmarks.bench_auth --duration 10 --concurrency 32 --streams 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+os.environ['COGNITO_INTEGRATE'] = 'false'
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from toshokan.frontend.metrics import percentile
+from toshokan.frontend.middleware.auth import AuthMiddleware, authenticate, login_redirect
+
+
+class BaseHTTPAuthMiddleware(BaseHTTPMiddleware):
+    """The same checks as ``AuthMiddleware``, the way it used to run them."""
+
+    async def dispatch(self, request, call_next):
+        session_info = await authenticate(request)
+        if session_info is None:
+            return login_redirect()
+        request.state.session_info = session_info
+        return await call_next(request)
+
+
+def build_app(middleware, events: int, interval: float) -> Starlette:
+    async def ping(request):
+        return JSONResponse({'user': request.state.session_info['cognito_id']})
+
+    async def stream(request):
+        user = request.state.session_info['cognito_id']
+
+        async def events_():
+            for index in range(events):
+                yield f'data: {json.dumps({"user": user, "index": index})}\n\n'
+                await asyncio.sleep(interval)
+
+        return StreamingResponse(events_(), media_type='text/event-stream')
+
+    app = Starlette(routes=[Route('/ping', ping), Route('/stream', stream)])
+    app.add_middleware(middleware)
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    def __init__(self, app):
+        self.port = _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=self.port, log_level='warning'))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return f'http://127.0.0.1:{self.port}'
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def requests_per_second(url: str, concurrency: int, duration: float) -> float:
+    done = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client):
+        nonlocal done
+        while time.perf_counter() < deadline:
+            response = await client.get(f'{url}/ping')
+            response.raise_for_status()
+            done += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return done / (time.perf_counter() - started_at)
+
+
+async def stream_latencies(url: str, streams: int, concurrency: int) -> tuple[list[float], list[float]]:
+    first, last = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(client):
+        async with semaphore:
+            started_at = time.perf_counter()
+            first_at = None
+            async with client.stream('GET', f'{url}/stream') as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_raw():
+                    if chunk and first_at is None:
+                        first_at = time.perf_counter() - started_at
+            first.append(first_at)
+            last.append(time.perf_counter() - started_at)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        await asyncio.gather(*(one(client) for _ in range(streams)))
+    return first, last
+
+
+def run(middleware, args) -> dict:
+    with Server(build_app(middleware, args.events, args.interval_ms / 1000)) as url:
+        rps = asyncio.run(requests_per_second(url, args.concurrency, args.duration))
+        first, last = asyncio.run(stream_latencies(url, args.streams, args.concurrency))
+    return {
+        'requests_per_second': round(rps, 1),
+        'first_event_p50_ms': round(percentile(first, 50) * 1000, 2),
+        'first_event_p99_ms': round(percentile(first, 99) * 1000, 2),
+        'last_event_p50_ms': round(percentile(last, 50) * 1000, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the pure ASGI auth middleware with BaseHTTPMiddleware')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of requests/s measurement')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--streams', type=int, default=100)
+    parser.add_argument('--events', type=int, default=5, help='events per stream')
+    parser.add_argument('--interval-ms', type=float, default=20.0, help='time between events')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = {
+        'BaseHTTPMiddleware': run(BaseHTTPAuthMiddleware, args),
+        'AuthMiddleware (ASGI)': run(AuthMiddleware, args),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"middleware":<24}{"req/s":>10}{"first p50":>12}{"first p99":>12}{"last p50":>12}')
+    for name, result in results.items():
+        print(
+            f'{name:<24}{result["requests_per_second"]:>10}{result["first_event_p50_ms"]:>10}ms'
+            f'{result["first_event_p99_ms"]:>10}ms{result["last_event_p50_ms"]:>10}ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Single-shot vs three-call conversation turns.
+
+Runs ``run_the_conversation_chat`` in both modes and reports, per turn:
+wall time (p50/p95), model calls, input/output tokens and, against a live
+endpoint, OpenRouter's reported cost.
+
+By default the fake chat model from ``benchmarks/fake_llm.py`` is used, so
+the token counts are estimates from the prompt and canned output sizes.
+With ``--live`` the configured models are called (``OPENROUTER_API_KEY``,
+optionally ``OPENROUTER_API_BASE`` for the mock server) and the counts come
+from the provider's usage reports.
+
+    PYTHONPATH=src python -m benchmarks.bench_conversation --turns 20
+    PYTHONPATH=src python -m benchmarks.bench_conversation --live --turns 5 --model openai/gpt-4o
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+os.environ.setdefault('OPENROUTER_API_KEY', 'benchmark-key')
+# every iteration repeats the same input, which would otherwise share one call
+os.environ.setdefault('LLM_DEDUPE_WINDOW_SECONDS', '0')
+
+import gradio as gr
+from benchmarks.bench_handlers import KNOWN_KANJI, SCHEDULED_KANJI, LESSONS, _history, install_fake_models
+from benchmarks.fake_llm import CallProbe, current_probe
+from toshokan.frontend import handlers
+from toshokan.frontend.metrics import percentile
+from toshokan.frontend.routing import task_usage
+
+
+SITUATION = 'You are ordering lunch at a small restaurant near the station.'
+USER_TURNS = ['こんにちは。今日はいい天気ですね。', '週末は何をしますか？', 'そうですか。私は映画を見に行きます。']
+
+
+def _ledger_totals() -> dict:
+    report = task_usage.report()
+    return {
+        'calls': sum(entry['calls'] for entry in report.values()),
+        'input_tokens': sum(entry['input_tokens'] for entry in report.values()),
+        'output_tokens': sum(entry['output_tokens'] for entry in report.values()),
+        'cost': sum(entry['cost'] for entry in report.values()),
+    }
+
+
+def run_mode(single_shot: bool, turns: int, model_name: str, live: bool) -> dict:
+    runtime_config = {'model_name': model_name, 'openrouter_api_key': None, 'conversation_single_shot': single_shot}
+    request = gr.Request(session_hash=f'bench-conversation-{single_shot}')
+    history = _history(3)
+    walls = []
+    probe = CallProbe()
+    before = _ledger_totals()
+    for turn in range(turns):
+        token = current_probe.set(probe)
+        try:
+            started_at = time.perf_counter()
+            handlers.run_the_conversation_chat(
+                LESSONS, SITUATION, KNOWN_KANJI, SCHEDULED_KANJI, USER_TURNS[turn % len(USER_TURNS)],
+                history, 'Semi-formal', runtime_config, request=request)
+            walls.append(time.perf_counter() - started_at)
+        finally:
+            current_probe.reset(token)
+
+    if live:
+        after = _ledger_totals()
+        usage = {key: after[key] - before[key] for key in after}
+    else:
+        usage = {'calls': probe.calls, 'input_tokens': probe.input_tokens, 'output_tokens': probe.output_tokens, 'cost': 0.0}
+    return {
+        'wall_p50_s': percentile(walls, 50),
+        'wall_p95_s': percentile(walls, 95),
+        'calls_per_turn': usage['calls'] / turns,
+        'input_tokens_per_turn': usage['input_tokens'] / turns,
+        'output_tokens_per_turn': usage['output_tokens'] / turns,
+        'cost_per_turn': usage['cost'] / turns,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Single-shot vs three-call conversation turns')
+    parser.add_argument('--turns', type=int, default=10)
+    parser.add_argument('--model', default='openai/gpt-4o')
+    parser.add_argument('--live', action='store_true', help='call the configured models instead of the fake one')
+    parser.add_argument('--latency-median', type=float, default=0.3, help='fake time to first token, seconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.3)
+    parser.add_argument('--tokens-per-second', type=float, default=80.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=Path, help='write results to this file')
+    args = parser.parse_args(argv)
+
+    if not args.live:
+        install_fake_models(args.latency_median, args.latency_sigma, args.tokens_per_second, args.seed)
+
+    results = {
+        'three_call': run_mode(False, args.turns, args.model, args.live),
+        'single_shot': run_mode(True, args.turns, args.model, args.live),
+    }
+
+    header = f"{'mode':<12} {'p50 s':>7} {'p95 s':>7} {'calls':>6} {'in tok':>8} {'out tok':>8} {'cost $':>10}"
+    print(f'{args.turns} turns per mode, {"live" if args.live else "fake"} model')
+    print(header)
+    print('-' * len(header))
+    for mode, r in results.items():
+        print(f"{mode:<12} {r['wall_p50_s']:>7.2f} {r['wall_p95_s']:>7.2f} {r['calls_per_turn']:>6.1f} "
+              f"{r['input_tokens_per_turn']:>8.0f} {r['output_tokens_per_turn']:>8.0f} {r['cost_per_turn']:>10.5f}")
+
+    three_call, single_shot = results['three_call'], results['single_shot']
+    if three_call['wall_p50_s']:
+        print(f"\nsingle-shot p50 latency: {single_shot['wall_p50_s'] / three_call['wall_p50_s']:.0%} of three-call")
+    total_three = three_call['input_tokens_per_turn'] + three_call['output_tokens_per_turn']
+    if total_three:
+        total_single = single_shot['input_tokens_per_turn'] + single_shot['output_tokens_per_turn']
+        print(f'single-shot tokens per turn: {total_single / total_three:.0%} of three-call')
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Handler overhead benchmark against a fake chat model.
+
+Drives every handler in ``handlers.py`` and the ``state_manager`` save/load
+functions in-process, with the model pool swapped for :class:`FakeChatModel`.
+For each handler it reports:
+
+- overhead: handler wall time minus simulated model time (p50/p99), with
+  N concurrent simulated users
+- peak traced allocations of a single call (measured sequentially)
+
+Results are compared against ``benchmarks/baseline.json``, which holds a
+run per number of users. Machine speed is taken out with a calibration
+workload (fixed JSON and gzip work) timed in the same process: the baseline's
+overheads are scaled by how much faster or slower it ran, and the run fails
+with exit code 1 when a handler's p50 overhead regresses by more than the
+threshold.
+
+    PYTHONPATH=src python -m benchmarks.bench_handlers --users 16 --iterations 20
+    PYTHONPATH=src python -m benchmarks.bench_handlers --update-baseline
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault('OPENROUTER_API_KEY', 'benchmark-key')
+# every iteration repeats the same input, which would otherwise share one call
+os.environ.setdefault('LLM_DEDUPE_WINDOW_SECONDS', '0')
+# measure the live exercise generation, not the bank
+os.environ.setdefault('EXERCISE_BANK_ENABLED', 'false')
+
+import gradio as gr
+from gradio_agentchatbot_5 import ChatMessage
+from benchmarks.fake_llm import CallProbe, current_probe, fake_model_factory
+from toshokan.frontend import handlers, models, state_manager
+from toshokan.frontend.metrics import percentile
+
+
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+ARTIFACTS = Path(__file__).resolve().parent.parent / 'artifacts'
+
+KNOWN_KANJI = (ARTIFACTS / 'known_kanji.csv').read_text()
+SCHEDULED_KANJI = (ARTIFACTS / 'scheduled_kanji.csv').read_text()
+LESSONS = ['Lesson 3 - ~ます forms', 'Lesson 5 - past tense']
+EXERCISE_TYPE = 'Translate sentences ENG -> JP'
+SAMPLE_SENTENCE = '昨日は駅の近くの喫茶店で友達と会いました。週末は何をしますか？'
+RUNTIME_CONFIG = {'model_name': 'openai/gpt-4o', 'openrouter_api_key': None}
+
+
+def _history(turns: int) -> list[ChatMessage]:
+    history = []
+    for i in range(turns):
+        history.append(ChatMessage(role='user', content=f'答え{i}: 昨日、友達と駅で会いました。'))
+        history.append(ChatMessage(role='assistant', content=f'よくできました！次の問題{i}: I went to the bank yesterday.'))
+    return history
+
+
+def _scenarios(tmp_dir: Path) -> dict:
+    history = _history(10)
+    lessons_df = state_manager.load_csv_into_df_lessons(str(ARTIFACTS / 'lessons.csv'))
+    selected_df = state_manager.load_csv_into_df_lessons_selected_for_conversation(str(ARTIFACTS / 'lessons_include.csv'))
+    exercise_types_df = state_manager.load_csv_into_df_exercise_types(str(ARTIFACTS / 'exercise_types.csv'))
+    exercise_state = {f'{"_".join(LESSONS)}_{EXERCISE_TYPE}_{i}': _history(20) for i in range(20)}
+
+    saved = state_manager.save_config(dict(RUNTIME_CONFIG), lessons_df, selected_df, exercise_types_df, KNOWN_KANJI, SCHEDULED_KANJI)
+    config_path = tmp_dir / 'config.jsonl.gz'
+    config_path.write_bytes(Path(saved.value['path']).read_bytes())
+    saved = state_manager.save_exercise_progress(exercise_state)
+    progress_path = tmp_dir / 'progress.jsonl.gz'
+    progress_path.write_bytes(Path(saved.value['path']).read_bytes())
+
+    return {
+        'run_the_exercise_initiate': lambda request: handlers.run_the_exercise_initiate(
+            LESSONS, EXERCISE_TYPE, KNOWN_KANJI, SCHEDULED_KANJI, '', RUNTIME_CONFIG, request=request),
+        'run_the_exercise_chat': lambda request: handlers.run_the_exercise_chat(
+            LESSONS, EXERCISE_TYPE, KNOWN_KANJI, SCHEDULED_KANJI, '昨日、銀行に行きました。', history, RUNTIME_CONFIG, request=request),
+        'run_the_conversation_initiate': lambda request: handlers.run_the_conversation_initiate(
+            'Semi-formal', RUNTIME_CONFIG, request=request),
+        'run_the_conversation_chat': lambda request: handlers.run_the_conversation_chat(
+            LESSONS, 'At a restaurant', KNOWN_KANJI, SCHEDULED_KANJI, '週末は何をしますか？', history, 'Semi-formal', RUNTIME_CONFIG, request=request),
+        'detect_unknown_kanji': lambda request: handlers.detect_unknown_kanji(
+            SAMPLE_SENTENCE, KNOWN_KANJI, SCHEDULED_KANJI, RUNTIME_CONFIG, request=request),
+        'run_the_word_chat': lambda request: handlers.run_the_word_chat('喫茶店', history, RUNTIME_CONFIG, request=request),
+        'run_the_breakdown_chat': lambda request: handlers.run_the_breakdown_chat(SAMPLE_SENTENCE, history, RUNTIME_CONFIG, request=request),
+        'run_the_aux_chat': lambda request: handlers.run_the_aux_chat('What is the difference between は and が?', history, RUNTIME_CONFIG, request=request),
+        'update_lessons_included_choices_values': lambda request: handlers.update_lessons_included_choices_values(lessons_df, selected_df),
+        'save_config': lambda request: state_manager.save_config(
+            dict(RUNTIME_CONFIG), lessons_df, selected_df, exercise_types_df, KNOWN_KANJI, SCHEDULED_KANJI),
+        'load_config': lambda request: state_manager.load_config(str(config_path)),
+        'save_exercise_progress': lambda request: state_manager.save_exercise_progress(exercise_state),
+        'load_exercise_progress': lambda request: state_manager.load_exercise_progress(str(progress_path)),
+    }
+
+
+def _calibration_workload():
+    payload = {'history': [message.model_dump() for message in _history(20)], 'kanji': KNOWN_KANJI}
+    for _ in range(10):
+        gzip.decompress(gzip.compress(json.dumps(payload, ensure_ascii=False).encode()))
+
+
+def calibrate(rounds: int = 15) -> float:
+    """Median time of the calibration workload on one thread, in ms."""
+    _calibration_workload()
+    timings = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        _calibration_workload()
+        timings.append(time.perf_counter() - started_at)
+    return percentile(timings, 50) * 1000
+
+
+def _timed_call(fn, request) -> tuple[float, CallProbe]:
+    probe = CallProbe()
+    token = current_probe.set(probe)
+    try:
+        started_at = time.perf_counter()
+        fn(request)
+        wall = time.perf_counter() - started_at
+    finally:
+        current_probe.reset(token)
+    return wall, probe
+
+
+def measure_concurrent(fn, users: int, iterations: int) -> dict:
+    overheads, walls = [], []
+    lock = threading.Lock()
+
+    def user(index):
+        request = gr.Request(session_hash=f'bench-user-{index}')
+        for _ in range(iterations):
+            wall, probe = _timed_call(fn, request)
+            with lock:
+                walls.append(wall)
+                overheads.append(max(0.0, wall - probe.model_seconds))
+
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(user, range(users)))
+
+    return {
+        'overhead_p50_ms': percentile(overheads, 50) * 1000,
+        'overhead_p99_ms': percentile(overheads, 99) * 1000,
+        'wall_p50_ms': percentile(walls, 50) * 1000,
+        'wall_p99_ms': percentile(walls, 99) * 1000,
+    }
+
+
+def measure_allocations(fn) -> dict:
+    request = gr.Request(session_hash='bench-alloc')
+    fn(request)  # warm caches and lazy imports
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn(request)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'alloc_peak_kib': (peak - before) / 1024}
+
+
+def install_fake_models(latency_median: float, latency_sigma: float, tokens_per_second: float, seed: int):
+    models.model_pool = models.ModelPool(factory=fake_model_factory(
+        latency_median=latency_median,
+        latency_sigma=latency_sigma,
+        tokens_per_second=tokens_per_second,
+        seed=seed,
+    ))
+
+
+def compare(results: dict, calibration_ms: float, baseline: dict, threshold: float, slack_ms: float) -> list[str]:
+    """Handlers whose p50 overhead, relative to the calibration, grew past the threshold."""
+    scale = calibration_ms / baseline['calibration_ms']
+    regressions = []
+    for name, result in results.items():
+        previous = baseline['handlers'].get(name)
+        if previous is None:
+            continue
+        expected = previous['overhead_p50_ms'] * scale
+        limit = expected * (1 + threshold) + slack_ms
+        if result['overhead_p50_ms'] > limit:
+            regressions.append(
+                f"{name}: overhead p50 {result['overhead_p50_ms']:.2f} ms > {limit:.2f} ms "
+                f"(baseline {previous['overhead_p50_ms']:.2f} ms, x{scale:.2f} for this run's calibration)")
+    return regressions
+
+
+def print_table(results: dict):
+    header = f"{'handler':<40} {'ovh p50':>9} {'ovh p99':>9} {'wall p50':>9} {'wall p99':>9} {'alloc KiB':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        print(f"{name:<40} {r['overhead_p50_ms']:>9.2f} {r['overhead_p99_ms']:>9.2f} "
+              f"{r['wall_p50_ms']:>9.2f} {r['wall_p99_ms']:>9.2f} {r['alloc_peak_kib']:>10.1f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=8, help='concurrent simulated users')
+    parser.add_argument('--iterations', type=int, default=10, help='calls per user per handler')
+    parser.add_argument('--latency-median', type=float, default=0.02, help='fake time to first token, seconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='lognormal sigma of the time to first token')
+    parser.add_argument('--tokens-per-second', type=float, default=500.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='*', help='run only these handlers')
+    parser.add_argument('--threshold', type=float, default=1.0, help='allowed relative p50 overhead regression')
+    parser.add_argument('--slack-ms', type=float, default=2.0, help='absolute slack added to the limit')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--json', type=Path, help='also write results to this file')
+    args = parser.parse_args(argv)
+
+    install_fake_models(args.latency_median, args.latency_sigma, args.tokens_per_second, args.seed)
+
+    tmp_dir = Path('/tmp/toshokan_bench')
+    tmp_dir.mkdir(exist_ok=True)
+    scenarios = _scenarios(tmp_dir)
+    if args.only:
+        scenarios = {name: fn for name, fn in scenarios.items() if name in args.only}
+
+    calibration_ms = calibrate()
+    results = {}
+    for name, fn in scenarios.items():
+        results[name] = {**measure_concurrent(fn, args.users, args.iterations), **measure_allocations(fn)}
+
+    print(f'{args.users} users x {args.iterations} iterations, fake model median {args.latency_median * 1000:.0f} ms, '
+          f'calibration p50 {calibration_ms:.2f} ms')
+    print_table(results)
+
+    if args.json:
+        args.json.write_text(json.dumps({'calibration_ms': calibration_ms, 'handlers': results}, indent=2))
+
+    # overhead under contention grows with the number of users, so each count has its own baseline
+    baselines = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if args.update_baseline:
+        baselines[str(args.users)] = {'calibration_ms': calibration_ms, 'handlers': results}
+        args.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + '\n')
+        print(f'Baseline for {args.users} users written to {args.baseline}')
+        return 0
+
+    baseline = baselines.get(str(args.users))
+    if baseline is None:
+        print(f'No baseline for {args.users} users in {args.baseline}; run with --update-baseline to create one')
+        return 0
+
+    regressions = compare(results, calibration_ms, baseline, args.threshold, args.slack_ms)
+    if regressions:
+        print('\n' + '!' * 72)
+        print('HANDLER OVERHEAD REGRESSION')
+        for line in regressions:
+            print(f'  {line}')
+        print('!' * 72)
+        return 1
+    print('\nNo overhead regressions against the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
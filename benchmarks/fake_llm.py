@@ -0,0 +1,168 @@
+"""Deterministic stand-in for ``ChatOpenRouter`` used by the benchmarks.
+
+The fake model sleeps for a simulated time to first token drawn from a
+lognormal distribution, then for ``output_tokens / tokens_per_second``, and
+returns canned text or structured outputs. The simulated time is credited to
+the active :class:`CallProbe`, so benchmarks can subtract model time from
+handler wall time.
+"""
+import asyncio
+import contextvars
+import math
+import random
+import threading
+import time
+from typing import Any, Callable
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel, PrivateAttr
+from toshokan.frontend.schema import (
+    AllKanji,
+    ConversationAnnotatedResponse,
+    ConversationKanjiResponse,
+    ConversationResponse,
+    ConversationSituation,
+    UnknownKanji,
+)
+
+
+SAMPLE_REPLY = 'はい、そうですね。昨日は駅の近くの喫茶店で友達と会いました。週末は何をしますか？'
+
+
+def _fake_situation(messages):
+    return ConversationSituation(situation='You are ordering lunch at a small restaurant near the station.')
+
+
+def _fake_conversation(messages):
+    return ConversationResponse(response=SAMPLE_REPLY, notes='Natural and polite. 喫茶店 is a nice word choice.')
+
+
+def _fake_all_kanji(messages):
+    return AllKanji(kanji='昨,日,駅,近,喫,茶,店,友,達,会,週,末,何')
+
+
+def _fake_unknown_kanji(messages):
+    return ConversationKanjiResponse(unknown_kanji=[
+        UnknownKanji(kanji='喫茶店', hiragana='きっさてん', explanation='coffee shop'),
+        UnknownKanji(kanji='週末', hiragana='しゅうまつ', explanation='weekend'),
+        UnknownKanji(kanji='近く', hiragana='ちかく', explanation='nearby'),
+    ])
+
+
+def _fake_annotated_conversation(messages):
+    return ConversationAnnotatedResponse(
+        response=SAMPLE_REPLY,
+        notes='Natural and polite. 喫茶店 is a nice word choice.',
+        unknown_kanji=_fake_unknown_kanji(messages).unknown_kanji,
+    )
+
+
+DEFAULT_STRUCTURED_OUTPUTS: dict[type[BaseModel], Callable[[list[BaseMessage]], BaseModel]] = {
+    ConversationSituation: _fake_situation,
+    ConversationResponse: _fake_conversation,
+    AllKanji: _fake_all_kanji,
+    ConversationKanjiResponse: _fake_unknown_kanji,
+    ConversationAnnotatedResponse: _fake_annotated_conversation,
+}
+
+
+class CallProbe:
+    """Accumulates simulated model time and token counts for one handler call."""
+
+    __slots__ = ('model_seconds', 'calls', 'input_tokens', 'output_tokens')
+
+    def __init__(self):
+        self.model_seconds = 0.0
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+
+current_probe: contextvars.ContextVar[CallProbe | None] = contextvars.ContextVar('current_probe', default=None)
+
+
+def _count_tokens(text: str) -> int:
+    # close enough for Japanese-heavy text: ~1 token per 2 characters
+    return max(1, math.ceil(len(text) / 2))
+
+
+class FakeChatModel(BaseChatModel):
+    model_name: str = 'fake'
+    latency_median: float = 0.05
+    latency_sigma: float = 0.5
+    tokens_per_second: float = 200.0
+    reply: str = SAMPLE_REPLY
+    seed: int = 0
+    structured_outputs: dict = {}
+
+    _rng: random.Random = PrivateAttr()
+    _rng_lock: threading.Lock = PrivateAttr()
+
+    def model_post_init(self, context: Any):
+        self._rng = random.Random(self.seed)
+        self._rng_lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat'
+
+    def _simulate(self, messages: list[BaseMessage], output_text: str) -> float:
+        with self._rng_lock:
+            ttft = self.latency_median * math.exp(self._rng.gauss(0, self.latency_sigma)) if self.latency_median > 0 else 0.0
+        output_tokens = _count_tokens(output_text)
+        seconds = ttft + (output_tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0)
+        probe = current_probe.get()
+        if probe is not None:
+            probe.model_seconds += seconds
+            probe.calls += 1
+            probe.input_tokens += sum(_count_tokens(str(m.content)) for m in messages)
+            probe.output_tokens += output_tokens
+        return seconds
+
+    def _result(self, messages: list[BaseMessage]) -> ChatResult:
+        input_tokens = sum(_count_tokens(str(m.content)) for m in messages)
+        output_tokens = _count_tokens(self.reply)
+        usage = {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens}
+        message = AIMessage(content=self.reply, usage_metadata={
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={'token_usage': usage, 'model_name': self.model_name})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._simulate(messages, self.reply))
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._simulate(messages, self.reply))
+        return self._result(messages)
+
+    def with_structured_output(self, schema, **kwargs):
+        build = {**DEFAULT_STRUCTURED_OUTPUTS, **self.structured_outputs}[schema]
+
+        def _messages(value):
+            return value.to_messages() if hasattr(value, 'to_messages') else list(value)
+
+        def _invoke(value, **kwargs):
+            messages = _messages(value)
+            output = build(messages)
+            time.sleep(self._simulate(messages, output.model_dump_json()))
+            return output
+
+        async def _ainvoke(value, **kwargs):
+            messages = _messages(value)
+            output = build(messages)
+            await asyncio.sleep(self._simulate(messages, output.model_dump_json()))
+            return output
+
+        return RunnableLambda(_invoke, afunc=_ainvoke)
+
+
+def fake_model_factory(**params):
+    """Return a ``ModelPool`` factory that builds :class:`FakeChatModel` clients."""
+    def factory(model_name, api_key, http_client=None, http_async_client=None):
+        return FakeChatModel(model_name=model_name, **params)
+    return factory
@@ -0,0 +1,198 @@
+"""Scripted load generator for the full stack (uvicorn, middleware, Gradio queue, handlers).
+
+Each simulated learner is a separate Gradio client session that loops
+through a realistic journey: configure the library, do an exercise, hold a
+short conversation and run the lookup chats. Concurrency ramps through the
+given levels; for each level the run reports throughput, latency
+percentiles and the error rate per step and overall.
+
+    python -m benchmarks.mock_openrouter --port 8900 &
+    OPENROUTER_API_BASE=http://127.0.0.1:8900/api/v1 OPENROUTER_API_KEY=mock \\
+        python -m toshokan.frontend.app &
+    python -m benchmarks.loadgen --url http://127.0.0.1:8080/dashboard/ --levels 1 4 16 32 --duration 60
+
+With Cognito enabled, pass the session cookies of a test user with
+``--cookie 'id_token=...; access_token=...'``.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from gradio_client import Client, handle_file
+from toshokan.frontend.metrics import percentile
+
+
+ARTIFACTS = Path(__file__).resolve().parent.parent / 'artifacts'
+
+EXERCISE_ANSWERS = ['昨日、友達と駅で会いました。', 'わかりません。ヒントをください。', '毎日日本語を勉強します。']
+CONVERSATION_TURNS = ['こんにちは。今日はいい天気ですね。', '週末は何をしますか？', 'そうですか。私は映画を見に行きます。']
+WORDS = ['喫茶店', 'to borrow', '週末', 'umbrella']
+SENTENCES = ['昨日は駅の近くの喫茶店で友達と会いました。', '雨が降っているから、傘を持って行きます。']
+AUX_QUESTIONS = ['What is the difference between は and が?', 'When do I use ～ている?']
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, step: str, seconds: float, ok: bool):
+        with self._lock:
+            if ok:
+                self.latencies[step].append(seconds)
+            else:
+                self.errors[step] += 1
+
+
+class Learner:
+    """One simulated user with its own Gradio session."""
+
+    def __init__(self, url: str, recorder: Recorder, headers: dict, rng: random.Random, think_time: float):
+        self.client = Client(url, headers=headers, verbose=False)
+        self.recorder = recorder
+        self.rng = rng
+        self.think_time = think_time
+
+    def step(self, name: str, *args, api_name: str):
+        started_at = time.perf_counter()
+        try:
+            result = self.client.predict(*args, api_name=api_name)
+        except Exception:
+            self.recorder.record(name, time.perf_counter() - started_at, False)
+            raise
+        self.recorder.record(name, time.perf_counter() - started_at, True)
+        if self.think_time:
+            time.sleep(self.rng.uniform(0, self.think_time))
+        return result
+
+    def configure(self):
+        lessons = self.step('load_lessons', handle_file(str(ARTIFACTS / 'lessons.csv')), api_name='/load_csv_into_df_lessons')
+        self.lesson_choices = [value for _, value in self.step('lesson_dropdown', lessons, [], api_name='/update_exercise_lesson_dropdown_values')['choices']]
+        exercise_types = self.step('load_exercise_types', handle_file(str(ARTIFACTS / 'exercise_types.csv')), api_name='/load_csv_into_df_exercise_types')
+        self.exercise_type_choices = [value for _, value in self.step('exercise_type_dropdown', exercise_types, api_name='/update_exercise_type_dropdown_choices')['choices']]
+        self.known_kanji = self.step('load_known_kanji', handle_file(str(ARTIFACTS / 'known_kanji.csv')), api_name='/load_csv_into_txt')
+        self.scheduled_kanji = self.step('load_scheduled_kanji', handle_file(str(ARTIFACTS / 'scheduled_kanji.csv')), api_name='/load_csv_into_txt_1')
+
+    def exercise(self):
+        lessons = self.rng.sample(self.lesson_choices, 2)
+        exercise_type = self.rng.choice(self.exercise_type_choices)
+        chat, _ = self.step('exercise_initiate', lessons, exercise_type, self.known_kanji, self.scheduled_kanji, '', api_name='/run_the_exercise_initiate')
+        for answer in EXERCISE_ANSWERS:
+            chat, _ = self.step('exercise_chat', lessons, exercise_type, self.known_kanji, self.scheduled_kanji, answer, chat, api_name='/run_the_exercise_chat')
+
+    def conversation(self):
+        formality = self.rng.choice(['Formal', 'Semi-formal', 'Informal'])
+        situation = self.step('conversation_initiate', formality, api_name='/run_the_conversation_initiate')
+        chat = []
+        for turn in CONVERSATION_TURNS:
+            chat, _, _, _ = self.step('conversation_chat', [], situation, self.known_kanji, self.scheduled_kanji, turn, chat, formality, api_name='/run_the_conversation_chat')
+
+    def lookups(self):
+        self.step('word_lookup', self.rng.choice(WORDS), [], api_name='/run_the_word_chat')
+        self.step('breakdown', self.rng.choice(SENTENCES), [], api_name='/run_the_breakdown_chat')
+        self.step('aux_chat', self.rng.choice(AUX_QUESTIONS), [], api_name='/run_the_aux_chat')
+
+    def run(self, stop: threading.Event):
+        try:
+            self.configure()
+        except Exception:
+            return
+        while not stop.is_set():
+            for activity in (self.exercise, self.conversation, self.lookups):
+                if stop.is_set():
+                    return
+                try:
+                    activity()
+                except Exception:
+                    # the error is recorded; start the next activity like a user would
+                    pass
+
+
+def run_level(url: str, users: int, duration: float, headers: dict, think_time: float, seed: int) -> dict:
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = []
+    for index in range(users):
+        rng = random.Random(seed + index)
+
+        def target(rng=rng):
+            try:
+                Learner(url, recorder, headers, rng, think_time).run(stop)
+            except Exception:
+                recorder.record('connect', 0.0, False)
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    started_at = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=120)
+    elapsed = time.perf_counter() - started_at
+
+    steps = {}
+    for step in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = recorder.latencies.get(step, [])
+        errors = recorder.errors.get(step, 0)
+        steps[step] = {
+            'ok': len(latencies),
+            'errors': errors,
+            'error_rate': errors / max(1, len(latencies) + errors),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+        }
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    total_errors = sum(recorder.errors.values())
+    return {
+        'users': users,
+        'seconds': elapsed,
+        'throughput': len(all_latencies) / elapsed,
+        'error_rate': total_errors / max(1, len(all_latencies) + total_errors),
+        'p50': percentile(all_latencies, 50),
+        'p95': percentile(all_latencies, 95),
+        'p99': percentile(all_latencies, 99),
+        'steps': steps,
+    }
+
+
+def print_level(result: dict, verbose: bool):
+    print(f"{result['users']:>6} {result['throughput']:>10.2f} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+          f"{result['p99']:>8.2f} {result['error_rate'] * 100:>7.1f}%")
+    if verbose:
+        for step, s in result['steps'].items():
+            print(f"         {step:<24} ok={s['ok']:<5} err={s['errors']:<4} p50={s['p50']:.2f}s p95={s['p95']:.2f}s p99={s['p99']:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ramp simulated learners against a running Toshokan instance')
+    parser.add_argument('--url', default='http://127.0.0.1:8080/dashboard/')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds per concurrency level')
+    parser.add_argument('--think-time', type=float, default=1.0, help='max random pause between steps, seconds')
+    parser.add_argument('--cookie', help='Cookie header for authenticated deployments')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='print per-step breakdown')
+    parser.add_argument('--json', type=Path, help='write all results to this file')
+    args = parser.parse_args(argv)
+
+    headers = {'Cookie': args.cookie} if args.cookie else {}
+    print(f"{'users':>6} {'steps/s':>10} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'errors':>8}")
+    results = []
+    for users in args.levels:
+        result = run_level(args.url, users, args.duration, headers, args.think_time, args.seed)
+        print_level(result, args.verbose)
+        results.append(result)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
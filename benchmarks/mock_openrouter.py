@@ -0,0 +1,243 @@
+"""Local mock of the OpenRouter chat-completions API for load testing.
+
+Speaks enough of the OpenAI API for ``ChatOpenRouter``: plain and streamed
+completions, tool calls (function-calling structured output) and
+``response_format`` JSON schemas. Structured responses are generated from
+the request's JSON schema. Latency, jitter, token rate, error injection and
+a per-key requests-per-minute limit with rate-limit headers are configurable.
+
+    python -m benchmarks.mock_openrouter --port 8900 --latency-ms 800 --jitter-ms 400 --error-rate 0.02
+
+Then start the app with ``OPENROUTER_API_BASE=http://127.0.0.1:8900/api/v1``.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import deque
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+SAMPLE_REPLY = 'はい、そうですね。昨日は駅の近くの喫茶店で友達と会いました。週末は何をしますか？'
+
+# property name -> canned value, for the fields of toshokan's schemas
+SAMPLE_FIELDS = {
+    'situation': 'You are ordering lunch at a small restaurant near the station.',
+    'response': SAMPLE_REPLY,
+    'notes': 'Natural and polite. 喫茶店 is a nice word choice.',
+    'kanji': '喫,茶,店,週,末',
+    'hiragana': 'きっさてん',
+    'explanation': 'coffee shop',
+}
+
+
+class MockSettings:
+    def __init__(self, latency_ms=800.0, jitter_ms=300.0, tokens_per_second=80.0, error_rate=0.0, rate_limit_rpm=0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rpm = rate_limit_rpm
+        self.rng = random.Random(seed)
+
+
+def _tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 2))
+
+
+def sample_from_schema(schema: dict, defs: dict | None = None, name: str = ''):
+    """Build a value that validates against a (pydantic-generated) JSON schema."""
+    defs = defs if defs is not None else schema.get('$defs', {})
+    if '$ref' in schema:
+        return sample_from_schema(defs[schema['$ref'].split('/')[-1]], defs, name)
+    for combinator in ('anyOf', 'oneOf', 'allOf'):
+        if combinator in schema:
+            return sample_from_schema(schema[combinator][0], defs, name)
+    kind = schema.get('type', 'object')
+    if kind == 'object':
+        return {key: sample_from_schema(value, defs, key) for key, value in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [sample_from_schema(schema.get('items', {}), defs, name) for _ in range(3)]
+    if kind == 'string':
+        return SAMPLE_FIELDS.get(name, f'sample {name}'.strip())
+    if kind == 'integer':
+        return 1
+    if kind == 'number':
+        return 1.0
+    if kind == 'boolean':
+        return True
+    return None
+
+
+class RateLimiter:
+    """Sliding one-minute request window per API key."""
+
+    def __init__(self):
+        self._windows: dict[str, deque] = {}
+
+    def check(self, key: str, limit: int) -> tuple[bool, dict]:
+        now = time.monotonic()
+        window = self._windows.setdefault(key, deque())
+        while window and now - window[0] > 60:
+            window.popleft()
+        allowed = len(window) < limit
+        if allowed:
+            window.append(now)
+        reset = 60 - (now - window[0]) if window else 60
+        headers = {
+            'x-ratelimit-limit-requests': str(limit),
+            'x-ratelimit-remaining-requests': str(max(0, limit - len(window))),
+            'x-ratelimit-reset-requests': f'{reset:.1f}s',
+        }
+        if not allowed:
+            headers['retry-after'] = f'{math.ceil(reset)}'
+        return allowed, headers
+
+
+def _error(status: int, message: str, headers: dict | None = None) -> JSONResponse:
+    return JSONResponse({'error': {'message': message, 'code': status}}, status_code=status, headers=headers)
+
+
+def _completion_body(body: dict) -> tuple[dict, str]:
+    """Return the assistant message for the request and the text used for token counts."""
+    tools = body.get('tools') or []
+    response_format = body.get('response_format') or {}
+    if tools:
+        function = tools[0]['function']
+        arguments = json.dumps(sample_from_schema(function.get('parameters', {})), ensure_ascii=False)
+        message = {
+            'role': 'assistant',
+            'content': None,
+            'tool_calls': [{
+                'id': f'call_{uuid.uuid4().hex[:12]}',
+                'type': 'function',
+                'function': {'name': function['name'], 'arguments': arguments},
+            }],
+        }
+        return message, arguments
+    if response_format.get('type') == 'json_schema':
+        content = json.dumps(sample_from_schema(response_format['json_schema'].get('schema', {})), ensure_ascii=False)
+    elif response_format.get('type') == 'json_object':
+        content = json.dumps({'response': SAMPLE_REPLY}, ensure_ascii=False)
+    else:
+        content = SAMPLE_REPLY
+    return {'role': 'assistant', 'content': content}, content
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI()
+    limiter = RateLimiter()
+
+    @app.get('/health')
+    def health():
+        return {'status': 'healthy'}
+
+    @app.post('/api/v1/chat/completions')
+    @app.post('/v1/chat/completions')
+    async def chat_completions(request: Request):
+        body = await request.json()
+        api_key = request.headers.get('authorization', '').removeprefix('Bearer ')
+
+        headers = {}
+        if settings.rate_limit_rpm:
+            allowed, headers = limiter.check(api_key, settings.rate_limit_rpm)
+            if not allowed:
+                return _error(429, 'Rate limit exceeded', headers)
+
+        if settings.error_rate and settings.rng.random() < settings.error_rate:
+            status = settings.rng.choice([500, 502, 503, 429])
+            return _error(status, 'Injected upstream error', {**headers, 'retry-after': '1'} if status == 429 else headers)
+
+        ttft = max(0.0, settings.rng.gauss(settings.latency_ms, settings.jitter_ms)) / 1000
+        message, text = _completion_body(body)
+        prompt_tokens = sum(_tokens(str(m.get('content') or '')) for m in body.get('messages', []))
+        completion_tokens = _tokens(text)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'cost': (prompt_tokens * 2.5 + completion_tokens * 10) / 1_000_000,
+        }
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time.time())
+        model = body.get('model', 'mock')
+
+        if not body.get('stream'):
+            await asyncio.sleep(ttft + completion_tokens / settings.tokens_per_second)
+            return JSONResponse({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'message': message, 'finish_reason': 'tool_calls' if 'tool_calls' in message else 'stop'}],
+                'usage': usage,
+            }, headers=headers)
+
+        include_usage = (body.get('stream_options') or {}).get('include_usage', False)
+
+        async def events():
+            def chunk(delta, finish_reason=None, with_usage=False):
+                data = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': created,
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}] if delta is not None else [],
+                }
+                if with_usage:
+                    data['usage'] = usage
+                return f'data: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+            await asyncio.sleep(ttft)
+            yield chunk({'role': 'assistant', 'content': ''})
+            if 'tool_calls' in message:
+                call = message['tool_calls'][0]
+                yield chunk({'tool_calls': [{'index': 0, 'id': call['id'], 'type': 'function', 'function': {'name': call['function']['name'], 'arguments': ''}}]})
+            piece_size = 4
+            for start in range(0, len(text), piece_size):
+                piece = text[start:start + piece_size]
+                await asyncio.sleep(_tokens(piece) / settings.tokens_per_second)
+                if 'tool_calls' in message:
+                    yield chunk({'tool_calls': [{'index': 0, 'function': {'arguments': piece}}]})
+                else:
+                    yield chunk({'content': piece})
+            yield chunk({}, finish_reason='tool_calls' if 'tool_calls' in message else 'stop')
+            if include_usage:
+                yield chunk(None, with_usage=True)
+            yield 'data: [DONE]\n\n'
+
+        return StreamingResponse(events(), media_type='text/event-stream', headers=headers)
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mock OpenRouter chat-completions server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=800.0, help='mean time to first token')
+    parser.add_argument('--jitter-ms', type=float, default=300.0, help='standard deviation of the time to first token')
+    parser.add_argument('--tokens-per-second', type=float, default=80.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 5xx/429')
+    parser.add_argument('--rate-limit-rpm', type=int, default=0, help='requests per minute per API key, 0 disables')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        rate_limit_rpm=args.rate_limit_rpm,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Cold start profile of the app.
+
+Reports the slowest imports of ``toshokan.frontend.app`` and of the
+dashboard (from ``python -X importtime``), then launches the server and
+measures time-to-healthy (first 200 from /health) and time-to-first-page
+(first 200 from /dashboard/), with and without ``FAST_START``.
+
+    PYTHONPATH=src python -m benchmarks.startup
+    PYTHONPATH=src python -m benchmarks.startup --runs 3 --top 15
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+import httpx
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+STARTUP_ENV = {
+    'ENVIRONMENT': 'local',
+    'APP_HOST': '127.0.0.1',
+    'APP_PORT': '8080',
+    'CODE_VERSION': 'benchmark',
+    'OPENROUTER_API_KEY': 'benchmark-key',
+    'COGNITO_INTEGRATE': 'false',
+}
+
+
+def _env(**overrides) -> dict:
+    env = {**os.environ, **STARTUP_ENV, **overrides}
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(ROOT / 'src'), env.get('PYTHONPATH')]))
+    return env
+
+
+def import_profile(module: str, top: int) -> tuple[float, list[tuple[float, str]]]:
+    """Return total import seconds of *module* and its *top* slowest imports (cumulative)."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=_env(), capture_output=True, text=True, check=True)
+    # lines look like "import time:  self [us] | cumulative | <indent>package"
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(cumulative) / 1e6, depth, name.strip()))
+    total = next((seconds for seconds, _, name in entries if name == module), 0.0)
+    # nested imports are already counted in their parents
+    shallow = [(seconds, name) for seconds, depth, name in entries if depth <= 2]
+    return total, sorted(shallow, reverse=True)[:top]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_startup(fast_start: bool, timeout: float) -> dict:
+    port = _free_port()
+    env = _env(APP_PORT=str(port), FAST_START='true' if fast_start else 'false')
+    base = f'http://127.0.0.1:{port}'
+    started_at = time.monotonic()
+    process = subprocess.Popen([sys.executable, '-m', 'toshokan.frontend.app'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    healthy = first_page = None
+    try:
+        with httpx.Client(timeout=5) as client:
+            while time.monotonic() - started_at < timeout and first_page is None:
+                if process.poll() is not None:
+                    raise RuntimeError(f'app exited with code {process.returncode}')
+                try:
+                    if healthy is None and client.get(f'{base}/health').status_code == 200:
+                        healthy = time.monotonic() - started_at
+                    if healthy is not None and client.get(f'{base}/dashboard/').status_code == 200:
+                        first_page = time.monotonic() - started_at
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.05)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {'time_to_healthy': healthy, 'time_to_first_page': first_page}
+
+
+def _fmt(seconds: float | None) -> str:
+    return f'{seconds:.2f}s' if seconds is not None else 'timeout'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold start profile of the app')
+    parser.add_argument('--runs', type=int, default=1, help='server launches per mode')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--json', type=Path, help='write results to this file')
+    args = parser.parse_args(argv)
+
+    results = {'imports': {}, 'startup': {}}
+    for module in ('toshokan.frontend.app', 'toshokan.frontend.dashboard'):
+        total, slowest = import_profile(module, args.top)
+        results['imports'][module] = {'seconds': total, 'slowest': slowest}
+        print(f'import {module}: {total:.2f}s')
+        for seconds, name in slowest:
+            print(f'  {seconds:>7.3f}s  {name}')
+
+    print(f"\n{'mode':<12} {'healthy':>10} {'first page':>12}")
+    for fast_start in (False, True):
+        mode = 'fast start' if fast_start else 'default'
+        runs = [measure_startup(fast_start, args.timeout) for _ in range(args.runs)]
+        results['startup'][mode] = runs
+        for run in runs:
+            print(f"{mode:<12} {_fmt(run['time_to_healthy']):>10} {_fmt(run['time_to_first_page']):>12}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
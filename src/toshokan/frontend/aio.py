@@ -0,0 +1,53 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future
+
+
+_loop: asyncio.AbstractEventLoop | None = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the background event loop used for provider calls.
+
+    Gradio runs sync handlers in worker threads. Running their model calls
+    on one long-lived loop lets async HTTP clients keep their connections
+    across calls, and lets any thread cancel a call in flight.
+    """
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='llm-event-loop', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def get_loop_if_started() -> asyncio.AbstractEventLoop | None:
+    return _loop
+
+
+async def _in_context(context: contextvars.Context, coro):
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def submit(coro) -> Future:
+    """Schedule *coro* on the background loop; cancelling the future cancels the task.
+
+    The caller's context variables are visible inside the task.
+    """
+    return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), get_loop())
+
+
+def run(coro):
+    """Run *coro* on the background loop and block the calling thread on its result."""
+    future = submit(coro)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
@@ -0,0 +1,356 @@
+"""Versioned JSON API for scripted clients (flashcard generators, reading tools).
+
+The endpoints run the same handlers as the dashboard, so model calls go
+through the gateway, routing and fallbacks like any UI event. Each
+``/batch`` variant takes up to ``API_BATCH_MAX_ITEMS`` items and streams one
+NDJSON line per item as it completes (in completion order, with the item's
+``index``)::
+
+    {"index": 3, "result": {...}, "cached": false}
+    {"index": 0, "error": "...", "status": 503}
+
+Batch items of all requests share ``API_BATCH_CONCURRENCY`` slots and are
+admitted by the gateway after interactive work. Identical items in a batch
+are only computed once, and lookups on models with temperature 0 are
+answered from the caller's cache for ``API_CACHE_SECONDS``.
+
+A failed item is 429 when the provider is throttling, 503 when the gateway
+is overloaded or no model answered in time, 422 for errors in the request
+and 500 for anything else.
+
+Only fastapi and pydantic are imported here; the handlers and their
+dependencies are imported by the first API call, in a worker thread.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from fastapi import APIRouter, Header, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+
+# Items per batch request
+API_BATCH_MAX_ITEMS = int(os.environ.get('API_BATCH_MAX_ITEMS', '500'))
+# Batch items processed at a time across all batch requests; keep it under
+# LLM_GATEWAY_MAX_QUEUE_PER_USER, since a single client's batch can take them all
+API_BATCH_CONCURRENCY = int(os.environ.get('API_BATCH_CONCURRENCY', '4'))
+# Results kept for repeated lookups; each caller only sees their own
+API_CACHE_SIZE = int(os.environ.get('API_CACHE_SIZE', '4096'))
+API_CACHE_SECONDS = float(os.environ.get('API_CACHE_SECONDS', '3600'))
+
+DEFAULT_MODEL_NAME = 'openai/gpt-4o'
+
+
+class ItemFailed(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class ResultCache:
+    """LRU of recent results, keyed by caller, operation, model and item."""
+
+    def __init__(self, max_items: int = API_CACHE_SIZE, ttl: float = API_CACHE_SECONDS):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._results: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: str) -> dict | None:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: dict):
+        self._results[key] = (time.monotonic(), result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_items:
+            self._results.popitem(last=False)
+
+
+result_cache = ResultCache()
+# shared by all batch requests; created with the module, bound to the server's loop on first use
+batch_slots = asyncio.Semaphore(API_BATCH_CONCURRENCY)
+
+
+class WordItem(BaseModel):
+    word: str = Field(min_length=1)
+
+
+class BreakdownItem(BaseModel):
+    sentence: str = Field(min_length=1)
+
+
+class KanjiAnnotationItem(BaseModel):
+    sentence: str = Field(min_length=1)
+    known_kanji: str = ''
+    scheduled_kanji: str = ''
+
+
+class ExerciseItem(BaseModel):
+    lessons: list[str] = []
+    exercise_type: str
+    known_kanji: str = ''
+    scheduled_kanji: str = ''
+    user_input: str = ''
+
+
+class WordRequest(WordItem):
+    model_name: str = DEFAULT_MODEL_NAME
+
+
+class BreakdownRequest(BreakdownItem):
+    model_name: str = DEFAULT_MODEL_NAME
+
+
+class KanjiAnnotationRequest(KanjiAnnotationItem):
+    model_name: str = DEFAULT_MODEL_NAME
+
+
+class ExerciseRequest(ExerciseItem):
+    model_name: str = DEFAULT_MODEL_NAME
+
+
+class WordBatch(BaseModel):
+    items: list[WordItem] = Field(min_length=1, max_length=API_BATCH_MAX_ITEMS)
+    model_name: str = DEFAULT_MODEL_NAME
+
+
+class BreakdownBatch(BaseModel):
+    items: list[BreakdownItem] = Field(min_length=1, max_length=API_BATCH_MAX_ITEMS)
+    model_name: str = DEFAULT_MODEL_NAME
+
+
+class KanjiAnnotationBatch(BaseModel):
+    items: list[KanjiAnnotationItem] = Field(min_length=1, max_length=API_BATCH_MAX_ITEMS)
+    model_name: str = DEFAULT_MODEL_NAME
+
+
+class ExerciseBatch(BaseModel):
+    items: list[ExerciseItem] = Field(min_length=1, max_length=API_BATCH_MAX_ITEMS)
+    model_name: str = DEFAULT_MODEL_NAME
+
+
+def lookup_word(item: WordItem, runtime_config: dict, request, **kwargs) -> dict:
+    from toshokan.frontend.handlers import run_the_word_chat
+
+    messages, _ = run_the_word_chat(item.word, [], runtime_config, request=request, **kwargs)
+    return {'word': item.word, 'explanation': messages[-1].content}
+
+
+def break_down_sentence(item: BreakdownItem, runtime_config: dict, request, **kwargs) -> dict:
+    from toshokan.frontend.handlers import run_the_breakdown_chat
+
+    messages, _ = run_the_breakdown_chat(item.sentence, [], runtime_config, request=request, **kwargs)
+    return {'sentence': item.sentence, 'breakdown': messages[-1].content}
+
+
+def annotate_kanji(item: KanjiAnnotationItem, runtime_config: dict, request, **kwargs) -> dict:
+    from toshokan.frontend.handlers import detect_unknown_kanji
+
+    rows = detect_unknown_kanji(item.sentence, item.known_kanji, item.scheduled_kanji, runtime_config, request=request, **kwargs)
+    return {
+        'sentence': item.sentence,
+        'unknown_kanji': [{'kanji': kanji, 'hiragana': hiragana, 'explanation': explanation} for kanji, hiragana, explanation in rows],
+    }
+
+
+def generate_exercise(item: ExerciseItem, runtime_config: dict, request, **kwargs) -> dict:
+    from toshokan.frontend.handlers import run_the_exercise_initiate
+
+    messages, _ = run_the_exercise_initiate(
+        item.lessons, item.exercise_type, item.known_kanji, item.scheduled_kanji, item.user_input,
+        runtime_config, request=request, **kwargs,
+    )
+    return {'exercise': messages[-1].content}
+
+
+# operation -> (function, whether its results can be reused); exercises are meant to differ every time
+OPERATIONS = {
+    'word': (lookup_word, True),
+    'breakdown': (break_down_sentence, True),
+    'kanji_annotation': (annotate_kanji, True),
+    'exercise': (generate_exercise, False),
+}
+
+
+def _runtime_config(model_name: str, openrouter_api_key: str | None) -> tuple[dict, bool]:
+    """The handlers' runtime config, and whether the model's answers are deterministic."""
+    from toshokan.frontend.models import MODEL_SPECS, ensure_openrouter_api_key
+
+    if model_name not in MODEL_SPECS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f'Unknown model {model_name!r}')
+    runtime_config = {'model_name': model_name, 'openrouter_api_key': openrouter_api_key}
+    if not ensure_openrouter_api_key(runtime_config):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Openrouter API key is not set')
+    _, temperature = MODEL_SPECS[model_name]
+    return runtime_config, temperature == 0.0
+
+
+def _cache_scope(runtime_config: dict, http_request: Request) -> str:
+    """Whose cached results a request may reuse: those of the same user with the same OpenRouter key."""
+    import gradio as gr
+    from toshokan.frontend.models import resolve_api_key
+    from toshokan.frontend.session import get_user_id
+
+    user_id = get_user_id(gr.Request(request=http_request))
+    return hashlib.sha256(f'{user_id}\0{resolve_api_key(runtime_config)}'.encode()).hexdigest()[:16]
+
+
+def _failure_status(error: BaseException | None) -> int:
+    """HTTP status of a failed item, from the error the model call raised."""
+    from toshokan.frontend.gateway import GatewayOverloaded
+    from toshokan.frontend.resilience import DeadlineExceeded
+    from toshokan.frontend.throttling import ProviderThrottled
+
+    if isinstance(error, ProviderThrottled):
+        return status.HTTP_429_TOO_MANY_REQUESTS
+    if isinstance(error, (GatewayOverloaded, DeadlineExceeded)):
+        return status.HTTP_503_SERVICE_UNAVAILABLE
+    return status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def _run_item(operation: str, item: BaseModel, runtime_config: dict, http_request: Request, batch: bool = False) -> dict:
+    import gradio as gr
+    from toshokan.frontend.gateway import Priority
+
+    fn, _ = OPERATIONS[operation]
+    # no session hash: API calls are never deduplicated or superseded like a tab's,
+    # but the gateway still sees the signed-in user
+    request = gr.Request(request=http_request)
+    try:
+        return fn(item, runtime_config, request, **({'priority': Priority.SPECULATIVE} if batch else {}))
+    except gr.Error as e:
+        # llm.invoke raises overload, deadline and throttling errors from the original
+        raise ItemFailed(e.message, _failure_status(e.__cause__))
+    except Exception as e:
+        logging.exception(f'API {operation} item failed')
+        raise ItemFailed(f'{operation} failed: {type(e).__name__}', status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _cache_key(scope: str, operation: str, model_name: str, item: BaseModel) -> str:
+    return json.dumps([scope, operation, model_name, item.model_dump()], ensure_ascii=False, sort_keys=True)
+
+
+async def _run_one(operation: str, item: BaseModel, model_name: str, openrouter_api_key: str | None, http_request: Request) -> dict:
+    runtime_config, deterministic = await run_in_threadpool(_runtime_config, model_name, openrouter_api_key)
+    reusable = deterministic and OPERATIONS[operation][1]
+    key = None
+    if reusable:
+        scope = await run_in_threadpool(_cache_scope, runtime_config, http_request)
+        key = _cache_key(scope, operation, model_name, item)
+    if key is not None and (cached := result_cache.get(key)) is not None:
+        return cached
+    try:
+        result = await run_in_threadpool(_run_item, operation, item, runtime_config, http_request)
+    except ItemFailed as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    if key is not None:
+        result_cache.put(key, result)
+    return result
+
+
+async def _stream_batch(operation: str, items: list[BaseModel], runtime_config: dict, scope: str | None, http_request: Request):
+    # identical items share one computation
+    computations: dict[str, asyncio.Future] = {}
+
+    async def compute(item):
+        async with batch_slots:
+            return await run_in_threadpool(_run_item, operation, item, runtime_config, http_request, batch=True)
+
+    async def process(index, item):
+        key = _cache_key(scope, operation, runtime_config['model_name'], item) if scope is not None else None
+        if key is None:
+            computation = asyncio.ensure_future(compute(item))
+        elif (cached := result_cache.get(key)) is not None:
+            return {'index': index, 'result': cached, 'cached': True}
+        elif (computation := computations.get(key)) is None:
+            computation = computations[key] = asyncio.ensure_future(compute(item))
+        try:
+            result = await computation
+        except ItemFailed as e:
+            return {'index': index, 'error': e.message, 'status': e.status_code}
+        if key is not None:
+            result_cache.put(key, result)
+        return {'index': index, 'result': result, 'cached': False}
+
+    tasks = [asyncio.ensure_future(process(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done, ensure_ascii=False) + '\n'
+    finally:
+        # the client went away: drop the items that haven't started
+        for task in [*tasks, *computations.values()]:
+            task.cancel()
+
+
+async def _batch_response(operation: str, batch, openrouter_api_key: str | None, http_request: Request) -> StreamingResponse:
+    runtime_config, deterministic = await run_in_threadpool(_runtime_config, batch.model_name, openrouter_api_key)
+    # the caller's cache, when the operation's results can be reused at all
+    scope = None
+    if deterministic and OPERATIONS[operation][1]:
+        scope = await run_in_threadpool(_cache_scope, runtime_config, http_request)
+    logging.info(f'API {operation} batch of {len(batch.items)} items')
+    return StreamingResponse(
+        _stream_batch(operation, batch.items, runtime_config, scope, http_request),
+        media_type='application/x-ndjson',
+    )
+
+
+router = APIRouter(prefix='/api/v1', tags=['api'])
+
+# The user's own OpenRouter key; the server-wide key is used without it
+OpenRouterKey = Header(None, alias='X-OpenRouter-Key')
+
+
+@router.post('/word')
+async def word(body: WordRequest, request: Request, openrouter_api_key: str | None = OpenRouterKey):
+    return await _run_one('word', WordItem(word=body.word), body.model_name, openrouter_api_key, request)
+
+
+@router.post('/word/batch')
+async def word_batch(body: WordBatch, request: Request, openrouter_api_key: str | None = OpenRouterKey):
+    return await _batch_response('word', body, openrouter_api_key, request)
+
+
+@router.post('/breakdown')
+async def breakdown(body: BreakdownRequest, request: Request, openrouter_api_key: str | None = OpenRouterKey):
+    return await _run_one('breakdown', BreakdownItem(sentence=body.sentence), body.model_name, openrouter_api_key, request)
+
+
+@router.post('/breakdown/batch')
+async def breakdown_batch(body: BreakdownBatch, request: Request, openrouter_api_key: str | None = OpenRouterKey):
+    return await _batch_response('breakdown', body, openrouter_api_key, request)
+
+
+@router.post('/kanji/annotate')
+async def kanji_annotation(body: KanjiAnnotationRequest, request: Request, openrouter_api_key: str | None = OpenRouterKey):
+    item = KanjiAnnotationItem(sentence=body.sentence, known_kanji=body.known_kanji, scheduled_kanji=body.scheduled_kanji)
+    return await _run_one('kanji_annotation', item, body.model_name, openrouter_api_key, request)
+
+
+@router.post('/kanji/annotate/batch')
+async def kanji_annotation_batch(body: KanjiAnnotationBatch, request: Request, openrouter_api_key: str | None = OpenRouterKey):
+    return await _batch_response('kanji_annotation', body, openrouter_api_key, request)
+
+
+@router.post('/exercises')
+async def exercise(body: ExerciseRequest, request: Request, openrouter_api_key: str | None = OpenRouterKey):
+    item = ExerciseItem(**body.model_dump(exclude={'model_name'}))
+    return await _run_one('exercise', item, body.model_name, openrouter_api_key, request)
+
+
+@router.post('/exercises/batch')
+async def exercise_batch(body: ExerciseBatch, request: Request, openrouter_api_key: str | None = OpenRouterKey):
+    return await _batch_response('exercise', body, openrouter_api_key, request)
@@ -1,15 +1,30 @@
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv())
 
-import gradio as gr
 import os
+import asyncio
 import httpx
 import uvicorn
 import logging
-from fastapi import FastAPI, Response, Request, status
-from fastapi.responses import RedirectResponse, FileResponse
-from toshokan.frontend.middleware.auth import AuthMiddleware, COGNITO_INTEGRATE
-from toshokan.frontend.dashboard import dashboard
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Response, Request, status
+from fastapi.responses import RedirectResponse, FileResponse, PlainTextResponse
+from toshokan.frontend.middleware.auth import AuthMiddleware, COGNITO_INTEGRATE, require_api_access
+from toshokan.frontend.middleware.static import StaticAssetsMiddleware, STATIC_ASSETS_ENABLED
+from toshokan.frontend.middleware.tracing import TracingMiddleware
+from toshokan.frontend.api import router as api_router
+from toshokan.frontend.tracing import configure_tracing
+from toshokan.frontend.startup import FAST_START, DeferredMount
+from toshokan.frontend.readiness import loop_lag_monitor, warm_model_clients, warm_token_encoding
+from toshokan.frontend.profiling import (
+    PROFILING_MAX_SECONDS,
+    MIN_INTERVAL_SECONDS,
+    ProfilerBusy,
+    allocation_snapshot,
+    folded,
+    is_admin,
+    sample_stacks,
+)
 
 # Load env variables
 ENVIRONMENT = os.environ['ENVIRONMENT']
@@ -22,8 +37,39 @@ if COGNITO_INTEGRATE:
     REDIRECT_URI_LOGIN = os.environ['COGNITO_DOMAIN_REDIRECT_URI_LOGIN']
     REDIRECT_URI_LOGOUT = os.environ['COGNITO_DOMAIN_REDIRECT_URI_LOGOUT']
 
+DASHBOARD_PATH = '/dashboard'
+
+deferred_dashboard = DeferredMount()
+# set once the dashboard has been built
+dashboard_blocks = None
+
+
+def mount_dashboard(app: FastAPI) -> FastAPI:
+    # gradio and the handlers' dependencies make up most of the startup time,
+    # so they're only imported here
+    import gradio as gr
+    from toshokan.frontend.dashboard import build_dashboard
+
+    global dashboard_blocks
+    dashboard_blocks = build_dashboard()
+    return gr.mount_gradio_app(app, dashboard_blocks, path=DASHBOARD_PATH, favicon_path='/dashboard/favicon.ico', allowed_paths=['/dashboard/output'])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_lag_monitor.start()
+    if FAST_START:
+        deferred_dashboard.start(lambda: mount_dashboard(FastAPI()), DASHBOARD_PATH)
+    warming = asyncio.gather(asyncio.to_thread(warm_model_clients), asyncio.to_thread(warm_token_encoding))
+    yield
+    await deferred_dashboard.close()
+    await loop_lag_monitor.stop()
+    await asyncio.gather(warming, return_exceptions=True)
+
+
 # Session management
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.include_router(api_router, dependencies=[Depends(require_api_access)])
 
 
 @app.get("/health")
@@ -31,6 +77,78 @@ def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """503 while the instance is saturated; thresholds are the READY_* settings."""
+    from toshokan.frontend.readiness import check
+
+    dashboard_ready = deferred_dashboard.ready if FAST_START else dashboard_blocks is not None
+    report = await check(dashboard_ready, dashboard_blocks)
+    if not report['ready']:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return report
+
+
+@app.get("/metrics", dependencies=[Depends(require_api_access)])
+def metrics_report():
+    from toshokan.frontend import cassettes
+    from toshokan.frontend.compaction import prompt_savings
+    from toshokan.frontend.gateway import gateway
+    from toshokan.frontend.metrics import metrics
+    from toshokan.frontend.models import model_pool
+    from toshokan.frontend.routing import task_usage
+    from toshokan.frontend.queues import queue_stats
+    from toshokan.frontend.throttling import provider_limits
+    from toshokan.frontend.transport import shared_transport
+
+    return {
+        "gateway": gateway.stats(),
+        "queues": queue_stats(dashboard_blocks) if dashboard_blocks is not None else {},
+        "model_pool": model_pool.stats(),
+        "http": shared_transport.stats(),
+        "provider_limits": provider_limits.stats(),
+        "tasks": task_usage.report(),
+        "prompts": prompt_savings.report(),
+        **({"cassette": cassettes.cassette.stats()} if cassettes.cassette is not None else {}),
+        **metrics.snapshot(),
+    }
+
+
+def require_admin(request: Request):
+    if not is_admin(getattr(request.state, 'session_info', None)):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+async def profile_cpu(
+    request: Request,
+    seconds: float = Query(10, gt=0, le=PROFILING_MAX_SECONDS),
+    interval_ms: float = Query(10, ge=MIN_INTERVAL_SECONDS * 1000, le=1000),
+):
+    """Sample all threads for *seconds*; returns folded stacks for a flame graph."""
+    require_admin(request)
+    try:
+        stacks, rounds = await asyncio.to_thread(sample_stacks, seconds, interval_ms / 1000)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    logging.info(f'Profiled {rounds} samples over {seconds}s')
+    return PlainTextResponse(folded(stacks), headers={"X-Profile-Samples": str(rounds)})
+
+
+@app.get("/admin/profile/memory")
+async def profile_memory(
+    request: Request,
+    seconds: float = Query(10, gt=0, le=PROFILING_MAX_SECONDS),
+    limit: int = Query(50, gt=0, le=1000),
+):
+    """Allocations made during *seconds* and still alive, by call site."""
+    require_admin(request)
+    try:
+        return await asyncio.to_thread(allocation_snapshot, seconds, limit)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
 if COGNITO_INTEGRATE:
     @app.get("/login")
     async def login():
@@ -166,7 +284,16 @@ def go_to_dashboard():
 if __name__ == '__main__':
     if COGNITO_INTEGRATE:
         app.add_middleware(AuthMiddleware)
-    gr.mount_gradio_app(app, dashboard, path='/dashboard', favicon_path='/dashboard/favicon.ico', allowed_paths=['/dashboard/output'])
+    # outside the auth checks, so cached assets are served without them
+    if STATIC_ASSETS_ENABLED:
+        app.add_middleware(StaticAssetsMiddleware, prefix=DASHBOARD_PATH)
+    # added last so that it wraps the auth checks too
+    if configure_tracing():
+        app.add_middleware(TracingMiddleware)
+    if FAST_START:
+        app.mount(DASHBOARD_PATH, deferred_dashboard)
+    else:
+        mount_dashboard(app)
 
     if ENVIRONMENT == 'local':
         if 'LOCAL_CERT_PATH' in os.environ:
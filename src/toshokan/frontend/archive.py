@@ -0,0 +1,262 @@
+"""Export format for configuration and exercise progress.
+
+An archive is a sequence of gzip members, each holding newline-delimited
+JSON records. ``gzip`` reads concatenated members as one stream, so an
+export can be extended by appending members without rewriting the file.
+The first record is a header::
+
+    {"format": "toshokan", "kind": "exercise_progress", "version": 1}
+
+Exercise progress records carry the messages of one exercise starting at
+an offset, so later exports only append what's new:
+
+    {"k": <exercise key>, "o": <offset>, "m": [["u", "..."], ["a", "..."]]}
+    {"k": <exercise key>, "d": 1}          # exercise removed
+    {"k": <key>, "v": <value>}             # anything that isn't a chat
+
+Configuration records are ``{"k": <config key>, "v": <value>}``.
+"""
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Iterator
+from gradio_agentchatbot_5 import ChatMessage
+
+
+FORMAT_NAME = 'toshokan'
+FORMAT_VERSION = 1
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'toshokan_exports'))
+# Appended members before an export is rewritten from scratch
+EXPORT_MAX_CHUNKS = int(os.environ.get('EXPORT_MAX_CHUNKS', 32))
+# Sessions whose last export is remembered for incremental saves
+EXPORT_MAX_SESSIONS = int(os.environ.get('EXPORT_MAX_SESSIONS', 1024))
+
+CHUNK_BYTES = 256 * 1024
+MESSAGES_PER_RECORD = 256
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+ROLE_CODES = {'user': 'u', 'assistant': 'a'}
+ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def encode_message(message) -> list | dict:
+    """``[role code, content]``, plus the thought metadata when it's set."""
+    if not isinstance(message, ChatMessage):
+        # already serialized (dicts from older states)
+        return message
+    thought = message.thought_metadata
+    if thought.tool_name is None and not thought.error:
+        return [ROLE_CODES[message.role], message.content]
+    return [ROLE_CODES[message.role], message.content, {'tool_name': thought.tool_name, 'error': thought.error}]
+
+
+def decode_message(record: list | dict) -> ChatMessage:
+    if isinstance(record, dict):
+        return ChatMessage(role=record['role'], content=record['content'], metadata=record.get('metadata', {}))
+    if len(record) > 2:
+        return ChatMessage(role=ROLES[record[0]], content=record[1], thought_metadata=record[2])
+    return ChatMessage(role=ROLES[record[0]], content=record[1])
+
+
+def is_archive(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(2) == GZIP_MAGIC
+
+
+class ArchiveWriter:
+    """Buffers records and writes them out as gzip members of about CHUNK_BYTES."""
+
+    def __init__(self, file):
+        self._file = file
+        self._buffer: list[bytes] = []
+        self._size = 0
+        self.chunks = 0
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+        self._buffer.append(line)
+        self._size += len(line)
+        if self._size >= CHUNK_BYTES:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self._file.write(gzip.compress(b''.join(self._buffer), compresslevel=6))
+        self._buffer.clear()
+        self._size = 0
+        self.chunks += 1
+
+
+def _header(kind: str) -> dict:
+    return {'format': FORMAT_NAME, 'kind': kind, 'version': FORMAT_VERSION}
+
+
+def read_records(path: str, kind: str) -> Iterator[dict]:
+    """Yield the records of an archive after checking its header."""
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        header = json.loads(file.readline() or 'null')
+        if not isinstance(header, dict) or header.get('format') != FORMAT_NAME:
+            raise ArchiveError('Not a Toshokan export')
+        if header.get('kind') != kind:
+            raise ArchiveError(f"Expected a {kind} export, got {header.get('kind')}")
+        if header.get('version', 0) > FORMAT_VERSION:
+            raise ArchiveError(f"Export version {header['version']} is newer than this app supports")
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_config(path: str, config: dict):
+    with open(path, 'wb') as file:
+        writer = ArchiveWriter(file)
+        writer.write(_header('config'))
+        for key, value in config.items():
+            writer.write({'k': key, 'v': value})
+        writer.flush()
+
+
+def read_config(path: str) -> dict:
+    return {record['k']: record['v'] for record in read_records(path, 'config')}
+
+
+def read_exercise_progress(path: str) -> dict:
+    state = {}
+    for record in read_records(path, 'exercise_progress'):
+        key = record['k']
+        if record.get('d'):
+            state.pop(key, None)
+        elif 'm' in record:
+            messages = state.get(key) if record['o'] else None
+            messages = (messages or [])[:record['o']]
+            messages.extend(decode_message(message) for message in record['m'])
+            state[key] = messages
+        else:
+            state[key] = record['v']
+    return state
+
+
+def session_export_dir(session_id: str, export_dir: str = EXPORT_DIR) -> str:
+    path = os.path.join(export_dir, re.sub(r'[^A-Za-z0-9_-]', '_', session_id) or 'default')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _fingerprint(message) -> int:
+    if isinstance(message, ChatMessage):
+        return hash((message.role, message.content))
+    return hash(json.dumps(message, sort_keys=True, default=str))
+
+
+def _position(value) -> tuple[int, int]:
+    if not isinstance(value, list):
+        return -1, _fingerprint(value)
+    return len(value), _fingerprint(value[-1]) if value else 0
+
+
+class _ExportCursor:
+    """What the last export of a session contained, per exercise."""
+
+    __slots__ = ('path', 'chunks', 'exercises')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.chunks = 0
+        # key -> (message count, fingerprint of the last message); count is -1 for non-chat values
+        self.exercises: dict[str, tuple[int, int]] = {}
+
+
+def _write_exercise(writer: ArchiveWriter, key: str, messages: list, offset: int):
+    if not messages:
+        writer.write({'k': key, 'o': 0, 'm': []})
+    for start in range(offset, len(messages), MESSAGES_PER_RECORD):
+        chunk = messages[start:start + MESSAGES_PER_RECORD]
+        writer.write({'k': key, 'o': start, 'm': [encode_message(message) for message in chunk]})
+
+
+class ExerciseProgressExporter:
+    """Writes exercise progress exports, appending to the session's last one when possible."""
+
+    def __init__(self, export_dir: str = EXPORT_DIR, max_sessions: int = EXPORT_MAX_SESSIONS, max_chunks: int = EXPORT_MAX_CHUNKS):
+        self.export_dir = export_dir
+        self.max_sessions = max_sessions
+        self.max_chunks = max_chunks
+        self._lock = threading.Lock()
+        self._cursors: OrderedDict[str, _ExportCursor] = OrderedDict()
+
+    def _cursor(self, session_id: str, path: str) -> _ExportCursor | None:
+        with self._lock:
+            cursor = self._cursors.get(session_id)
+            if cursor is not None:
+                self._cursors.move_to_end(session_id)
+                if cursor.path == path and os.path.exists(path) and cursor.chunks < self.max_chunks:
+                    return cursor
+            return None
+
+    def _remember(self, session_id: str, cursor: _ExportCursor):
+        with self._lock:
+            self._cursors[session_id] = cursor
+            self._cursors.move_to_end(session_id)
+            while len(self._cursors) > self.max_sessions:
+                _, evicted = self._cursors.popitem(last=False)
+                shutil.rmtree(os.path.dirname(evicted.path), ignore_errors=True)
+
+    def export(self, exercise_state: dict, session_id: str) -> str:
+        path = os.path.join(session_export_dir(session_id, self.export_dir), 'toshokan_exercise_progress.jsonl.gz')
+        cursor = self._cursor(session_id, path)
+        if cursor is None:
+            return self._export_full(exercise_state, session_id, path)
+
+        exercises = {}
+        with open(path, 'ab') as file:
+            writer = ArchiveWriter(file)
+            for key in cursor.exercises.keys() - exercise_state.keys():
+                writer.write({'k': key, 'd': 1})
+            for key, value in exercise_state.items():
+                exercises[key] = _position(value)
+                if exercises[key] == cursor.exercises.get(key):
+                    continue
+                if not isinstance(value, list):
+                    writer.write({'k': key, 'v': value})
+                    continue
+                offset = 0
+                count, fingerprint = cursor.exercises.get(key, (0, 0))
+                if 0 < count <= len(value) and _fingerprint(value[count - 1]) == fingerprint:
+                    offset = count
+                _write_exercise(writer, key, value, offset)
+            writer.flush()
+        cursor.chunks += writer.chunks
+        cursor.exercises = exercises
+        self._remember(session_id, cursor)
+        return path
+
+    def _export_full(self, exercise_state: dict, session_id: str, path: str) -> str:
+        cursor = _ExportCursor(path)
+        partial = path + '.partial'
+        with open(partial, 'wb') as file:
+            writer = ArchiveWriter(file)
+            writer.write(_header('exercise_progress'))
+            for key, value in exercise_state.items():
+                if isinstance(value, list):
+                    _write_exercise(writer, key, value, 0)
+                else:
+                    writer.write({'k': key, 'v': value})
+                cursor.exercises[key] = _position(value)
+            writer.flush()
+        os.replace(partial, path)
+        self._remember(session_id, cursor)
+        return path
+
+
+exercise_progress_exporter = ExerciseProgressExporter()
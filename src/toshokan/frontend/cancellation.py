@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+from typing import Callable
+import gradio as gr
+from toshokan.frontend.metrics import metrics
+from toshokan.frontend.routing import task_usage
+
+
+# Identical calls of a session started within this many seconds share one
+# response instead of calling the model twice (double clicks, client retries)
+LLM_DEDUPE_WINDOW_SECONDS = float(os.environ.get('LLM_DEDUPE_WINDOW_SECONDS', '2'))
+
+# Tasks answering the same view. A new call on a channel supersedes the
+# session's previous one on it; other tasks are their own channel.
+TASK_CHANNELS = {
+    'conversation_annotated': 'conversation',
+    'kanji_listing': 'conversation',
+    'kanji_annotation': 'conversation',
+}
+
+
+class CallCancelled(gr.Error):
+    """The learner moved on; the event's outputs are no longer wanted, so nothing is shown."""
+
+    def __init__(self, reason: str):
+        super().__init__(f'Request cancelled ({reason})', visible=False, print_exception=False)
+        self.reason = reason
+
+
+def fingerprint(messages, *extra) -> int:
+    """Identity of a call's input, to recognize duplicate submits."""
+    return hash((tuple((message.type, str(message.content)) for message in messages), *extra))
+
+
+class _Call:
+    __slots__ = ('task', 'fingerprint', 'started_at', 'outcome', 'future', 'cancel_reason')
+
+    def __init__(self, task: str, fingerprint: int, started_at: float):
+        self.task = task
+        self.fingerprint = fingerprint
+        self.started_at = started_at
+        # shared with the duplicates that joined this call
+        self.outcome = Future()
+        # the provider call on the background loop, once admitted by the gateway
+        self.future: Future | None = None
+        self.cancel_reason: str | None = None
+
+    def stale(self, now: float, window: float) -> bool:
+        return self.outcome.done() and now - self.started_at >= window
+
+
+class InflightCalls:
+    """The latest model call of every session and channel.
+
+    Starting a call cancels the session's previous call on the same channel
+    (``superseded``), unless it has the same input and started within the
+    dedupe window, in which case the new call waits for its response
+    instead. Cancelling a call cancels its task on the background loop,
+    which closes the HTTP request to the provider.
+    """
+
+    def __init__(self, dedupe_window: float = LLM_DEDUPE_WINDOW_SECONDS):
+        self.dedupe_window = dedupe_window
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[str, dict[str, _Call]] = OrderedDict()
+
+    def begin(self, session_id: str, task: str, fingerprint: int) -> tuple[_Call, bool]:
+        """Register a call; returns it and whether it's a duplicate of a running or recent one."""
+        channel = TASK_CHANNELS.get(task, task)
+        now = time.monotonic()
+        with self._lock:
+            calls = self._sessions.setdefault(session_id, {})
+            self._sessions.move_to_end(session_id)
+            previous = calls.get(channel)
+            if (
+                previous is not None
+                and previous.fingerprint == fingerprint
+                and previous.cancel_reason is None
+                and now - previous.started_at < self.dedupe_window
+                and not (previous.outcome.done() and previous.outcome.exception() is not None)
+            ):
+                metrics.inc('llm_deduplicated_total', task=task)
+                metrics.inc('llm_tokens_saved_total', task_usage.average_tokens(task), task=task, reason='duplicate')
+                return previous, True
+            call = calls[channel] = _Call(task, fingerprint, now)
+            self._prune(now)
+        if previous is not None:
+            self._cancel(previous, 'superseded')
+        return call, False
+
+    def run(self, call: _Call, start: Callable[[], Future]):
+        """Start *call* with *start* unless it was cancelled meanwhile, and block on its result.
+
+        Errors are raised without settling the call's outcome: the caller
+        turns them into what the learner sees and passes that on with
+        :meth:`fail`, so the duplicates get the same error.
+        """
+        with self._lock:
+            if call.cancel_reason is None:
+                call.future = start()
+        if call.future is None:
+            raise CallCancelled(call.cancel_reason)
+        try:
+            result = call.future.result()
+        except CancelledError:
+            raise CallCancelled(call.cancel_reason or 'cancelled') from None
+        except BaseException:
+            call.future.cancel()
+            raise
+        call.outcome.set_result(result)
+        return result
+
+    @staticmethod
+    def fail(call: _Call, error: BaseException) -> BaseException:
+        """Pass *error* on to the duplicates waiting for *call*, unless it already has an outcome."""
+        if not call.outcome.done():
+            call.outcome.set_exception(error)
+        return error
+
+    def cancel(self, session_id: str, reason: str, channels: tuple[str, ...] | None = None, forget: bool = False) -> int:
+        """Cancel the session's running calls, on *channels* or all of them."""
+        with self._lock:
+            calls = self._sessions.pop(session_id, {}) if forget else dict(self._sessions.get(session_id, {}))
+        return sum(
+            self._cancel(call, reason)
+            for channel, call in calls.items()
+            if channels is None or channel in channels
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = sum(not call.outcome.done() for calls in self._sessions.values() for call in calls.values())
+            return {'sessions': len(self._sessions), 'running': running}
+
+    def _cancel(self, call: _Call, reason: str) -> bool:
+        with self._lock:
+            if call.cancel_reason is not None or call.outcome.done():
+                return False
+            call.cancel_reason = reason
+            future = call.future
+        if future is not None and not future.cancel():
+            # it finished just now
+            return False
+        metrics.inc('llm_cancelled_total', task=call.task, reason=reason)
+        # a call still waiting for a gateway slot never sent its prompt
+        saved = task_usage.average_tokens(call.task, output_only=future is not None)
+        metrics.inc('llm_tokens_saved_total', saved, task=call.task, reason=reason)
+        return True
+
+    def _prune(self, now: float):
+        while self._sessions:
+            session_id, calls = next(iter(self._sessions.items()))
+            if not all(call.stale(now, self.dedupe_window) for call in calls.values()):
+                break
+            del self._sessions[session_id]
+
+
+inflight_calls = InflightCalls()
+
+
+def session_id_of(request: gr.Request | None) -> str | None:
+    """Calls are tracked per browser tab; calls without a Gradio session aren't tracked."""
+    if request is None:
+        return None
+    return request.session_hash
@@ -0,0 +1,395 @@
+"""Record and replay of the model clients' HTTP traffic.
+
+With ``LLM_CASSETTE_MODE=record`` every model call that goes through the
+shared transport is sent as usual and appended to the cassette
+``LLM_CASSETTE_PATH`` (JSON lines): the request, the response's status and
+headers, its body chunks with the time each one arrived (streamed responses
+included), and the token usage the provider reported.
+
+With ``LLM_CASSETTE_MODE=replay`` nothing goes to the network. Each call is
+answered from the cassette with its recorded timing multiplied by
+``LLM_CASSETTE_TIME_SCALE`` (0 answers at once), so the same user journey
+can be run again and again, offline, with the same answers and latencies.
+
+Calls match on method, path and JSON body (with sorted keys); headers, and
+so API keys, don't count. A call made several times gets its recordings in
+the order they were made. With ``LLM_CASSETTE_MATCH=sequence``, a call that
+has no recording (because a prompt changed) gets the next unused recording
+for the same model and response format. Calls without a recording are
+answered with a 404 naming the cassette.
+
+Summarize a cassette, or compare two::
+
+    python -m toshokan.frontend.cassettes journeys.jsonl [after.jsonl]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+import httpx
+
+
+# off, record or replay
+LLM_CASSETTE_MODE = os.environ.get('LLM_CASSETTE_MODE', 'off').lower()
+LLM_CASSETTE_PATH = os.environ.get('LLM_CASSETTE_PATH', 'llm_cassette.jsonl')
+# Multiplies the recorded delays on replay; 0 replays without delays
+LLM_CASSETTE_TIME_SCALE = float(os.environ.get('LLM_CASSETTE_TIME_SCALE', '1'))
+# exact, or sequence to fall back to the next recording of the same model and format
+LLM_CASSETTE_MATCH = os.environ.get('LLM_CASSETTE_MATCH', 'exact').lower()
+
+# never written to a cassette
+PRIVATE_HEADERS = frozenset({'set-cookie', 'authorization', 'cf-ray'})
+
+
+def _request_body(request: httpx.Request):
+    try:
+        return json.loads(request.content or b'null')
+    except ValueError:
+        return None
+
+
+def request_key(method: str, path: str, body) -> str:
+    canonical = json.dumps([method, path, body], sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+def request_shape(body) -> str:
+    """The model and the form of the answer asked for, without the prompt."""
+    if not isinstance(body, dict):
+        return ''
+    response_format = body.get('response_format') or {}
+    schema = (response_format.get('json_schema') or {}).get('name') or response_format.get('type')
+    tools = sorted((tool.get('function') or {}).get('name', '') for tool in body.get('tools') or ())
+    return json.dumps([body.get('model'), bool(body.get('stream')), schema, tools])
+
+
+def _usage_of(body: bytes) -> dict | None:
+    """The usage block of a JSON or server-sent event body (the last one reported)."""
+    text = body.decode('utf-8', errors='replace')
+    documents = [line[len('data:'):].strip() for line in text.splitlines() if line.startswith('data:')] or [text]
+    usage = None
+    for document in documents:
+        try:
+            parsed = json.loads(document)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict) and parsed.get('usage'):
+            usage = parsed['usage']
+    return usage
+
+
+def _encode_chunk(offset: float, chunk: bytes) -> list:
+    try:
+        return [round(offset, 4), chunk.decode('utf-8')]
+    except UnicodeDecodeError:
+        # a chunk can end inside a multi-byte character
+        return [round(offset, 4), None, base64.b64encode(chunk).decode()]
+
+
+def _decode_chunk(encoded: list) -> tuple[float, bytes]:
+    if len(encoded) > 2:
+        return encoded[0], base64.b64decode(encoded[2])
+    return encoded[0], encoded[1].encode('utf-8')
+
+
+class Cassette:
+    """The recordings of one cassette file."""
+
+    def __init__(self, path: str = LLM_CASSETTE_PATH, match: str = LLM_CASSETTE_MATCH):
+        self.path = path
+        self.match = match
+        self._lock = threading.Lock()
+        self._by_key: dict[str, list[dict]] = defaultdict(list)
+        self._by_shape: dict[str, list[dict]] = defaultdict(list)
+        self._next_of_key: dict[str, int] = defaultdict(int)
+        self._used: set[int] = set()
+        self._loaded = 0
+        self.recorded = self.replayed = self.sequence_matches = self.misses = 0
+
+    def load(self) -> 'Cassette':
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    self._add(json.loads(line))
+        return self
+
+    def _add(self, entry: dict):
+        entry['_id'] = self._loaded
+        self._loaded += 1
+        self._by_key[entry['key']].append(entry)
+        self._by_shape[entry['shape']].append(entry)
+
+    def entries(self) -> list[dict]:
+        with self._lock:
+            return sorted((entry for entries in self._by_key.values() for entry in entries), key=lambda entry: entry['_id'])
+
+    def append(self, entry: dict):
+        with self._lock:
+            # one line per call, flushed, so an interrupted run keeps what it recorded
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.recorded += 1
+
+    def take(self, key: str, shape: str) -> dict | None:
+        with self._lock:
+            recordings = self._by_key.get(key)
+            if recordings:
+                # repeated calls get the recordings in order, then the last one again
+                index = min(self._next_of_key[key], len(recordings) - 1)
+                self._next_of_key[key] += 1
+                entry = recordings[index]
+                self._used.add(entry['_id'])
+                self.replayed += 1
+                return entry
+            if self.match == 'sequence':
+                for entry in self._by_shape.get(shape, ()):
+                    if entry['_id'] not in self._used:
+                        self._used.add(entry['_id'])
+                        self.sequence_matches += 1
+                        self.replayed += 1
+                        return entry
+            self.misses += 1
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'path': self.path,
+                'recorded': self.recorded,
+                'replayed': self.replayed,
+                'sequence_matches': self.sequence_matches,
+                'misses': self.misses,
+            }
+
+
+class _RecordingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Passes the response body through, noting when each chunk arrived."""
+
+    def __init__(self, stream, started_at: float, on_complete):
+        self._stream = stream
+        self._started_at = started_at
+        self._on_complete = on_complete
+        self._chunks: list[tuple[float, bytes]] = []
+        self._complete = False
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._chunks.append((time.monotonic() - self._started_at, chunk))
+            yield chunk
+        self._complete = True
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._chunks.append((time.monotonic() - self._started_at, chunk))
+            yield chunk
+        self._complete = True
+
+    def _finish(self):
+        # a body that wasn't read to the end (a cancelled call) isn't recorded
+        if self._complete:
+            self._complete = False
+            self._on_complete(self._chunks)
+
+    def close(self):
+        self._stream.close()
+        self._finish()
+
+    async def aclose(self):
+        await self._stream.aclose()
+        self._finish()
+
+
+class _ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    def __init__(self, chunks: list[tuple[float, bytes]], started_at: float, time_scale: float):
+        self._chunks = chunks
+        self._started_at = started_at
+        self._time_scale = time_scale
+
+    def _delay(self, offset: float) -> float:
+        return self._started_at + offset * self._time_scale - time.monotonic()
+
+    def __iter__(self):
+        for offset, chunk in self._chunks:
+            delay = self._delay(offset)
+            if delay > 0:
+                time.sleep(delay)
+            yield chunk
+
+    async def __aiter__(self):
+        for offset, chunk in self._chunks:
+            delay = self._delay(offset)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield chunk
+
+
+class CassetteTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Records the calls sent through *inner*, or replays them without it.
+
+    *inner* is an ``httpx.HTTPTransport`` or ``httpx.AsyncHTTPTransport``;
+    only calls with a JSON body (the model calls) use the cassette.
+    """
+
+    def __init__(self, cassette: Cassette, mode: str, inner=None, time_scale: float = LLM_CASSETTE_TIME_SCALE):
+        self.cassette = cassette
+        self.mode = mode
+        self.inner = inner
+        self.time_scale = time_scale
+
+    def _miss(self, request: httpx.Request) -> httpx.Response:
+        message = f'No recording in the cassette {self.cassette.path} for {request.method} {request.url.path}'
+        logging.warning(message)
+        return httpx.Response(404, json={'error': {'message': message, 'code': 404}}, request=request)
+
+    def _replay(self, request: httpx.Request, started_at: float):
+        """The response, and how long to wait before returning it."""
+        body = _request_body(request)
+        if body is None:
+            # pings and the like; no need to go anywhere
+            return httpx.Response(204, request=request), 0.0
+        entry = self.cassette.take(request_key(request.method, request.url.path, body), request_shape(body))
+        if entry is None:
+            return self._miss(request), 0.0
+        chunks = [_decode_chunk(chunk) for chunk in entry['chunks']]
+        response = httpx.Response(
+            entry['status'],
+            headers=entry['headers'],
+            stream=_ReplayStream(chunks, started_at, self.time_scale),
+            request=request,
+        )
+        return response, started_at + entry['headers_after'] * self.time_scale - time.monotonic()
+
+    def _recording(self, request: httpx.Request, response: httpx.Response, started_at: float) -> httpx.Response:
+        body = _request_body(request)
+        if body is None:
+            return response
+        headers_after = time.monotonic() - started_at
+
+        def on_complete(chunks):
+            raw = b''.join(chunk for _, chunk in chunks)
+            self.cassette.append({
+                'key': request_key(request.method, request.url.path, body),
+                'shape': request_shape(body),
+                'method': request.method,
+                'path': request.url.path,
+                'body': body,
+                'status': response.status_code,
+                'headers': [[name, value] for name, value in response.headers.items() if name.lower() not in PRIVATE_HEADERS],
+                'headers_after': round(headers_after, 4),
+                'chunks': [_encode_chunk(offset, chunk) for offset, chunk in chunks],
+                'usage': _usage_of(raw),
+                'recorded_at': time.time(),
+            })
+
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, started_at, on_complete),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started_at = time.monotonic()
+        if self.mode == 'replay':
+            response, delay = self._replay(request, started_at)
+            if delay > 0:
+                time.sleep(delay)
+            return response
+        # recorded bodies stay readable
+        request.headers['accept-encoding'] = 'identity'
+        return self._recording(request, self.inner.handle_request(request), started_at)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started_at = time.monotonic()
+        if self.mode == 'replay':
+            response, delay = self._replay(request, started_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return response
+        request.headers['accept-encoding'] = 'identity'
+        return self._recording(request, await self.inner.handle_async_request(request), started_at)
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+    async def aclose(self):
+        if self.inner is not None:
+            await self.inner.aclose()
+
+
+cassette: Cassette | None = None
+
+
+def cassette_transports(http2: bool, limits: httpx.Limits) -> tuple[CassetteTransport, CassetteTransport]:
+    """Sync and async transports for the shared clients in ``LLM_CASSETTE_MODE``."""
+    global cassette
+    if LLM_CASSETTE_MODE not in ('record', 'replay'):
+        raise ValueError(f'LLM_CASSETTE_MODE must be off, record or replay, not {LLM_CASSETTE_MODE!r}')
+    cassette = Cassette(LLM_CASSETTE_PATH)
+    if LLM_CASSETTE_MODE == 'replay':
+        cassette.load()
+        logging.info(f'Replaying model calls from {LLM_CASSETTE_PATH}')
+        return CassetteTransport(cassette, 'replay'), CassetteTransport(cassette, 'replay')
+    logging.info(f'Recording model calls to {LLM_CASSETTE_PATH}')
+    return (
+        CassetteTransport(cassette, 'record', httpx.HTTPTransport(http2=http2, limits=limits)),
+        CassetteTransport(cassette, 'record', httpx.AsyncHTTPTransport(http2=http2, limits=limits)),
+    )
+
+
+def summarize(path: str) -> dict:
+    """Calls, token usage and recorded latency per model."""
+    from toshokan.frontend.metrics import percentile
+
+    models = defaultdict(lambda: {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0, 'seconds': []})
+    for entry in Cassette(path).load().entries():
+        summary = models[(entry.get('body') or {}).get('model', '?')]
+        usage = entry.get('usage') or {}
+        summary['calls'] += 1
+        summary['prompt_tokens'] += usage.get('prompt_tokens', 0)
+        summary['completion_tokens'] += usage.get('completion_tokens', 0)
+        summary['cost'] += usage.get('cost', 0.0) or 0.0
+        summary['seconds'].append(entry['chunks'][-1][0] if entry['chunks'] else entry['headers_after'])
+    return {
+        model: {
+            'calls': summary['calls'],
+            'prompt_tokens': summary['prompt_tokens'],
+            'completion_tokens': summary['completion_tokens'],
+            'cost': round(summary['cost'], 6),
+            'p50_seconds': round(percentile(summary['seconds'], 50), 3),
+            'p99_seconds': round(percentile(summary['seconds'], 99), 3),
+        }
+        for model, summary in sorted(models.items())
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarize an LLM cassette, or compare two')
+    parser.add_argument('cassette')
+    parser.add_argument('other', nargs='?', help='a cassette recorded after a change, to compare with the first')
+    args = parser.parse_args(argv)
+
+    before = summarize(args.cassette)
+    after = summarize(args.other) if args.other else None
+    columns = ('calls', 'prompt_tokens', 'completion_tokens', 'cost', 'p50_seconds', 'p99_seconds')
+    width = 19 if after is None else 26
+    print(f'{"model":<40}' + ''.join(f'{column:>{width}}' for column in columns))
+    for model in sorted(set(before) | set(after or {})):
+        row = before.get(model, dict.fromkeys(columns, 0))
+        if after is None:
+            print(f'{model:<40}' + ''.join(f'{row[column]:>{width}}' for column in columns))
+            continue
+        other = after.get(model, dict.fromkeys(columns, 0))
+        print(f'{model:<40}' + ''.join(f'{f"{row[column]} -> {other[column]}":>{width}}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
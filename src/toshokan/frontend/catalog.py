@@ -0,0 +1,213 @@
+import csv
+import logging
+import os
+import unicodedata
+from functools import lru_cache
+from typing import Iterable, NamedTuple
+
+
+# Entries a loaded CSV may have
+CATALOG_MAX_ENTRIES = int(os.environ.get('CATALOG_MAX_ENTRIES', '20000'))
+CATALOG_MAX_FIELD_LENGTH = int(os.environ.get('CATALOG_MAX_FIELD_LENGTH', '2000'))
+# Choices sent to a dropdown at a time; typing in it searches the rest
+CATALOG_CHOICES_PAGE_SIZE = int(os.environ.get('CATALOG_CHOICES_PAGE_SIZE', '50'))
+
+LESSON_COLUMNS = ('Lesson', 'Description')
+SELECTED_LESSON_COLUMNS = ('Lesson',)
+EXERCISE_TYPE_COLUMNS = ('Exercise Type', 'Description')
+UNKNOWN_KANJI_COLUMNS = ('Kanji', 'Hiragana', 'Explanation')
+
+
+class CatalogError(ValueError):
+    pass
+
+
+class Entry(NamedTuple):
+    name: str
+    description: str = ''
+
+
+def _normalize(text: str) -> str:
+    # full-width letters and digits match their ASCII forms, case doesn't matter
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+class Catalog:
+    """Immutable table of named entries (lessons, exercise types).
+
+    Entries are ``(name, description)`` tuples, so they double as Gradio
+    dropdown choices (label, value). *columns* only controls how many of the
+    two fields are shown in a ``gr.Dataframe`` and saved in the config.
+
+    ``search`` uses an index of the character bigrams of names and
+    descriptions, built on first use, so catalogs of thousands of lessons
+    can be searched as the learner types.
+    """
+
+    __slots__ = ('columns', 'entries', 'names', '_by_name', '_by_value', '_positions', '_index')
+
+    def __init__(self, entries: Iterable[Entry], columns: tuple[str, ...] = LESSON_COLUMNS):
+        self.columns = columns
+        self.entries = tuple(entries)
+        self.names = frozenset(entry.name for entry in self.entries)
+        self._by_name = {entry.name: entry for entry in self.entries}
+        self._by_value = {entry.description: entry for entry in reversed(self.entries)}
+        self._positions = {entry: position for position, entry in reversed(list(enumerate(self.entries)))}
+        self._index = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def __deepcopy__(self, memo) -> 'Catalog':
+        # immutable; gr.State copies its values
+        return self
+
+    def get(self, name: str) -> Entry | None:
+        return self._by_name.get(name)
+
+    def by_value(self, value: str) -> Entry | None:
+        """The entry a dropdown value (the description) stands for."""
+        return self._by_value.get(value)
+
+    def values_of(self, names: Iterable[str]) -> list[str]:
+        """Dropdown values of the entries named *names*, in catalog order."""
+        entries = {self._by_name[name] for name in names if name in self._by_name}
+        return [entry.description for entry in sorted(entries, key=self._positions.__getitem__)]
+
+    @property
+    def choices(self) -> tuple[Entry, ...]:
+        return self.entries
+
+    def _build_index(self) -> tuple[list[str], dict[str, tuple[int, ...]]]:
+        texts = [_normalize(f'{entry.name}\n{entry.description}') for entry in self.entries]
+        postings: dict[str, list[int]] = {}
+        for position, text in enumerate(texts):
+            grams = {text[i:i + 2] for i in range(len(text) - 1)} | set(text)
+            for gram in grams:
+                postings.setdefault(gram, []).append(position)
+        return texts, {gram: tuple(positions) for gram, positions in postings.items()}
+
+    def search(self, query: str) -> list[int]:
+        """Positions of the entries whose name or description contains every word of *query*, in catalog order."""
+        terms = _normalize(query or '').split()
+        if not terms:
+            return list(range(len(self.entries)))
+        if self._index is None:
+            self._index = self._build_index()
+        texts, postings = self._index
+        grams = {term[i:i + 2] for term in terms for i in range(len(term) - 1)} | {term for term in terms if len(term) == 1}
+        candidates = sorted((postings.get(gram, ()) for gram in grams), key=len)
+        matches = set(candidates[0]).intersection(*candidates[1:])
+        # the bigrams can all occur without the words themselves
+        return sorted(position for position in matches if all(term in texts[position] for term in terms))
+
+    def choices_page(
+        self,
+        query: str = '',
+        keep: Iterable[str] = (),
+        limit: int = CATALOG_CHOICES_PAGE_SIZE,
+    ) -> tuple[tuple[Entry, ...], int]:
+        """The first *limit* matches of *query* and the entries of the dropdown values *keep*.
+
+        The kept entries stay among the choices so a dropdown doesn't lose its
+        selection. Also returns the number of matches.
+        """
+        matches = self.search(query)
+        page = [self.entries[position] for position in matches[:limit]]
+        shown = set(page)
+        for value in keep or ():
+            entry = self._by_value.get(value)
+            if entry is not None and entry not in shown:
+                page.append(entry)
+                shown.add(entry)
+        return tuple(page), len(matches)
+
+    def rows(self) -> list[list[str]]:
+        """Rows for a ``gr.Dataframe(type='array')``."""
+        width = len(self.columns)
+        return [list(entry[:width]) for entry in self.entries]
+
+    def records(self) -> list[dict]:
+        return [dict(zip(self.columns, entry)) for entry in self.entries]
+
+    @classmethod
+    def from_rows(cls, rows, columns: tuple[str, ...] = LESSON_COLUMNS) -> 'Catalog':
+        entries = []
+        for row in rows or ():
+            if not row or row[0] is None or not str(row[0]).strip():
+                # the dataframe editor sends blank rows for an empty table
+                continue
+            description = row[1] if len(row) > 1 and row[1] is not None else ''
+            entries.append(Entry(str(row[0]), str(description)))
+        return cls(entries, columns)
+
+    @classmethod
+    def from_records(cls, records: list[dict], columns: tuple[str, ...] = LESSON_COLUMNS) -> 'Catalog':
+        # positional, so configs saved with other header spellings still load
+        return cls.from_rows([list(record.values()) for record in records or ()], columns)
+
+    @classmethod
+    def from_csv(
+        cls,
+        path: str,
+        columns: tuple[str, ...] = LESSON_COLUMNS,
+        max_entries: int = CATALOG_MAX_ENTRIES,
+        max_field_length: int = CATALOG_MAX_FIELD_LENGTH,
+    ) -> 'Catalog':
+        """Read a CSV row by row, checking it as it goes.
+
+        A header row naming the columns is skipped, as are blank rows. Repeated
+        names keep their first row. Raises ``CatalogError`` naming the line of
+        the first problem.
+        """
+        entries = []
+        seen = set()
+        duplicates = 0
+        header = tuple(column.casefold() for column in columns)
+        line = 0
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as file:
+                reader = csv.reader(file)
+                for row in reader:
+                    line = reader.line_num
+                    if not row or not row[0].strip():
+                        continue
+                    if not entries and tuple(field.strip().casefold() for field in row[:len(columns)]) == header:
+                        continue
+                    if len(row) > 2:
+                        raise CatalogError(f'line {line}: expected a name and a description, got {len(row)} columns')
+                    if any(len(field) > max_field_length for field in row):
+                        raise CatalogError(f'line {line}: fields can be at most {max_field_length} characters long')
+                    if row[0] in seen:
+                        duplicates += 1
+                        continue
+                    if len(entries) == max_entries:
+                        raise CatalogError(f'line {line}: at most {max_entries} entries can be loaded')
+                    seen.add(row[0])
+                    entries.append(Entry(row[0], row[1] if len(row) > 1 else ''))
+        except UnicodeDecodeError:
+            # decoded in blocks, so the line isn't known
+            raise CatalogError('the file is not UTF-8 text') from None
+        except csv.Error as e:
+            raise CatalogError(f'line {line + 1}: {e}') from None
+        if duplicates:
+            logging.info(f'Skipped {duplicates} repeated names in {path}')
+        return cls(entries, columns)
+
+
+@lru_cache(maxsize=256)
+def _cached_catalog(rows: tuple[tuple, ...], columns: tuple[str, ...]) -> Catalog:
+    return Catalog.from_rows(rows, columns)
+
+
+def catalog_from_rows(rows, columns: tuple[str, ...] = LESSON_COLUMNS) -> Catalog:
+    """Catalog for dataframe rows, shared between sessions that loaded the same table."""
+    if isinstance(rows, Catalog):
+        return rows
+    return _cached_catalog(tuple(tuple(row) for row in rows or ()), columns)
@@ -0,0 +1,160 @@
+"""Compact rendering of the learner's inputs into system prompts.
+
+Kanji lists arrive as the CSV text of the Library tab (commas, newlines,
+duplicates) and lesson selections as Python lists. ``render_prompt``
+formats a template with them normalized:
+
+- kanji lists become the unique kanji in their original order, without
+  separators; scheduled kanji that are already known are dropped
+- lesson lists become one ``- lesson`` line each, without duplicates
+- with ``KANJI_REFERENCE_PATH`` set to a standard list (e.g. the jōyō
+  kanji), a known list covering most of it is sent as "all of the list
+  except ..." when that's shorter
+
+The tokens saved on each prompt are reported on ``/metrics`` under
+``prompts``.
+"""
+import logging
+import os
+import threading
+from functools import lru_cache
+from toshokan.frontend.helpers import is_kanji
+from toshokan.frontend.metrics import metrics
+
+
+# Optional file of a standard kanji list the known kanji can be expressed against
+KANJI_REFERENCE_PATH = os.environ.get('KANJI_REFERENCE_PATH')
+KANJI_REFERENCE_NAME = os.environ.get('KANJI_REFERENCE_NAME', 'jōyō kanji (常用漢字)')
+# tiktoken encoding used to count tokens, loaded at startup (it may be downloaded);
+# an estimate is used until then, or when it can't be loaded
+PROMPT_TOKEN_ENCODING = os.environ.get('PROMPT_TOKEN_ENCODING', 'o200k_base')
+
+KANJI_FIELDS = ('known_kanji', 'scheduled_kanji')
+LESSON_FIELDS = ('lessons', 'lessons_included')
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def load_token_encoding():
+    """Load the tiktoken encoding, downloading it when it isn't cached; never called by a request."""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(PROMPT_TOKEN_ENCODING)
+            except Exception as e:
+                logging.info(f'Estimating prompt tokens, tiktoken is unavailable: {e!r}')
+            _encoding_loaded = True
+
+
+def count_tokens(text: str) -> int:
+    return _count_tokens(text, _encoding is not None)
+
+
+@lru_cache(maxsize=1024)
+def _count_tokens(text: str, exact: bool) -> int:
+    if exact:
+        return len(_encoding.encode(text))
+    # about one token per CJK character and per four other characters
+    cjk = sum(1 for char in text if char >= '\u3000')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@lru_cache(maxsize=256)
+def unique_kanji(text: str) -> str:
+    """The kanji of *text* in order of first appearance, each once."""
+    return ''.join(dict.fromkeys(char for char in text or '' if is_kanji(char)))
+
+
+@lru_cache(maxsize=1)
+def _reference_kanji(path: str | None) -> str:
+    if not path:
+        return ''
+    with open(path, encoding='utf-8') as file:
+        return unique_kanji(file.read())
+
+
+@lru_cache(maxsize=256)
+def compact_known_kanji(text: str) -> str:
+    known = unique_kanji(text)
+    reference = _reference_kanji(KANJI_REFERENCE_PATH)
+    if not reference:
+        return known
+    known_set, reference_set = set(known), set(reference)
+    missing = ''.join(char for char in reference if char not in known_set)
+    extra = ''.join(char for char in known if char not in reference_set)
+    relative = f'All {KANJI_REFERENCE_NAME} except: {missing or "none"}'
+    if extra:
+        relative += f'\nAnd also: {extra}'
+    return relative if len(relative) < len(known) else known
+
+
+def compact_scheduled_kanji(scheduled_kanji: str, known_kanji: str) -> str:
+    known = set(unique_kanji(known_kanji))
+    return ''.join(char for char in unique_kanji(scheduled_kanji) if char not in known)
+
+
+def compact_lessons(lessons) -> str:
+    if isinstance(lessons, str):
+        lessons = lessons.splitlines()
+    names = dict.fromkeys(str(lesson).strip() for lesson in lessons or () if str(lesson).strip())
+    return '\n'.join(f'- {name}' for name in names)
+
+
+class PromptSavings:
+    """Tokens of the compacted fields per prompt, against their verbatim form."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prompts: dict[str, list[int]] = {}
+
+    def record(self, prompt: str, verbatim_tokens: int, compact_tokens: int):
+        with self._lock:
+            totals = self._prompts.setdefault(prompt, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += verbatim_tokens
+            totals[2] += compact_tokens
+        metrics.inc('prompt_tokens_saved_total', verbatim_tokens - compact_tokens, prompt=prompt)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                prompt: {
+                    'renders': renders,
+                    'verbatim_tokens': verbatim,
+                    'compact_tokens': compact,
+                    'saved_tokens': verbatim - compact,
+                    'saved_ratio': (verbatim - compact) / verbatim if verbatim else 0.0,
+                }
+                for prompt, (renders, verbatim, compact) in self._prompts.items()
+            }
+
+
+prompt_savings = PromptSavings()
+
+
+def render_prompt(name: str, template: str, **fields) -> str:
+    """``template.format(**fields)`` with the kanji and lesson fields compacted.
+
+    *name* identifies the prompt in the savings report.
+    """
+    compact = dict(fields)
+    if 'known_kanji' in fields:
+        compact['known_kanji'] = compact_known_kanji(fields['known_kanji'] or '')
+    if 'scheduled_kanji' in fields:
+        compact['scheduled_kanji'] = compact_scheduled_kanji(fields['scheduled_kanji'] or '', fields.get('known_kanji') or '')
+    for field in LESSON_FIELDS:
+        if field in fields:
+            compact[field] = compact_lessons(fields[field])
+
+    changed = [field for field in (*KANJI_FIELDS, *LESSON_FIELDS) if field in fields]
+    if changed:
+        prompt_savings.record(
+            name,
+            sum(count_tokens(str(fields[field])) for field in changed),
+            sum(count_tokens(compact[field]) for field in changed),
+        )
+    return template.format(**compact)
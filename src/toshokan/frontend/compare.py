@@ -0,0 +1,315 @@
+"""Side-by-side comparison of models on the lookup, breakdown and aux chats.
+
+The same prompt is streamed from every selected model at once, each into its
+own panel, with its time to first token, total time and token counts. Every
+comparison is stored (``COMPARE_RESULTS_PATH``), along with the answer the
+learner picked as the best one, and the leaderboard aggregates them per task
+and model: median latencies, output speed, errors and how often the model's
+answer was picked, to choose the default models in ``TASK_PROFILES`` from.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import gradio as gr
+from langchain_core.messages import HumanMessage, SystemMessage
+from toshokan.frontend import aio
+from toshokan.frontend.gateway import gateway, GatewayOverloaded, Priority
+from toshokan.frontend.metrics import metrics, percentile
+from toshokan.frontend.models import ensure_openrouter_api_key, get_model, resolve_api_key, upstream_model_name
+from toshokan.frontend.resilience import get_task_policy
+from toshokan.frontend.routing import get_task_profile, profile_call_kwargs
+from toshokan.frontend.session import get_user_id
+from toshokan.frontend.throttling import provider_limits
+from toshokan.frontend.prompts.word import WORD_SYSTEM_PROMPT
+from toshokan.frontend.prompts.breakdown import BREAKDOWN_SYSTEM_PROMPT
+from toshokan.frontend.prompts.aux import AUX_SYSTEM_PROMPT
+
+
+# Models one comparison can run (the panels in the Compare tab)
+COMPARE_MAX_MODELS = int(os.environ.get('COMPARE_MAX_MODELS', '4'))
+COMPARE_RESULTS_PATH = os.environ.get('COMPARE_RESULTS_PATH', os.path.join(tempfile.gettempdir(), 'toshokan_model_comparisons.sqlite'))
+# How often the panels are redrawn while the answers stream in
+COMPARE_REFRESH_SECONDS = float(os.environ.get('COMPARE_REFRESH_SECONDS', '0.1'))
+
+# task: (label, system prompt, prompt field)
+COMPARE_TASKS = {
+    'word': ('Word lookup', WORD_SYSTEM_PROMPT, 'word'),
+    'breakdown': ('Sentence breakdown', BREAKDOWN_SYSTEM_PROMPT, 'sentence'),
+    'aux': ('General aux chat', AUX_SYSTEM_PROMPT, 'user_input'),
+}
+
+RESULT_COLUMNS = ('Model', 'First token (s)', 'Total (s)', 'Input tokens', 'Output tokens', 'Tokens/s', 'Error')
+LEADERBOARD_COLUMNS = (
+    'Task', 'Model', 'Runs', 'Errors', 'First token p50 (s)', 'Total p50 (s)', 'Total p90 (s)',
+    'Output tokens (avg)', 'Tokens/s (avg)', 'Picked', 'Pick rate',
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comparisons (
+    id INTEGER PRIMARY KEY,
+    task TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    user_id TEXT,
+    winner TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    comparison_id INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    first_token_seconds REAL,
+    total_seconds REAL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    error TEXT,
+    PRIMARY KEY (comparison_id, model)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS comparisons_task ON comparisons (task);
+"""
+
+
+class ModelRun:
+    """One model's answer as it streams in; written on the LLM event loop, read by the handler."""
+
+    __slots__ = ('model_name', 'text', 'started_at', 'first_token_seconds', 'total_seconds', 'input_tokens', 'output_tokens', 'error')
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.text = ''
+        self.started_at = None
+        self.first_token_seconds = None
+        self.total_seconds = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.error = None
+
+    @property
+    def done(self) -> bool:
+        return self.total_seconds is not None or self.error is not None
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        # output speed once the first token is in
+        if not self.output_tokens or self.total_seconds is None:
+            return None
+        streaming = self.total_seconds - (self.first_token_seconds or 0.0)
+        return self.output_tokens / streaming if streaming > 0 else None
+
+    def markdown(self) -> str:
+        if self.error is not None:
+            status = f'**Failed:** {self.error}'
+        elif self.total_seconds is not None:
+            status = (
+                f'first token {self.first_token_seconds or 0:.2f}s · total {self.total_seconds:.2f}s · '
+                f'{self.input_tokens} in / {self.output_tokens} out tokens'
+            )
+        elif self.first_token_seconds is not None:
+            status = f'first token {self.first_token_seconds:.2f}s · streaming…'
+        else:
+            status = 'waiting for the first token…'
+        return f'### {self.model_name}\n\n{self.text}\n\n---\n{status}'
+
+    def row(self) -> list:
+        def seconds(value):
+            return round(value, 2) if value is not None else None
+        tokens_per_second = self.tokens_per_second
+        return [
+            self.model_name, seconds(self.first_token_seconds), seconds(self.total_seconds),
+            self.input_tokens, self.output_tokens, round(tokens_per_second, 1) if tokens_per_second else None, self.error or '',
+        ]
+
+
+async def _stream(run: ModelRun, runtime_config: dict, messages, deadline: float, call_kwargs: dict):
+    model = get_model(runtime_config, run.model_name)
+    limiter = provider_limits.get('openrouter', upstream_model_name(run.model_name), resolve_api_key(runtime_config))
+
+    async def attempt():
+        # a retried attempt starts over
+        run.text, run.first_token_seconds = '', None
+        run.started_at = time.monotonic()
+        async for chunk in model.astream(messages, stream_usage=True, **call_kwargs):
+            if chunk.content and run.first_token_seconds is None:
+                run.first_token_seconds = time.monotonic() - run.started_at
+            run.text += chunk.content
+            if chunk.usage_metadata:
+                run.input_tokens = chunk.usage_metadata.get('input_tokens', 0)
+                run.output_tokens = chunk.usage_metadata.get('output_tokens', 0)
+        run.total_seconds = time.monotonic() - run.started_at
+
+    try:
+        await asyncio.wait_for(limiter.call(attempt), deadline)
+        metrics.observe('compare_first_token_seconds', run.first_token_seconds or 0.0, model=run.model_name)
+    except asyncio.TimeoutError:
+        run.error = f'no answer after {deadline:.0f}s'
+    except Exception as e:
+        run.error = str(e) or type(e).__name__
+
+
+class ComparisonStore:
+    """SQLite store of comparisons, their per-model results and the picked answers."""
+
+    def __init__(self, path: str = COMPARE_RESULTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def add(self, task: str, prompt: str, runs: list[ModelRun], user_id: str | None = None) -> int:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    'INSERT INTO comparisons (task, prompt_hash, user_id, created_at) VALUES (?, ?, ?, ?)',
+                    (task, hashlib.sha256(prompt.encode()).hexdigest()[:16], user_id, time.time()),
+                )
+                connection.executemany(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [
+                        (cursor.lastrowid, run.model_name, run.first_token_seconds, run.total_seconds, run.input_tokens, run.output_tokens, run.error)
+                        for run in runs
+                    ],
+                )
+            return cursor.lastrowid
+
+    def pick(self, comparison_id: int, model_name: str):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('UPDATE comparisons SET winner = ? WHERE id = ?', (model_name, comparison_id))
+
+    def leaderboard(self) -> list[list]:
+        """One row per task and model, fastest median total time first within a task."""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT c.task, r.model, r.first_token_seconds, r.total_seconds, r.output_tokens, r.error, c.winner '
+                'FROM results r JOIN comparisons c ON c.id = r.comparison_id'
+            ).fetchall()
+        groups: dict[tuple[str, str], dict] = {}
+        for task, model, first_token, total, output_tokens, error, winner in rows:
+            group = groups.setdefault((task, model), {'runs': 0, 'errors': 0, 'first': [], 'total': [], 'tokens': [], 'speed': [], 'judged': 0, 'picked': 0})
+            group['runs'] += 1
+            if winner is not None:
+                group['judged'] += 1
+                group['picked'] += winner == model
+            if error is not None:
+                group['errors'] += 1
+                continue
+            group['first'].append(first_token or 0.0)
+            group['total'].append(total)
+            group['tokens'].append(output_tokens or 0)
+            if output_tokens and total > (first_token or 0.0):
+                group['speed'].append(output_tokens / (total - (first_token or 0.0)))
+
+        def mean(values):
+            return round(sum(values) / len(values), 1) if values else None
+
+        table = []
+        for (task, model), group in groups.items():
+            table.append([
+                task, model, group['runs'], group['errors'],
+                round(percentile(group['first'], 50), 2) if group['first'] else None,
+                round(percentile(group['total'], 50), 2) if group['total'] else None,
+                round(percentile(group['total'], 90), 2) if group['total'] else None,
+                mean(group['tokens']), mean(group['speed']), group['picked'],
+                f'{group["picked"] / group["judged"]:.0%}' if group['judged'] else '',
+            ])
+        table.sort(key=lambda row: (row[0], row[5] is None, row[5] or 0.0))
+        return table
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+comparison_store = ComparisonStore()
+
+
+def _panels(runs: list[ModelRun]) -> list:
+    panels = [gr.Markdown(run.markdown(), visible=True) for run in runs]
+    return panels + [gr.Markdown('', visible=False)] * (COMPARE_MAX_MODELS - len(runs))
+
+
+def run_the_comparison(
+    task_label: str,
+    model_names: list[str],
+    user_input: str,
+    runtime_config: dict,
+    request: gr.Request = None,
+):
+    """Streams the answers of *model_names* into the panels, then stores the comparison.
+
+    Yields the panels, the results table, the choices of the best-answer
+    radio, the comparison id and the leaderboard.
+    """
+    task = next((task for task, (label, _, _) in COMPARE_TASKS.items() if label == task_label), None)
+    if task is None:
+        raise gr.Error('Select what to compare the models on')
+    if not model_names:
+        raise gr.Error('Select the models to compare')
+    if len(model_names) > COMPARE_MAX_MODELS:
+        raise gr.Error(f'At most {COMPARE_MAX_MODELS} models can be compared at a time')
+    if not user_input or not user_input.strip():
+        raise gr.Error('Enter the prompt to send to the models')
+    if not ensure_openrouter_api_key(runtime_config):
+        raise gr.Error('Openrouter API key is not set')
+
+    _, system_prompt, field = COMPARE_TASKS[task]
+    messages = [SystemMessage(content=system_prompt.format(**{field: user_input})), HumanMessage(user_input)]
+    runs = [ModelRun(model_name) for model_name in dict.fromkeys(model_names)]
+    deadline = get_task_policy(task).deadline
+    # the task's own temperature and token limit, whatever model answers
+    call_kwargs = profile_call_kwargs(get_task_profile(task))
+
+    try:
+        # one gateway slot for the comparison, after the learners' own turns; each model
+        # still waits for its provider limit
+        with gateway.slot(get_user_id(request), priority=Priority.SPECULATIVE, task=f'compare_{task}'):
+            futures = [aio.submit(_stream(run, runtime_config, messages, deadline, call_kwargs)) for run in runs]
+            try:
+                while not all(future.done() for future in futures):
+                    yield *_panels(runs), gr.skip(), gr.skip(), gr.skip(), gr.skip()
+                    time.sleep(COMPARE_REFRESH_SECONDS)
+            finally:
+                # the learner left or cancelled: stop the models still answering
+                for future in futures:
+                    future.cancel()
+    except GatewayOverloaded as e:
+        raise gr.Error(str(e))
+
+    comparison_id = comparison_store.add(task, user_input, runs, get_user_id(request))
+    answered = [run.model_name for run in runs if run.error is None]
+    yield (
+        *_panels(runs),
+        [run.row() for run in runs],
+        gr.Radio(choices=answered, value=None, visible=bool(answered)),
+        comparison_id,
+        comparison_store.leaderboard(),
+    )
+
+
+def pick_the_best_answer(
+    comparison_id: int | None,
+    model_name: str | None,
+):
+    if comparison_id is None or not model_name:
+        raise gr.Error('Run a comparison and select the best answer first')
+    comparison_store.pick(comparison_id, model_name)
+    gr.Info(f'Saved {model_name} as the best answer')
+    return comparison_store.leaderboard()
+
+
+def load_leaderboard():
+    return comparison_store.leaderboard()
@@ -1,6 +1,10 @@
 import os
 
 
+# Get the conversation reply and its kanji annotations in one model call
+CONVERSATION_SINGLE_SHOT = os.environ.get('CONVERSATION_SINGLE_SHOT', 'false').lower() == 'true'
+
+
 def update_model_name(
         config: dict,
         model_name: str,
@@ -14,5 +18,12 @@ def update_openrouter_api_key(
         openrouter_api_key: str,
 ) -> tuple[dict, str]:
     config['openrouter_api_key'] = openrouter_api_key
-    os.environ['OPENROUTER_API_KEY'] = openrouter_api_key
     return config, ''
+
+
+def update_conversation_single_shot(
+        config: dict,
+        conversation_single_shot: bool,
+) -> dict:
+    config['conversation_single_shot'] = conversation_single_shot
+    return config
@@ -3,8 +3,10 @@ from __future__ import annotations
 import os
 import gradio as gr
 from gradio_agentchatbot_5 import AgentChatbot, ChatMessage
-from dotenv import load_dotenv, find_dotenv
 from toshokan.frontend.handlers import (
+    cancel_exercise_calls,
+    cancel_conversation_calls,
+    cancel_session_calls,
     run_the_aux_chat,
     run_the_conversation_chat,
     run_the_word_chat,
@@ -13,11 +15,30 @@ from toshokan.frontend.handlers import (
     update_lessons_included_choices_values,
     update_exercise_lesson_dropdown_values,
     update_exercise_type_dropdown_choices,
+    search_exercise_lessons,
+    search_conversation_lessons,
     run_the_exercise_initiate,
     run_the_conversation_initiate,
 )
-from toshokan.frontend.models import reload_models, get_available_model_names
-from toshokan.frontend.config import update_model_name, update_openrouter_api_key
+from toshokan.frontend.compare import (
+    COMPARE_MAX_MODELS,
+    COMPARE_TASKS,
+    LEADERBOARD_COLUMNS,
+    RESULT_COLUMNS,
+    load_leaderboard,
+    pick_the_best_answer,
+    run_the_comparison,
+)
+from toshokan.frontend.models import get_available_model_names
+from toshokan.frontend.catalog import LESSON_COLUMNS, EXERCISE_TYPE_COLUMNS, UNKNOWN_KANJI_COLUMNS
+from toshokan.frontend.queues import LLM_EVENT, IO_EVENT, UI_EVENT, configure_queue
+from toshokan.frontend.tracing import instrument_blocks
+from toshokan.frontend.config import (
+    CONVERSATION_SINGLE_SHOT,
+    update_model_name,
+    update_openrouter_api_key,
+    update_conversation_single_shot,
+)
 from toshokan.frontend.state_manager import (
     load_csv_into_df_lessons,
     load_csv_into_df_exercise_types,
@@ -31,8 +52,6 @@ from toshokan.frontend.state_manager import (
     exercise_state_to_chat,
 )
 
-_ = load_dotenv(find_dotenv())
-
 COGNITO_INTEGRATE = os.environ.get('COGNITO_INTEGRATE', 'false').lower() == 'true'
 
 if COGNITO_INTEGRATE:
@@ -48,423 +67,581 @@ CODE_VERSION = os.environ['CODE_VERSION']
 # Default model
 default_model_name = 'openai/gpt-4o'
 
-with gr.Blocks() as dashboard:
-    with gr.Row():
-        gr.Label("Toshokan (図書館)", show_label=False)
 
-    if COGNITO_INTEGRATE:
+def build_dashboard() -> gr.Blocks:
+    """Build the dashboard UI; called once at startup rather than at import."""
+    with gr.Blocks() as dashboard:
         with gr.Row():
-            with gr.Column():
-                account_label = gr.Label("account", label="Account")
-            with gr.Column():
-                logout_btn = gr.Button("Logout", link="/logout")
+            gr.Label("Toshokan (図書館)", show_label=False)
 
-    with gr.Row():
-        with gr.Tab("Library"):
+        if COGNITO_INTEGRATE:
+            with gr.Row():
+                with gr.Column():
+                    account_label = gr.Label("account", label="Account")
+                with gr.Column():
+                    logout_btn = gr.Button("Logout", link="/logout")
 
-            with gr.Accordion("API key"):
-                with gr.Row():
-                    with gr.Column(scale=9):
-                        openrouter_api_key = gr.Textbox(label="Openrouter API key (you can get it from https://openrouter.ai/settings/keys)")
-                    with gr.Column(scale=1):
-                        api_key_save_btn = gr.Button("Save API key")
+        with gr.Row():
+            with gr.Tab("Library"):
+
+                with gr.Accordion("API key"):
+                    with gr.Row():
+                        with gr.Column(scale=9):
+                            openrouter_api_key = gr.Textbox(label="Openrouter API key (you can get it from https://openrouter.ai/settings/keys)")
+                        with gr.Column(scale=1):
+                            api_key_save_btn = gr.Button("Save API key")
+
+                with gr.Accordion("Configuration save/load"):
+                    with gr.Row():
+                        with gr.Column():
+                            config_load_btn = gr.UploadButton("Load configuration", file_types=[".json", ".gz"])
+                        with gr.Column():
+                            config_save_btn = gr.DownloadButton("Save configuration")
+
+                with gr.Accordion("Configuration"):
+                    runtime_config = gr.State({
+                        'model_name': default_model_name,
+                        'openrouter_api_key': None,
+                        'conversation_single_shot': CONVERSATION_SINGLE_SHOT,
+                    })
+                    model_name_dropdown = gr.Dropdown(
+                        choices=get_available_model_names(),
+                        value=default_model_name,
+                        label="Model",
+                        info="Select the model to use for the conversation",
+                    )
+                    conversation_single_shot_checkbox = gr.Checkbox(
+                        value=CONVERSATION_SINGLE_SHOT,
+                        label="Single-shot conversation",
+                        info="Get the reply and the kanji annotations in one model call (faster, annotations may be less thorough)",
+                    )
+                with gr.Accordion("Lessons"):
+                    # the session's lesson catalog, and the choices each lesson dropdown was sent
+                    lesson_choices = gr.State({})
+                    with gr.Row():
+                        lessons_df_load_btn = gr.UploadButton("Load lessons", file_types=[".csv"])
+                    with gr.Row():
+                        lessons_df = gr.Dataframe(label="Lessons", headers=list(LESSON_COLUMNS), type="array")
+                with gr.Accordion("Lessons selected for conversation"):
+                    with gr.Row():
+                        lessons_df_selected_for_conversation_load_btn = gr.UploadButton("Load lessons selected for conversation", file_types=[".csv"])
+                    with gr.Row():
+                        lessons_df_selected_for_conversation = gr.Dataframe(label="Lessons selected for conversation", headers=list(LESSON_COLUMNS), type="array")
+                with gr.Accordion("Exercise types"):
+                    with gr.Row():
+                        exercise_types_df_load_btn = gr.UploadButton("Load exercise types", file_types=[".csv"])
+                    with gr.Row():
+                        exercise_types_df = gr.Dataframe(label="Exercise types", headers=list(EXERCISE_TYPE_COLUMNS), type="array")
+                with gr.Accordion("Known kanji"):
+                    with gr.Row():
+                        known_kanji_txt_load_btn = gr.UploadButton("Load known kanji", file_types=[".csv"])
+                    with gr.Row():
+                        known_kanji_txt = gr.Textbox(label="Known kanji")
+                with gr.Accordion("Scheduled kanji"):
+                    with gr.Row():
+                        scheduled_kanji_txt_load_btn = gr.UploadButton("Load scheduled kanji", file_types=[".csv"])
+                    with gr.Row():
+                        scheduled_kanji_txt = gr.Textbox(label="Scheduled kanji")
+
+            with gr.Tab("Exercises"):
+                exercise_state = gr.State({})
+                with gr.Accordion("Select lesson and exercise type"):
+                    with gr.Row():
+                        lessons_dropdown = gr.Dropdown(label="Lesson", multiselect=True)
+                        exercise_type_dropdown = gr.Dropdown(label="Exercise type")
+                    with gr.Row():
+                        exercise_initiate_btn = gr.Button("Initiate exercise")
+                        exercise_save_btn = gr.DownloadButton("Save progress")
+                        exercise_load_btn = gr.UploadButton("Load progress")
 
-            with gr.Accordion("Configuration save/load"):
-                with gr.Row():
-                    with gr.Column():
-                        config_load_btn = gr.UploadButton("Load configuration", file_types=[".json"])
-                    with gr.Column():
-                        config_save_btn = gr.DownloadButton("Save configuration")
-
-            with gr.Accordion("Configuration"):
-                runtime_config = gr.State({
-                    'model_name': default_model_name,
-                    'openrouter_api_key': None,
-                })
-                model_name_dropdown = gr.Dropdown(
-                    choices=get_available_model_names(),
-                    value=default_model_name,
-                    label="Model",
-                    info="Select the model to use for the conversation",
-                )
-            with gr.Accordion("Lessons"):
-                with gr.Row():
-                    lessons_df_load_btn = gr.UploadButton("Load lessons", file_types=[".csv"])
-                with gr.Row():
-                    lessons_df = gr.Dataframe(label="Lessons", headers=["Lesson", "Description"])
-            with gr.Accordion("Lessons selected for conversation"):
-                with gr.Row():
-                    lessons_df_selected_for_conversation_load_btn = gr.UploadButton("Load lessons selected for conversation", file_types=[".csv"])
-                with gr.Row():
-                    lessons_df_selected_for_conversation = gr.Dataframe(label="Lessons selected for conversation", headers=["Lesson", "Description"])
-            with gr.Accordion("Exercise types"):
                 with gr.Row():
-                    exercise_types_df_load_btn = gr.UploadButton("Load exercise types", file_types=[".csv"])
+                    exercise_chat = AgentChatbot()
                 with gr.Row():
-                    exercise_types_df = gr.Dataframe(label="Exercise types", headers=["Exercise type", "Description"])
-            with gr.Accordion("Known kanji"):
+                    exercise_input = gr.Textbox(label="Input")
+
+            with gr.Tab("Conversation"):
+                with gr.Accordion("Lessons included in conversation"):
+                    # with gr.Row():
+                    #     lessons_included_in_conversation_drop_load_btn = gr.UploadButton("Load lessons included in conversation", file_types=[".csv"])
+                    with gr.Row():
+                        lessons_included_in_conversation_drop = gr.Dropdown(label="Lessons included in conversation", multiselect=True)
+                with gr.Accordion("Formality & situation"):
+                    with gr.Row():
+                        formality_radio = gr.Radio(label="Formality", choices=["Formal", "Semi-formal", "Informal"], value="Semi-formal")
+                    with gr.Row():
+                        conversation_initiate_btn = gr.Button("Initiate conversation")
+                    with gr.Row():
+                        conversation_situation = gr.Textbox(label="Situation", interactive=True, lines=3)
+                    with gr.Row():
+                        conversation_chat = AgentChatbot()
+                    with gr.Accordion("Notes / kanji", open=False):
+                        with gr.Row():
+                            conversation_unknown_kanji = gr.Dataframe(label="Unknown kanji", headers=list(UNKNOWN_KANJI_COLUMNS), type="array", interactive=False)
+                        with gr.Row():
+                            conversation_notes = gr.Textbox(label="Notes", interactive=False)
+                    with gr.Row():
+                        conversation_input = gr.Textbox(label="Input", lines=3, interactive=True)
+
+            with gr.Tab("Word lookup"):
                 with gr.Row():
-                    known_kanji_txt_load_btn = gr.UploadButton("Load known kanji", file_types=[".csv"])
+                    word_chat = AgentChatbot()
                 with gr.Row():
-                    known_kanji_txt = gr.Textbox(label="Known kanji")
-            with gr.Accordion("Scheduled kanji"):
+                    word_input = gr.Textbox(label="Input")
+
+            with gr.Tab("Sentence breakdown"):
                 with gr.Row():
-                    scheduled_kanji_txt_load_btn = gr.UploadButton("Load scheduled kanji", file_types=[".csv"])
+                    breakdown_chat = AgentChatbot()
                 with gr.Row():
-                    scheduled_kanji_txt = gr.Textbox(label="Scheduled kanji")
+                    breakdown_input = gr.Textbox(label="Input")
 
-        with gr.Tab("Exercises"):
-            exercise_state = gr.State({})
-            with gr.Accordion("Select lesson and exercise type"):
+            with gr.Tab("General aux chat"):
                 with gr.Row():
-                    lessons_dropdown = gr.Dropdown(label="Lesson", multiselect=True)
-                    exercise_type_dropdown = gr.Dropdown(label="Exercise type")
+                    aux_chat = AgentChatbot()
                 with gr.Row():
-                    exercise_initiate_btn = gr.Button("Initiate exercise")
-                    exercise_save_btn = gr.DownloadButton("Save progress")
-                    exercise_load_btn = gr.UploadButton("Load progress")
+                    aux_input = gr.Textbox(label="Input")
 
-            with gr.Row():
-                exercise_chat = AgentChatbot()
-            with gr.Row():
-                exercise_input = gr.Textbox(label="Input")
-
-        with gr.Tab("Conversation"):
-            with gr.Accordion("Lessons included in conversation"):
-                # with gr.Row():
-                #     lessons_included_in_conversation_drop_load_btn = gr.UploadButton("Load lessons included in conversation", file_types=[".csv"])
+            with gr.Tab("Compare models") as compare_tab:
+                compare_id = gr.State(None)
                 with gr.Row():
-                    lessons_included_in_conversation_drop = gr.Dropdown(label="Lessons included in conversation", multiselect=True)
-            with gr.Accordion("Formality & situation"):
+                    compare_task_radio = gr.Radio(
+                        choices=[label for label, _, _ in COMPARE_TASKS.values()],
+                        value=COMPARE_TASKS['word'][0],
+                        label="Chat",
+                    )
+                    compare_models_dropdown = gr.Dropdown(
+                        choices=get_available_model_names(),
+                        value=[default_model_name],
+                        multiselect=True,
+                        max_choices=COMPARE_MAX_MODELS,
+                        label=f"Models (up to {COMPARE_MAX_MODELS})",
+                    )
                 with gr.Row():
-                    formality_radio = gr.Radio(label="Formality", choices=["Formal", "Semi-formal", "Informal"], value="Semi-formal")
+                    compare_input = gr.Textbox(label="Input")
                 with gr.Row():
-                    conversation_initiate_btn = gr.Button("Initiate conversation")
+                    compare_panels = [gr.Markdown(visible=False) for _ in range(COMPARE_MAX_MODELS)]
                 with gr.Row():
-                    conversation_situation = gr.Textbox(label="Situation", interactive=True, lines=3)
+                    compare_results = gr.Dataframe(label="Results", headers=list(RESULT_COLUMNS), type="array", interactive=False)
                 with gr.Row():
-                    conversation_chat = AgentChatbot()
-                with gr.Accordion("Notes / kanji", open=False):
-                    with gr.Row():
-                        conversation_unknown_kanji = gr.Dataframe(label="Unknown kanji", interactive=False)
-                    with gr.Row():
-                        conversation_notes = gr.Textbox(label="Notes", interactive=False)
+                    compare_best_radio = gr.Radio(label="Best answer", visible=False)
+                    compare_pick_btn = gr.Button("Save the best answer")
                 with gr.Row():
-                    conversation_input = gr.Textbox(label="Input", lines=3, interactive=True)
-
-        with gr.Tab("Word lookup"):
-            with gr.Row():
-                word_chat = AgentChatbot()
-            with gr.Row():
-                word_input = gr.Textbox(label="Input")
-
-        with gr.Tab("Sentence breakdown"):
-            with gr.Row():
-                breakdown_chat = AgentChatbot()
-            with gr.Row():
-                breakdown_input = gr.Textbox(label="Input")
-
-        with gr.Tab("General aux chat"):
-            with gr.Row():
-                aux_chat = AgentChatbot()
-            with gr.Row():
-                aux_input = gr.Textbox(label="Input")
-
-    model_name_dropdown.select(
-        fn=update_model_name,
-        inputs=[runtime_config, model_name_dropdown],
-        outputs=runtime_config,
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
-                known_kanji_txt,
-                scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    api_key_save_btn.click(
-        fn=update_openrouter_api_key,
-        inputs=[runtime_config, openrouter_api_key],
-        outputs=[runtime_config, openrouter_api_key],
-    )
-
-    lessons_df_load_btn.upload(
-        fn=load_csv_into_df_lessons,
-        inputs=[lessons_df_load_btn],
-        outputs=[lessons_df],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
-                known_kanji_txt,
-                scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    lessons_df.change(
-        fn=update_lessons_included_choices_values,
-        inputs=[lessons_df, lessons_df_selected_for_conversation],
-        outputs=[lessons_included_in_conversation_drop],
-    ).then(
-        fn=update_exercise_lesson_dropdown_values,
-        inputs=[lessons_df],
-        outputs=[lessons_dropdown],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
-                known_kanji_txt,
-                scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    lessons_df_selected_for_conversation_load_btn.upload(
-        fn=load_csv_into_df_lessons_selected_for_conversation,
-        inputs=[lessons_df_selected_for_conversation_load_btn],
-        outputs=[lessons_df_selected_for_conversation],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
-                known_kanji_txt,
-                scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    lessons_df_selected_for_conversation.change(
-        fn=update_lessons_included_choices_values,
-        inputs=[lessons_df, lessons_df_selected_for_conversation],
-        outputs=[lessons_included_in_conversation_drop],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
-                known_kanji_txt,
-                scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    exercise_types_df_load_btn.upload(
-        fn=load_csv_into_df_exercise_types,
-        inputs=[exercise_types_df_load_btn],
-        outputs=[exercise_types_df],
-    ).then(
-        fn=update_exercise_type_dropdown_choices,
-        inputs=[exercise_types_df],
-        outputs=[exercise_type_dropdown],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
-                known_kanji_txt,
-                scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    exercise_types_df.change(
-        fn=update_exercise_type_dropdown_choices,
-        inputs=[exercise_types_df],
-        outputs=[exercise_type_dropdown],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
-                known_kanji_txt,
-                scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    known_kanji_txt_load_btn.upload(
-        fn=load_csv_into_txt,
-        inputs=[known_kanji_txt_load_btn],
-        outputs=[known_kanji_txt],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
+                    compare_leaderboard = gr.Dataframe(label="Leaderboard", headers=list(LEADERBOARD_COLUMNS), type="array", interactive=False)
+                with gr.Row():
+                    compare_refresh_btn = gr.Button("Refresh the leaderboard")
+
+        model_name_dropdown.select(
+            fn=update_model_name,
+            inputs=[runtime_config, model_name_dropdown],
+            outputs=runtime_config,
+            **UI_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        conversation_single_shot_checkbox.input(
+            fn=update_conversation_single_shot,
+            inputs=[runtime_config, conversation_single_shot_checkbox],
+            outputs=runtime_config,
+            **UI_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        api_key_save_btn.click(
+            fn=update_openrouter_api_key,
+            inputs=[runtime_config, openrouter_api_key],
+            outputs=[runtime_config, openrouter_api_key],
+            **UI_EVENT,
+        )
+
+        lessons_df_load_btn.upload(
+            fn=load_csv_into_df_lessons,
+            inputs=[lessons_df_load_btn],
+            outputs=[lessons_df],
+            **IO_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        lessons_df.change(
+            fn=update_lessons_included_choices_values,
+            inputs=[lessons_df, lessons_df_selected_for_conversation, lesson_choices],
+            outputs=[lessons_included_in_conversation_drop, lesson_choices],
+            **UI_EVENT,
+        ).then(
+            fn=update_exercise_lesson_dropdown_values,
+            inputs=[lessons_df, lessons_dropdown, lesson_choices],
+            outputs=[lessons_dropdown, lesson_choices],
+            **UI_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        lessons_df_selected_for_conversation_load_btn.upload(
+            fn=load_csv_into_df_lessons_selected_for_conversation,
+            inputs=[lessons_df_selected_for_conversation_load_btn],
+            outputs=[lessons_df_selected_for_conversation],
+            **IO_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        lessons_df_selected_for_conversation.change(
+            fn=update_lessons_included_choices_values,
+            inputs=[lessons_df, lessons_df_selected_for_conversation, lesson_choices],
+            outputs=[lessons_included_in_conversation_drop, lesson_choices],
+            **UI_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        exercise_types_df_load_btn.upload(
+            fn=load_csv_into_df_exercise_types,
+            inputs=[exercise_types_df_load_btn],
+            outputs=[exercise_types_df],
+            **IO_EVENT,
+        ).then(
+            fn=update_exercise_type_dropdown_choices,
+            inputs=[exercise_types_df],
+            outputs=[exercise_type_dropdown],
+            **UI_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        exercise_types_df.change(
+            fn=update_exercise_type_dropdown_choices,
+            inputs=[exercise_types_df],
+            outputs=[exercise_type_dropdown],
+            **UI_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        known_kanji_txt_load_btn.upload(
+            fn=load_csv_into_txt,
+            inputs=[known_kanji_txt_load_btn],
+            outputs=[known_kanji_txt],
+            **IO_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        scheduled_kanji_txt_load_btn.upload(
+            fn=load_csv_into_txt,
+            inputs=[scheduled_kanji_txt_load_btn],
+            outputs=[scheduled_kanji_txt],
+            **IO_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        # recreating the save file
+        # this is a hack to mitigate broken downloads
+
+        config_save_btn.click(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        config_load_btn.upload(
+            fn=load_config,
+            inputs=[config_load_btn],
+            outputs=[
+                runtime_config,
                 lessons_df,
                 lessons_df_selected_for_conversation,
                 exercise_types_df,
                 known_kanji_txt,
-                scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    scheduled_kanji_txt_load_btn.upload(
-        fn=load_csv_into_txt,
-        inputs=[scheduled_kanji_txt_load_btn],
-        outputs=[scheduled_kanji_txt],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
+                scheduled_kanji_txt
+            ],
+            **IO_EVENT,
+        ).then(
+            fn=save_config,
+            inputs=[runtime_config,
+                    lessons_df,
+                    lessons_df_selected_for_conversation,
+                    exercise_types_df,
+                    known_kanji_txt,
+                    scheduled_kanji_txt,
+                    ],
+            outputs=[config_save_btn],
+            **IO_EVENT,
+        )
+
+        # the dropdowns hold a page of the lessons; typing searches all of them
+        lessons_dropdown.key_up(
+            fn=search_exercise_lessons,
+            inputs=[lessons_dropdown, lesson_choices],
+            outputs=[lessons_dropdown, lesson_choices],
+            trigger_mode='always_last',
+            **UI_EVENT,
+        )
+
+        lessons_included_in_conversation_drop.key_up(
+            fn=search_conversation_lessons,
+            inputs=[lessons_included_in_conversation_drop, lesson_choices],
+            outputs=[lessons_included_in_conversation_drop, lesson_choices],
+            trigger_mode='always_last',
+            **UI_EVENT,
+        )
+
+        lessons_dropdown.change(
+            fn=exercise_state_to_chat,
+            inputs=[lessons_dropdown, exercise_type_dropdown, exercise_state],
+            outputs=[exercise_chat],
+            **UI_EVENT,
+        )
+
+        exercise_type_dropdown.change(
+            fn=exercise_state_to_chat,
+            inputs=[lessons_dropdown, exercise_type_dropdown, exercise_state],
+            outputs=[exercise_chat],
+            **UI_EVENT,
+        )
+
+        exercise_initiate_event = exercise_initiate_btn.click(
+            fn=run_the_exercise_initiate,
+            inputs=[
+                lessons_dropdown,
+                exercise_type_dropdown,
                 known_kanji_txt,
                 scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    # recreating the save file
-    # this is a hack to mitigate broken downloads
-
-    config_save_btn.click(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
+                exercise_input,
+                runtime_config
+            ],
+            outputs=[exercise_chat, exercise_input],
+            **LLM_EVENT,
+        )
+
+        exercise_submit_event = exercise_input.submit(
+            fn=run_the_exercise_chat,
+            inputs=[
+                lessons_dropdown,
+                exercise_type_dropdown,
                 known_kanji_txt,
                 scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    config_load_btn.upload(
-        fn=load_config,
-        inputs=[config_load_btn],
-        outputs=[
-            runtime_config,
-            lessons_df,
-            lessons_df_selected_for_conversation,
-            exercise_types_df,
-            known_kanji_txt,
-            scheduled_kanji_txt
-        ],
-    ).then(
-        fn=save_config,
-        inputs=[runtime_config,
-                lessons_df,
-                lessons_df_selected_for_conversation,
-                exercise_types_df,
+                exercise_input,
+                exercise_chat,
+                runtime_config
+            ],
+            outputs=[exercise_chat, exercise_input],
+            **LLM_EVENT,
+        )
+        exercise_submit_event.then(
+            fn=exercise_chat_to_state,
+            inputs=[lessons_dropdown, exercise_type_dropdown, exercise_chat, exercise_state],
+            outputs=[exercise_state],
+            **UI_EVENT,
+        )
+
+        exercise_save_btn.click(
+            fn=save_exercise_progress,
+            inputs=[exercise_state],
+            outputs=[exercise_save_btn],
+            **IO_EVENT,
+        )
+
+        exercise_load_btn.upload(
+            fn=load_exercise_progress,
+            inputs=[exercise_load_btn],
+            outputs=[exercise_state],
+            **IO_EVENT,
+        ).then(
+            fn=exercise_state_to_chat,
+            inputs=[lessons_dropdown, exercise_type_dropdown, exercise_state],
+            outputs=[exercise_chat],
+            **UI_EVENT,
+        )
+
+        conversation_initiate_btn.click(
+            fn=run_the_conversation_initiate,
+            inputs=[formality_radio, runtime_config],
+            outputs=[conversation_situation],
+            **LLM_EVENT,
+        )
+
+        conversation_submit_event = conversation_input.submit(
+            run_the_conversation_chat,
+            inputs=[
+                lessons_included_in_conversation_drop,
+                conversation_situation,
                 known_kanji_txt,
                 scheduled_kanji_txt,
-                ],
-        outputs=[config_save_btn],
-    )
-
-    lessons_dropdown.change(
-        fn=exercise_state_to_chat,
-        inputs=[lessons_dropdown, exercise_type_dropdown, exercise_state],
-        outputs=[exercise_chat]
-    )
-
-    exercise_type_dropdown.change(
-        fn=exercise_state_to_chat,
-        inputs=[lessons_dropdown, exercise_type_dropdown, exercise_state],
-        outputs=[exercise_chat]
-    )
-
-    exercise_initiate_btn.click(
-        fn=run_the_exercise_initiate,
-        inputs=[
-            lessons_dropdown,
-            exercise_type_dropdown,
-            known_kanji_txt,
-            scheduled_kanji_txt,
-            exercise_input,
-            runtime_config
-        ],
-        outputs=[exercise_chat, exercise_input]
-    )
-
-    exercise_input.submit(
-        fn=run_the_exercise_chat,
-        inputs=[
-            lessons_dropdown,
-            exercise_type_dropdown,
-            known_kanji_txt,
-            scheduled_kanji_txt,
-            exercise_input,
-            exercise_chat,
-            runtime_config
-        ],
-        outputs=[exercise_chat, exercise_input]
-    ).then(
-        fn=exercise_chat_to_state,
-        inputs=[lessons_dropdown, exercise_type_dropdown, exercise_chat, exercise_state],
-        outputs=[exercise_state]
-    )
-
-    exercise_save_btn.click(
-        fn=save_exercise_progress,
-        inputs=[exercise_state],
-        outputs=[exercise_save_btn]
-    )
-
-    exercise_load_btn.upload(
-        fn=load_exercise_progress,
-        inputs=[exercise_load_btn],
-        outputs=[exercise_state]
-    ).then(
-        fn=exercise_state_to_chat,
-        inputs=[lessons_dropdown, exercise_type_dropdown, exercise_state],
-        outputs=[exercise_chat]
-    )
-
-    conversation_initiate_btn.click(
-        fn=run_the_conversation_initiate,
-        inputs=[formality_radio, runtime_config],
-        outputs=[conversation_situation]
-    )
-
-    conversation_input.submit(
-        run_the_conversation_chat,
-        inputs=[
-            lessons_included_in_conversation_drop,
-            conversation_situation,
-            known_kanji_txt,
-            scheduled_kanji_txt,
-            conversation_input,
-            conversation_chat,
-            formality_radio,
-            runtime_config
-        ],
-        outputs=[
-            conversation_chat,
-            conversation_input,
-            conversation_notes,
-            conversation_unknown_kanji
-        ]
-    )
-
-    word_input.submit(
-        run_the_word_chat,
-        inputs=[word_input, word_chat, runtime_config],
-        outputs=[word_chat, word_input]
-    )
-
-    breakdown_input.submit(
-        run_the_breakdown_chat,
-        inputs=[breakdown_input, breakdown_chat, runtime_config],
-        outputs=[breakdown_chat, breakdown_input]
-    )
-
-    aux_input.submit(
-        run_the_aux_chat,
-        inputs=[aux_input, aux_chat, runtime_config],
-        outputs=[aux_chat, aux_input]
-    )
+                conversation_input,
+                conversation_chat,
+                formality_radio,
+                runtime_config
+            ],
+            outputs=[
+                conversation_chat,
+                conversation_input,
+                conversation_notes,
+                conversation_unknown_kanji
+            ],
+            **LLM_EVENT,
+        )
+
+        word_input.submit(
+            run_the_word_chat,
+            inputs=[word_input, word_chat, runtime_config],
+            outputs=[word_chat, word_input],
+            **LLM_EVENT,
+        )
+
+        breakdown_input.submit(
+            run_the_breakdown_chat,
+            inputs=[breakdown_input, breakdown_chat, runtime_config],
+            outputs=[breakdown_chat, breakdown_input],
+            **LLM_EVENT,
+        )
+
+        aux_input.submit(
+            run_the_aux_chat,
+            inputs=[aux_input, aux_chat, runtime_config],
+            outputs=[aux_chat, aux_input],
+            **LLM_EVENT,
+        )
+
+        compare_input.submit(
+            run_the_comparison,
+            inputs=[compare_task_radio, compare_models_dropdown, compare_input, runtime_config],
+            outputs=[*compare_panels, compare_results, compare_best_radio, compare_id, compare_leaderboard],
+            **LLM_EVENT,
+        )
+
+        compare_pick_btn.click(
+            fn=pick_the_best_answer,
+            inputs=[compare_id, compare_best_radio],
+            outputs=[compare_leaderboard],
+            **IO_EVENT,
+        )
+
+        for leaderboard_trigger in (compare_tab.select, compare_refresh_btn.click):
+            leaderboard_trigger(
+                fn=load_leaderboard,
+                outputs=[compare_leaderboard],
+                **IO_EVENT,
+            )
+
+        # Moving on abandons the requests still running for the old input:
+        # `cancels` drops the pending events in the browser, the handlers
+        # cancel their model calls on the server.
+        for exercise_selection_change in (lessons_dropdown.change, exercise_type_dropdown.change):
+            exercise_selection_change(
+                fn=cancel_exercise_calls,
+                cancels=[exercise_initiate_event, exercise_submit_event],
+                **UI_EVENT,
+            )
+
+        # a new exercise or answer supersedes the other one's running call
+        exercise_initiate_btn.click(fn=None, cancels=[exercise_submit_event], **UI_EVENT)
+        exercise_input.submit(fn=None, cancels=[exercise_initiate_event], **UI_EVENT)
+
+        conversation_initiate_btn.click(
+            fn=cancel_conversation_calls,
+            cancels=[conversation_submit_event],
+            **UI_EVENT,
+        )
+
+        dashboard.unload(cancel_session_calls)
+
+    return instrument_blocks(configure_queue(dashboard))
@@ -0,0 +1,248 @@
+"""Bank of pre-generated first exercise turns.
+
+Lesson sets and exercise types are shared by many users, so the opening
+batch of tasks for a combination can be generated once, offline, and served
+instantly. Exercises are kept per lesson set, exercise type, model and kanji
+level, a band of ``EXERCISE_BANK_LEVEL_STEP`` known kanji, so learners of a
+similar level share them. Each exercise records the kanji it shows without a
+reading (the known kanji it was written for); ``run_the_exercise_initiate``
+takes one the user hasn't seen yet and knows all those kanji of, and
+generates one live (and adds it to the bank) when there's none left.
+
+Fill the bank for every lesson and exercise type with::
+
+    python -m toshokan.frontend.exercise_bank --per-key 5 --concurrency 4
+
+Each exercise is committed as soon as it's generated, so an interrupted run
+picks up where it stopped when it's started again.
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from toshokan.frontend.helpers import is_kanji
+
+
+EXERCISE_BANK_ENABLED = os.environ.get('EXERCISE_BANK_ENABLED', 'true').lower() == 'true'
+EXERCISE_BANK_PATH = os.environ.get('EXERCISE_BANK_PATH', os.path.join(tempfile.gettempdir(), 'toshokan_exercise_bank.sqlite'))
+# Learners whose known kanji counts fall in the same band of this size share exercises
+EXERCISE_BANK_LEVEL_STEP = int(os.environ.get('EXERCISE_BANK_LEVEL_STEP', '100'))
+# Unseen exercises checked against the learner's known kanji before generating one live
+EXERCISE_BANK_CANDIDATES = int(os.environ.get('EXERCISE_BANK_CANDIDATES', '20'))
+
+ARTIFACTS = Path(__file__).resolve().parents[3] / 'artifacts'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exercises (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    lessons TEXT NOT NULL,
+    exercise_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    required_kanji TEXT,
+    model_name TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS exercises_key ON exercises (key);
+CREATE TABLE IF NOT EXISTS seen (
+    user_id TEXT NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (user_id, exercise_id)
+) WITHOUT ROWID;
+"""
+
+
+def kanji_level(known_kanji: str) -> int:
+    """Band of the number of distinct known kanji; order, separators and duplicates don't matter."""
+    return len({char for char in known_kanji if is_kanji(char)}) // EXERCISE_BANK_LEVEL_STEP
+
+
+def bank_key(lessons_included: list[str], exercise_type: str, model_name: str, known_kanji: str) -> str:
+    """Key of the exercises a learner may be served.
+
+    The model is part of it: learners pick a model for its style and quality,
+    and an exercise written by another one isn't what they asked for. The
+    scheduled kanji aren't: they're shown with a reading like any kanji
+    the learner doesn't know yet.
+    """
+    payload = json.dumps([sorted(lessons_included or []), exercise_type, model_name, kanji_level(known_kanji)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def required_kanji(content: str, known_kanji: str) -> str:
+    """Kanji of *content* shown without a reading: the prompt has every other kanji followed by its hiragana."""
+    known = {char for char in known_kanji if is_kanji(char)}
+    return ''.join(dict.fromkeys(char for char in content if char in known))
+
+
+class ExerciseBank:
+    """SQLite store of exercises per key, and of the exercises each user has seen."""
+
+    def __init__(self, path: str = EXERCISE_BANK_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            # the generator writes while the app reads
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(exercises)')}
+            if 'required_kanji' not in columns:
+                # banks from before the column; their rows are never served
+                connection.execute('ALTER TABLE exercises ADD COLUMN required_kanji TEXT')
+            self._connection = connection
+        return self._connection
+
+    def take(self, key: str, user_id: str, known_kanji: str) -> str | None:
+        """An exercise for *key* that *user_id* hasn't seen and knows the kanji of, marked as seen."""
+        known = {char for char in known_kanji if is_kanji(char)}
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(
+                'SELECT id, content, required_kanji FROM exercises WHERE key = ? AND required_kanji IS NOT NULL '
+                'AND id NOT IN (SELECT exercise_id FROM seen WHERE user_id = ?) ORDER BY random() LIMIT ?',
+                (key, user_id, EXERCISE_BANK_CANDIDATES),
+            )
+            row = next((row for row in rows if known.issuperset(row[2])), None)
+            if row is None:
+                return None
+            with connection:
+                connection.execute('INSERT OR IGNORE INTO seen VALUES (?, ?, ?)', (user_id, row[0], time.time()))
+            return row[1]
+
+    def add(
+        self,
+        key: str,
+        lessons_included: list[str],
+        exercise_type: str,
+        content: str,
+        known_kanji: str,
+        model_name: str | None = None,
+        seen_by: str | None = None,
+    ):
+        """Add an exercise written for a learner who knows *known_kanji*."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    'INSERT INTO exercises (key, lessons, exercise_type, content, required_kanji, model_name, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, json.dumps(lessons_included, ensure_ascii=False), exercise_type, content,
+                     required_kanji(content, known_kanji), model_name, time.time()),
+                )
+                if seen_by is not None:
+                    connection.execute('INSERT OR IGNORE INTO seen VALUES (?, ?, ?)', (seen_by, cursor.lastrowid, time.time()))
+
+    def count(self, key: str) -> int:
+        with self._lock:
+            return self._connect().execute('SELECT count(*) FROM exercises WHERE key = ?', (key,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+exercise_bank = ExerciseBank()
+
+
+def _lesson_sets(args) -> list[list[str]]:
+    """Lesson sets as the dashboard sends them (lesson descriptions, the dropdown's values)."""
+    from toshokan.frontend.catalog import Catalog, LESSON_COLUMNS
+
+    lessons = Catalog.from_csv(args.lessons, LESSON_COLUMNS)
+    if args.lesson_sets is None:
+        return [[entry.description] for entry in lessons]
+    with open(args.lesson_sets, newline='') as file:
+        return [
+            [lessons.get(name.strip()).description for name in row if lessons.get(name.strip())]
+            for row in csv.reader(file) if row
+        ]
+
+
+def generate(args):
+    from toshokan.frontend.catalog import Catalog, EXERCISE_TYPE_COLUMNS
+    from toshokan.frontend.gateway import Priority
+    from toshokan.frontend.handlers import generate_exercise
+
+    # one known kanji list per level to cover
+    known_kanji_levels = [Path(path).read_text() for path in args.known_kanji]
+    scheduled_kanji = Path(args.scheduled_kanji).read_text()
+    exercise_types = [entry.description for entry in Catalog.from_csv(args.exercise_types, EXERCISE_TYPE_COLUMNS)]
+    runtime_config = {'model_name': args.model, 'openrouter_api_key': None}
+    bank = ExerciseBank(args.bank)
+
+    jobs = []
+    for lessons_included, exercise_type, known_kanji in itertools.product(_lesson_sets(args), exercise_types, known_kanji_levels):
+        key = bank_key(lessons_included, exercise_type, args.model, known_kanji)
+        missing = args.per_key - bank.count(key)
+        jobs.extend([(key, lessons_included, exercise_type, known_kanji)] * max(0, missing))
+    logging.info(f'Generating {len(jobs)} exercises with {args.concurrency} workers')
+
+    def run(job):
+        key, lessons_included, exercise_type, known_kanji = job
+        content = generate_exercise(
+            lessons_included, exercise_type, known_kanji, scheduled_kanji, '', runtime_config,
+            priority=Priority.SPECULATIVE,
+        )
+        bank.add(key, lessons_included, exercise_type, content, known_kanji, model_name=args.model)
+
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run, job) for job in jobs]
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    done += 1
+                except Exception as e:
+                    # left missing, so the next run retries it
+                    failed += 1
+                    logging.warning(f'Exercise generation failed: {e}')
+                if (done + failed) % 10 == 0:
+                    logging.info(f'{done + failed}/{len(jobs)} exercises, {failed} failed')
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+    bank.close()
+    logging.info(f'Generated {done} exercises, {failed} failed')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-generate first exercise turns into the exercise bank')
+    parser.add_argument('--bank', default=EXERCISE_BANK_PATH)
+    parser.add_argument('--lessons', default=str(ARTIFACTS / 'lessons.csv'))
+    parser.add_argument('--lesson-sets', help='CSV with one lesson set per row (lesson names); each lesson alone by default')
+    parser.add_argument('--exercise-types', default=str(ARTIFACTS / 'exercise_types.csv'))
+    parser.add_argument('--known-kanji', nargs='+', default=[str(ARTIFACTS / 'known_kanji.csv')],
+                        help='known kanji lists, one per level to cover')
+    parser.add_argument('--scheduled-kanji', default=str(ARTIFACTS / 'scheduled_kanji.csv'))
+    parser.add_argument('--per-key', type=int, default=5, help='exercises per lesson set, exercise type and known kanji list')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--model', default='openai/gpt-4o')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    generate(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from toshokan.frontend.metrics import metrics
+
+
+# Model calls allowed in flight at once across the whole process
+LLM_GATEWAY_MAX_CONCURRENCY = int(os.environ.get('LLM_GATEWAY_MAX_CONCURRENCY', '16'))
+# Waiting calls across all users before new ones are rejected
+LLM_GATEWAY_MAX_QUEUE = int(os.environ.get('LLM_GATEWAY_MAX_QUEUE', '256'))
+# Waiting calls of a single user before their new ones are rejected
+LLM_GATEWAY_MAX_QUEUE_PER_USER = int(os.environ.get('LLM_GATEWAY_MAX_QUEUE_PER_USER', '8'))
+# Longest a call may wait for a slot before it's rejected
+LLM_GATEWAY_MAX_WAIT_SECONDS = float(os.environ.get('LLM_GATEWAY_MAX_WAIT_SECONDS', '60'))
+
+
+class Priority(IntEnum):
+    """Lower values are admitted first."""
+    # a learner's own turn
+    INTERACTIVE = 0
+    # kanji listing and annotation around a turn
+    ANNOTATION = 1
+    # bulk work nobody is waiting on turn by turn: model comparisons, bank generation, API batches
+    SPECULATIVE = 2
+
+
+class GatewayOverloaded(Exception):
+    pass
+
+
+class _Ticket:
+    __slots__ = ('user_id', 'priority', 'task', 'start_tag', 'finish_tag', 'seq', 'admitted', 'abandoned', 'event')
+
+    def __init__(self, user_id, priority, task, start_tag, finish_tag, seq):
+        self.user_id = user_id
+        self.priority = priority
+        self.task = task
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.admitted = False
+        self.abandoned = False
+        self.event = threading.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.finish_tag, self.seq) < (other.priority, other.finish_tag, other.seq)
+
+
+class LLMGateway:
+    """Admission control for model calls.
+
+    Calls wait for one of ``max_concurrency`` slots. Waiting calls are ordered
+    by priority class first and then by weighted fair queuing across users: each
+    call gets a virtual finish tag of ``max(virtual_time, user's last tag) +
+    cost / weight``, so a user with many queued calls falls behind users with
+    few. Calls over the queue bounds, or waiting longer than ``max_wait``, are
+    rejected with :class:`GatewayOverloaded`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_GATEWAY_MAX_CONCURRENCY,
+        max_queue: int = LLM_GATEWAY_MAX_QUEUE,
+        max_queue_per_user: int = LLM_GATEWAY_MAX_QUEUE_PER_USER,
+        max_wait: float = LLM_GATEWAY_MAX_WAIT_SECONDS,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._heap: list[_Ticket] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_tag: dict[str, float] = {}
+        self._queued_per_user: dict[str, int] = {}
+        self._weights: dict[str, float] = {}
+        self._queued = 0
+        self._in_flight = 0
+        self.rejected = 0
+
+    def set_user_weight(self, user_id: str, weight: float):
+        with self._lock:
+            self._weights[user_id] = weight
+
+    @contextmanager
+    def slot(
+        self,
+        user_id: str,
+        priority: Priority = Priority.INTERACTIVE,
+        task: str | None = None,
+        cost: float = 1.0,
+    ):
+        ticket = self._enqueue(user_id, priority, task, cost)
+        enqueued_at = time.monotonic()
+        admitted = ticket.event.wait(self.max_wait)
+        wait = time.monotonic() - enqueued_at
+
+        if not admitted:
+            with self._lock:
+                # the slot may have been granted just after the wait timed out
+                if ticket.admitted:
+                    admitted = True
+                else:
+                    ticket.abandoned = True
+                    self._dequeued(ticket)
+        if not admitted:
+            self._reject('wait', task)
+            raise GatewayOverloaded(f'The server is busy, your request waited {wait:.0f}s without getting a slot. Please try again shortly.')
+
+        metrics.observe('llm_gateway_queue_wait_seconds', wait, priority=priority.name.lower(), task=task)
+        if wait > 1.0:
+            logging.info(f'LLM gateway: {task} for {user_id} waited {wait:.2f}s')
+
+        try:
+            yield wait
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._dispatch()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'rejected': self.rejected,
+            }
+
+    def _enqueue(self, user_id, priority, task, cost) -> _Ticket:
+        with self._lock:
+            if self._queued >= self.max_queue:
+                reason = 'queue full'
+            elif self._queued_per_user.get(user_id, 0) >= self.max_queue_per_user:
+                reason = 'user queue full'
+            else:
+                reason = None
+            if reason is None:
+                weight = self._weights.get(user_id, 1.0)
+                start_tag = max(self._virtual_time, self._last_tag.get(user_id, 0.0))
+                finish_tag = start_tag + cost / weight
+                self._last_tag[user_id] = finish_tag
+                ticket = _Ticket(user_id, priority, task, start_tag, finish_tag, next(self._seq))
+                heapq.heappush(self._heap, ticket)
+                self._queued += 1
+                self._queued_per_user[user_id] = self._queued_per_user.get(user_id, 0) + 1
+                self._dispatch()
+                return ticket
+
+        self._reject(reason, task)
+        if reason == 'user queue full':
+            raise GatewayOverloaded('You already have too many requests waiting. Please wait for them to finish.')
+        raise GatewayOverloaded('The server is busy right now. Please try again shortly.')
+
+    def _dispatch(self):
+        # called with the lock held
+        while self._heap and self._in_flight < self.max_concurrency:
+            ticket = heapq.heappop(self._heap)
+            if ticket.abandoned:
+                continue
+            self._dequeued(ticket)
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            self._in_flight += 1
+            ticket.admitted = True
+            ticket.event.set()
+
+        if len(self._last_tag) > 4 * self.max_queue:
+            # users whose tag is behind virtual time would restart from it anyway
+            self._last_tag = {u: t for u, t in self._last_tag.items() if t > self._virtual_time}
+
+    def _dequeued(self, ticket):
+        # called with the lock held
+        self._queued -= 1
+        remaining = self._queued_per_user[ticket.user_id] - 1
+        if remaining:
+            self._queued_per_user[ticket.user_id] = remaining
+        else:
+            del self._queued_per_user[ticket.user_id]
+
+    def _reject(self, reason, task):
+        with self._lock:
+            self.rejected += 1
+        metrics.inc('llm_gateway_rejected_total', reason=reason, task=task)
+        logging.warning(f'LLM gateway rejected {task}: {reason}')
+
+
+gateway = LLMGateway()
@@ -1,6 +1,5 @@
 import random
 import gradio as gr
-from dotenv import load_dotenv, find_dotenv
 from langchain_core.messages import (
     AIMessage,
     HumanMessage,
@@ -10,74 +9,167 @@ from langchain_core.messages import (
 from toshokan.frontend.helpers import (
     convert_langchain_messages_to_chat_messages,
     convert_chat_messages_to_langchain_messages,
+    is_kanji,
+)
+from toshokan.frontend.models import ensure_openrouter_api_key
+from toshokan.frontend.config import CONVERSATION_SINGLE_SHOT
+from toshokan.frontend.gateway import Priority
+from toshokan.frontend import llm, tracing
+from toshokan.frontend.cancellation import inflight_calls, session_id_of
+from toshokan.frontend.compaction import render_prompt
+from toshokan.frontend.exercise_bank import EXERCISE_BANK_ENABLED, bank_key, exercise_bank
+from toshokan.frontend.metrics import metrics
+from toshokan.frontend.session import get_user_id
+from toshokan.frontend.catalog import (
+    Catalog,
+    CATALOG_CHOICES_PAGE_SIZE,
+    catalog_from_rows,
+    LESSON_COLUMNS,
+    SELECTED_LESSON_COLUMNS,
+    EXERCISE_TYPE_COLUMNS,
 )
-from toshokan.frontend.models import reload_models, ensure_openrouter_api_key
-import pandas as pd
 
 from toshokan.frontend.prompts.breakdown import BREAKDOWN_SYSTEM_PROMPT
 from toshokan.frontend.prompts.exercise import EXERCISE_SYSTEM_PROMPT
 from toshokan.frontend.prompts.conversation import (
     CONVERSATION_SYSTEM_PROMPT,
+    CONVERSATION_SYSTEM_ANNOTATED_PROMPT,
     CONVERSATION_SYSTEM_ALL_KANJI_PROMPT,
     CONVERSATION_SYSTEM_UNKNOWN_KANJI_PROMPT,
     CONVERSATION_SYSTEM_INITIALIZE_PROMPT,
 )
 from toshokan.frontend.prompts.word import WORD_SYSTEM_PROMPT
 from toshokan.frontend.prompts.aux import AUX_SYSTEM_PROMPT
-from toshokan.frontend.schema import ConversationResponse, ConversationKanjiResponse, AllKanji, ConversationSituation
+from toshokan.frontend.schema import (
+    ConversationResponse,
+    ConversationAnnotatedResponse,
+    ConversationKanjiResponse,
+    AllKanji,
+    ConversationSituation,
+    UnknownKanji,
+)
 
-_ = load_dotenv(find_dotenv())
 
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
 
-def update_lessons_included_choices_values(
-    lessons_df: pd.DataFrame,
-    lessons_df_selected_for_conversation: pd.DataFrame,
+
+def _lesson_dropdown(
+    lessons: Catalog,
+    lesson_choices: dict,
+    dropdown: str,
+    keep: list[str],
+    query: str = '',
+    **kwargs,
 ):
+    """A page of lesson choices for *dropdown*, or ``gr.skip()`` if it shows them already.
 
-    names_lessons = lessons_df['Lesson'].tolist()
-    names_lessons_selected = lessons_df_selected_for_conversation['Lesson'].tolist()
-    descriptions_lessons = lessons_df['Description'].tolist()
+    *lesson_choices* is the session's ``gr.State`` holding the lessons catalog
+    and what each dropdown was last sent.
+    """
+    lesson_choices['catalog'] = lessons
+    choices, matches = lessons.choices_page(query, keep)
+    info = f'{min(matches, CATALOG_CHOICES_PAGE_SIZE)} of {matches} lessons shown, type to search' if matches > CATALOG_CHOICES_PAGE_SIZE else None
+    sent = (choices, info, tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in sorted(kwargs.items())))
+    if lesson_choices.get(dropdown) == sent:
+        return gr.skip()
+    lesson_choices[dropdown] = sent
+    return gr.Dropdown(choices=list(choices), info=info, **kwargs)
 
-    # here we need tuples of (lesson, description) from the DF
-    choices = [(lesson, description) for lesson, description in zip(names_lessons, descriptions_lessons)]
 
-    # for values we need to check if the lesson is in the lessons_df_selected_for_conversation
-    values = [choice[1] for choice in choices if choice[0] in names_lessons_selected]
+def update_lessons_included_choices_values(
+    lessons_df: list[list],
+    lessons_df_selected_for_conversation: list[list],
+    lesson_choices: dict | None = None,
+):
+    lessons = catalog_from_rows(lessons_df, LESSON_COLUMNS)
+    selected = catalog_from_rows(lessons_df_selected_for_conversation, SELECTED_LESSON_COLUMNS)
+    lesson_choices = {} if lesson_choices is None else lesson_choices
 
-    return gr.Dropdown(choices=choices, value=values, multiselect=True)
+    # choices are (lesson, description) tuples; the selected lessons are the initial values
+    values = lessons.values_of(selected.names)
+
+    return _lesson_dropdown(lessons, lesson_choices, 'conversation', keep=values, value=values, multiselect=True), lesson_choices
 
 
 def update_exercise_lesson_dropdown_values(
-    lessons_df: pd.DataFrame,
+    lessons_df: list[list],
+    exercise_lessons: list[str] | None = None,
+    lesson_choices: dict | None = None,
+):
+    lessons = catalog_from_rows(lessons_df, LESSON_COLUMNS)
+    lesson_choices = {} if lesson_choices is None else lesson_choices
+    return _lesson_dropdown(lessons, lesson_choices, 'exercise', keep=_as_list(exercise_lessons), interactive=True), lesson_choices
+
+
+def _search_lessons(lesson_choices: dict, dropdown: str, selected, query: str):
+    lessons = (lesson_choices or {}).get('catalog')
+    if lessons is None:
+        return gr.skip(), lesson_choices
+    return _lesson_dropdown(lessons, lesson_choices, dropdown, keep=_as_list(selected), query=query), lesson_choices
+
+
+def search_exercise_lessons(
+    exercise_lessons: list[str] | None,
+    lesson_choices: dict,
+    key_up_data: gr.KeyUpData,
+):
+    return _search_lessons(lesson_choices, 'exercise', exercise_lessons, key_up_data.input_value)
+
+
+def search_conversation_lessons(
+    conversation_lessons: list[str] | None,
+    lesson_choices: dict,
+    key_up_data: gr.KeyUpData,
 ):
-    # here we need tuples of (lesson, description) from the DF
-    choices = [(lesson, description) for lesson, description in zip(lessons_df['Lesson'], lessons_df['Description'])]
-    return gr.Dropdown(choices=choices, interactive=True)
+    return _search_lessons(lesson_choices, 'conversation', conversation_lessons, key_up_data.input_value)
 
 
 def update_exercise_type_dropdown_choices(
-    exercise_types_df: pd.DataFrame,
+    exercise_types_df: list[list],
 ):
-    # here we need tuples of (exercise_type, description) from the DF
-    choices = [(exercise_type, description) for exercise_type, description in zip(exercise_types_df['Exercise Type'], exercise_types_df['Description'])]
-    return gr.Dropdown(choices=choices, interactive=True)
+    return gr.Dropdown(choices=catalog_from_rows(exercise_types_df, EXERCISE_TYPE_COLUMNS).choices, interactive=True)
 
 
-def run_the_exercise_initiate(
+def cancel_exercise_calls(
+    request: gr.Request = None,
+):
+    """The learner picked another lesson or exercise type."""
+    if session_id_of(request) is not None:
+        inflight_calls.cancel(session_id_of(request), 'abandoned', channels=('exercise',))
+
+
+def cancel_conversation_calls(
+    request: gr.Request = None,
+):
+    """The learner started a new conversation situation."""
+    if session_id_of(request) is not None:
+        inflight_calls.cancel(session_id_of(request), 'abandoned', channels=('conversation',))
+
+
+def cancel_session_calls(
+    request: gr.Request = None,
+):
+    """The tab was closed or reloaded."""
+    if session_id_of(request) is not None:
+        inflight_calls.cancel(session_id_of(request), 'closed', forget=True)
+
+
+def generate_exercise(
     lessons_included: list[str],
     exercise_type: str,
     known_kanji: str,
     scheduled_kanji: str,
     user_input: str,
     runtime_config: dict,
-):
-
-    model = reload_models()[runtime_config['model_name']]
-
-    if not ensure_openrouter_api_key(model):
-        raise gr.Error('Openrouter API key is not set')
-
-    system_prompt = EXERCISE_SYSTEM_PROMPT.format(
+    request: gr.Request = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> str:
+    """The first turn of a new exercise, from the model."""
+    system_prompt = render_prompt(
+        'exercise', EXERCISE_SYSTEM_PROMPT,
         lessons_included=lessons_included,
         exercise_type=exercise_type,
         known_kanji=known_kanji,
@@ -91,8 +183,41 @@ def run_the_exercise_initiate(
     else:
         messages = [system_message]
 
-    assistant_message = model.invoke(messages)
-    messages = [assistant_message]
+    return llm.invoke(runtime_config, messages, task='exercise', request=request, priority=priority).content
+
+
+def run_the_exercise_initiate(
+    lessons_included: list[str],
+    exercise_type: str,
+    known_kanji: str,
+    scheduled_kanji: str,
+    user_input: str,
+    runtime_config: dict,
+    request: gr.Request = None,
+    priority: Priority = Priority.INTERACTIVE,
+):
+
+    if not ensure_openrouter_api_key(runtime_config):
+        raise gr.Error('Openrouter API key is not set')
+
+    # the bank only has exercises started without instructions from the user
+    key = None
+    content = None
+    if EXERCISE_BANK_ENABLED and len(user_input) == 0:
+        key = bank_key(lessons_included, exercise_type, runtime_config['model_name'], known_kanji)
+        content = exercise_bank.take(key, get_user_id(request), known_kanji)
+        metrics.inc('exercise_bank_total', outcome='hit' if content is not None else 'miss')
+
+    if content is None:
+        content = generate_exercise(
+            lessons_included, exercise_type, known_kanji, scheduled_kanji, user_input, runtime_config,
+            request=request, priority=priority)
+        if key is not None:
+            exercise_bank.add(
+                key, lessons_included, exercise_type, content, known_kanji,
+                model_name=runtime_config['model_name'], seen_by=get_user_id(request))
+
+    messages = [AIMessage(content)]
     converted_messages = list(convert_langchain_messages_to_chat_messages(messages))
 
     return converted_messages, ''
@@ -106,6 +231,7 @@ def run_the_exercise_chat(
     user_input: str,
     messages: list[AnyMessage],
     runtime_config: dict,
+    request: gr.Request = None,
 ):
 
     if len(messages) == 0:
@@ -116,12 +242,11 @@ def run_the_exercise_chat(
             known_kanji=known_kanji,
             scheduled_kanji=scheduled_kanji,
             user_input=user_input,
-            runtime_config=runtime_config)
+            runtime_config=runtime_config,
+            request=request)
 
     else:
-        model = reload_models()[runtime_config['model_name']]
-
-        if not ensure_openrouter_api_key(model):
+        if not ensure_openrouter_api_key(runtime_config):
             raise gr.Error('Openrouter API key is not set')
 
         messages = list(convert_chat_messages_to_langchain_messages(messages))
@@ -129,7 +254,7 @@ def run_the_exercise_chat(
         messages.append(HumanMessage(user_input))
         input_messages = messages
 
-        assistant_message = model.invoke(input_messages)
+        assistant_message = llm.invoke(runtime_config, input_messages, task='exercise', request=request)
         messages.append(assistant_message)
 
         converted_messages = list(convert_langchain_messages_to_chat_messages(messages))
@@ -141,10 +266,10 @@ def run_the_word_chat(
     user_input: str,
     messages: list[AnyMessage],
     runtime_config: dict,
+    request: gr.Request = None,
+    priority: Priority = Priority.INTERACTIVE,
 ):
-    model = reload_models()[runtime_config['model_name']]
-
-    if not ensure_openrouter_api_key(model):
+    if not ensure_openrouter_api_key(runtime_config):
         raise gr.Error('Openrouter API key is not set')
 
     system_prompt = WORD_SYSTEM_PROMPT.format(
@@ -154,7 +279,7 @@ def run_the_word_chat(
 
     messages = [system_message] + list(convert_chat_messages_to_langchain_messages(messages)) + [HumanMessage(user_input)]
 
-    assistant_message = model.invoke(messages)
+    assistant_message = llm.invoke(runtime_config, messages, task='word', request=request, priority=priority)
     messages.append(assistant_message)
 
     converted_messages = list(convert_langchain_messages_to_chat_messages(messages))
@@ -166,10 +291,10 @@ def run_the_breakdown_chat(
     user_input: str,
     messages: list[AnyMessage],
     runtime_config: dict,
+    request: gr.Request = None,
+    priority: Priority = Priority.INTERACTIVE,
 ):
-    model = reload_models()[runtime_config['model_name']]
-
-    if not ensure_openrouter_api_key(model):
+    if not ensure_openrouter_api_key(runtime_config):
         raise gr.Error('Openrouter API key is not set')
 
     system_prompt = BREAKDOWN_SYSTEM_PROMPT.format(
@@ -179,7 +304,7 @@ def run_the_breakdown_chat(
 
     messages = [system_message] + list(convert_chat_messages_to_langchain_messages(messages)) + [HumanMessage(user_input)]
 
-    assistant_message = model.invoke(messages)
+    assistant_message = llm.invoke(runtime_config, messages, task='breakdown', request=request, priority=priority)
     messages.append(assistant_message)
 
     converted_messages = list(convert_langchain_messages_to_chat_messages(messages))
@@ -191,10 +316,9 @@ def run_the_aux_chat(
     user_input: str,
     messages: list[AnyMessage],
     runtime_config: dict,
+    request: gr.Request = None,
 ):
-    model = reload_models()[runtime_config['model_name']]
-
-    if not ensure_openrouter_api_key(model):
+    if not ensure_openrouter_api_key(runtime_config):
         raise gr.Error('Openrouter API key is not set')
 
     system_prompt = AUX_SYSTEM_PROMPT.format(
@@ -204,7 +328,7 @@ def run_the_aux_chat(
 
     messages = [system_message] + list(convert_chat_messages_to_langchain_messages(messages)) + [HumanMessage(user_input)]
 
-    assistant_message = model.invoke(messages)
+    assistant_message = llm.invoke(runtime_config, messages, task='aux', request=request)
     messages.append(assistant_message)
 
     converted_messages = list(convert_langchain_messages_to_chat_messages(messages))
@@ -215,21 +339,22 @@ def run_the_aux_chat(
 def detect_all_kanji(
     sentence: str,
     runtime_config: dict,
+    request: gr.Request = None,
+    priority: Priority = Priority.ANNOTATION,
 ):
-    model = reload_models()[runtime_config['model_name']]
-
-    if not ensure_openrouter_api_key(model):
+    if not ensure_openrouter_api_key(runtime_config):
         raise gr.Error('Openrouter API key is not set')
 
     system_prompt = CONVERSATION_SYSTEM_ALL_KANJI_PROMPT.format(
         sentence=sentence
     )
 
-    model = model.with_structured_output(AllKanji)
     system_message = SystemMessage(content=system_prompt)
     messages = [system_message]
 
-    kanji_response = model.invoke(messages)
+    kanji_response = llm.invoke(
+        runtime_config, messages, task='kanji_listing', request=request,
+        priority=priority, schema=AllKanji)
 
     return kanji_response.kanji
 
@@ -239,17 +364,19 @@ def detect_unknown_kanji(
     known_kanji: str,
     scheduled_kanji: str,
     runtime_config: dict,
+    request: gr.Request = None,
+    priority: Priority = Priority.ANNOTATION,
 ):
-    model = reload_models()[runtime_config['model_name']]
-
-    if not ensure_openrouter_api_key(model):
+    if not ensure_openrouter_api_key(runtime_config):
         raise gr.Error('Openrouter API key is not set')
 
     unknown_kanji = []
 
     all_kanji = detect_all_kanji(
         sentence=sentence,
-        runtime_config=runtime_config
+        runtime_config=runtime_config,
+        request=request,
+        priority=priority,
     )
 
     if len(all_kanji) > 0:
@@ -262,34 +389,46 @@ def detect_unknown_kanji(
     system_prompt = CONVERSATION_SYSTEM_UNKNOWN_KANJI_PROMPT.format(
         kanji=unknown_kanji
     )
-    model = model.with_structured_output(ConversationKanjiResponse)
     system_message = SystemMessage(content=system_prompt)
     messages = [system_message]
 
-    kanji_response = model.invoke(messages)
+    kanji_response = llm.invoke(
+        runtime_config, messages, task='kanji_annotation', request=request,
+        priority=priority, schema=ConversationKanjiResponse)
 
-    records = [
-        {
-            'Kanji': k.kanji,
-            'Hiragana': k.hiragana,
-            'Explanation': k.explanation,
-        }
-        for k in kanji_response.unknown_kanji
-    ]
+    # rows for the unknown kanji dataframe, see UNKNOWN_KANJI_COLUMNS
+    with tracing.span('unknown_kanji_rows'):
+        return [[k.kanji, k.hiragana, k.explanation] for k in kanji_response.unknown_kanji]
 
-    if not records:
-        return pd.DataFrame(columns=['Kanji', 'Hiragana', 'Explanation'])
 
-    return pd.DataFrame.from_records(records)
+def filter_unknown_kanji_words(
+    words: list[UnknownKanji],
+    known_kanji: str,
+    scheduled_kanji: str,
+) -> list[UnknownKanji]:
+    """Drop words whose kanji are all known or scheduled, and duplicates.
+
+    The model is asked to do this itself in single-shot mode, but it isn't
+    reliable at it, so the annotations are checked against the lists here.
+    """
+    familiar = set(known_kanji) | set(scheduled_kanji)
+    seen = set()
+    unknown = []
+    for word in words:
+        if word.kanji in seen:
+            continue
+        if any(is_kanji(char) and char not in familiar for char in word.kanji):
+            seen.add(word.kanji)
+            unknown.append(word)
+    return unknown
 
 
 def run_the_conversation_initiate(
     formality: str,
     runtime_config: dict,
+    request: gr.Request = None,
 ):
-    model = reload_models()[runtime_config['model_name']]
-
-    if not ensure_openrouter_api_key(model):
+    if not ensure_openrouter_api_key(runtime_config):
         raise gr.Error('Openrouter API key is not set')
 
     system_prompt = CONVERSATION_SYSTEM_INITIALIZE_PROMPT.format(
@@ -299,12 +438,12 @@ def run_the_conversation_initiate(
     system_message = SystemMessage(content=system_prompt)
     messages = [system_message]
 
-    model = model.with_structured_output(ConversationSituation)
-
     seed = random.randint(0, 2**31-1)
     # import pdb; pdb.set_trace()
 
-    conversation_situation = model.invoke(messages, seed=seed)
+    conversation_situation = llm.invoke(
+        runtime_config, messages, task='conversation_situation', request=request,
+        schema=ConversationSituation, seed=seed)
 
     return conversation_situation.situation
 
@@ -318,13 +457,15 @@ def run_the_conversation_chat(
     messages: list[AnyMessage],
     formality: str,
     runtime_config: dict,
+    request: gr.Request = None,
 ):
-    model = reload_models()[runtime_config['model_name']]
-
-    if not ensure_openrouter_api_key(model):
+    if not ensure_openrouter_api_key(runtime_config):
         raise gr.Error('Openrouter API key is not set')
 
-    system_prompt = CONVERSATION_SYSTEM_PROMPT.format(
+    single_shot = runtime_config.get('conversation_single_shot', CONVERSATION_SINGLE_SHOT)
+    system_prompt = render_prompt(
+        'conversation_annotated' if single_shot else 'conversation',
+        CONVERSATION_SYSTEM_ANNOTATED_PROMPT if single_shot else CONVERSATION_SYSTEM_PROMPT,
         lessons=lessons,
         situation=situation,
         known_kanji=known_kanji,
@@ -332,11 +473,10 @@ def run_the_conversation_chat(
         formality=formality
     )
 
-    model = model.with_structured_output(ConversationResponse)
-
     system_message = SystemMessage(content=system_prompt)
 
-    messages = list(convert_chat_messages_to_langchain_messages(messages))
+    with tracing.span('convert_messages', count=len(messages)):
+        messages = list(convert_chat_messages_to_langchain_messages(messages))
 
     if len(user_input) > 0:
         user_message = HumanMessage(user_input)
@@ -344,16 +484,35 @@ def run_the_conversation_chat(
     else:
         messages = [system_message] + messages
 
-    conversation_response = model.invoke(messages)
+    if single_shot:
+        # one round trip: the reply comes back already annotated
+        conversation_response = llm.invoke(
+            runtime_config, messages, task='conversation_annotated', request=request,
+            schema=ConversationAnnotatedResponse)
+        messages.append(AIMessage(conversation_response.response))
+        with tracing.span('convert_messages', count=len(messages)):
+            converted_messages = list(convert_langchain_messages_to_chat_messages(messages))
+        with tracing.span('unknown_kanji_rows'):
+            unknown_kanji = [
+                [k.kanji, k.hiragana, k.explanation]
+                for k in filter_unknown_kanji_words(conversation_response.unknown_kanji, known_kanji, scheduled_kanji)
+            ]
+        return converted_messages, '', conversation_response.notes, unknown_kanji
+
+    conversation_response = llm.invoke(
+        runtime_config, messages, task='conversation', request=request,
+        schema=ConversationResponse)
     messages.append(AIMessage(conversation_response.response))
 
-    converted_messages = list(convert_langchain_messages_to_chat_messages(messages))
+    with tracing.span('convert_messages', count=len(messages)):
+        converted_messages = list(convert_langchain_messages_to_chat_messages(messages))
 
     unknown_kanji = detect_unknown_kanji(
             sentence=conversation_response.response,
             known_kanji=known_kanji,
             scheduled_kanji=scheduled_kanji,
-            runtime_config=runtime_config
+            runtime_config=runtime_config,
+            request=request,
         )
 
     return converted_messages, '', conversation_response.notes, unknown_kanji
@@ -24,3 +24,8 @@ def convert_chat_messages_to_langchain_messages(input):
             yield HumanMessage(content=msg.content)
         elif msg.role == 'system':
             continue
+
+
+def is_kanji(char: str) -> bool:
+    """CJK unified ideographs, including extension A."""
+    return '\u4e00' <= char <= '\u9fff' or '\u3400' <= char <= '\u4dbf'
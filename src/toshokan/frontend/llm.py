@@ -0,0 +1,100 @@
+import concurrent.futures
+import time
+import gradio as gr
+from langchain_core.messages import AnyMessage
+from pydantic import BaseModel
+from toshokan.frontend import aio, tracing
+from toshokan.frontend.cancellation import fingerprint, inflight_calls, session_id_of
+from toshokan.frontend.gateway import gateway, GatewayOverloaded, Priority
+from toshokan.frontend.models import get_model, resolve_api_key, upstream_model_name
+from toshokan.frontend.resilience import (
+    DeadlineExceeded,
+    candidate_models,
+    get_task_policy,
+    hedged_call,
+)
+from toshokan.frontend.routing import (
+    UsageCallback,
+    get_task_profile,
+    profile_call_kwargs,
+    resolve_task_model,
+    task_usage,
+)
+from toshokan.frontend.session import get_user_id
+from toshokan.frontend.throttling import ProviderThrottled, provider_limits
+
+
+@tracing.traced('llm.invoke')
+def invoke(
+    runtime_config: dict,
+    messages: list[AnyMessage],
+    task: str,
+    request: gr.Request | None = None,
+    priority: Priority = Priority.INTERACTIVE,
+    schema: type[BaseModel] | None = None,
+    **kwargs,
+):
+    """Run a model call for *task*.
+
+    Every handler goes through here: the call is admitted by the LLM gateway,
+    then sent to the task's model (see ``TASK_PROFILES``) with the task's
+    deadline, hedging to fallback models when it's slow or failing. Provider
+    requests are held to the adaptive limit of their model and key, and
+    retried when throttled (see ``throttling``). With *schema* the
+    structured output is returned instead of a message.
+
+    Calls from a browser session go through ``inflight_calls``: a new call
+    supersedes the session's running one for the same view, and an
+    identical call made within the dedupe window shares its response.
+    """
+    policy = get_task_policy(task)
+    candidates = candidate_models(resolve_task_model(task, runtime_config), policy)
+    call_kwargs = {**profile_call_kwargs(get_task_profile(task)), **kwargs}
+    usage = UsageCallback()
+    callbacks = [usage, *tracing.langchain_callbacks(task)]
+    tracing.set_attributes(**{'toshokan.task': task, 'gen_ai.request.model': candidates[0], 'enduser.id': get_user_id(request)})
+
+    async def call(model_name):
+        model = get_model(runtime_config, model_name)
+        if schema is not None:
+            model = model.with_structured_output(schema)
+        limiter = provider_limits.get('openrouter', upstream_model_name(model_name), resolve_api_key(runtime_config))
+        return await limiter.call(lambda: model.ainvoke(messages, config={'callbacks': callbacks}, **call_kwargs))
+
+    tracked = None
+    session_id = session_id_of(request)
+    if session_id is not None:
+        input_fingerprint = fingerprint(messages, task, schema, tuple(candidates), repr(sorted(call_kwargs.items())))
+        tracked, duplicate = inflight_calls.begin(session_id, task, input_fingerprint)
+        if duplicate:
+            try:
+                return tracked.outcome.result(timeout=policy.deadline)[1]
+            except concurrent.futures.TimeoutError:
+                raise gr.Error(f'No model answered the {task} request within {policy.deadline:.0f}s') from None
+    try:
+        with gateway.slot(get_user_id(request), priority=priority, task=task) as wait:
+            tracing.record_span('llm.gateway_wait', time.time() - wait, time.time())
+            started_at = time.monotonic()
+            if tracked is None:
+                model_name, result = aio.run(hedged_call(candidates, call, task, policy))
+            else:
+                model_name, result = inflight_calls.run(tracked, lambda: aio.submit(hedged_call(candidates, call, task, policy)))
+            task_usage.record(task, model_name, time.monotonic() - started_at, usage)
+            tracing.set_attributes(**{
+                'gen_ai.response.model': model_name,
+                'gen_ai.usage.input_tokens': usage.input_tokens,
+                'gen_ai.usage.output_tokens': usage.output_tokens,
+                'toshokan.cost': usage.cost,
+            })
+            return result
+    # the single place a tracked call fails: whatever went wrong, the
+    # duplicates waiting for it get the same error as this caller
+    except (GatewayOverloaded, DeadlineExceeded, ProviderThrottled) as e:
+        error = gr.Error(str(e))
+        if tracked is not None:
+            inflight_calls.fail(tracked, error)
+        raise error from e
+    except BaseException as e:
+        if tracked is not None:
+            inflight_calls.fail(tracked, e)
+        raise
@@ -0,0 +1,92 @@
+import math
+import threading
+from collections import deque
+
+
+# Number of most recent observations kept per histogram for percentiles
+HISTOGRAM_WINDOW = 1024
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    label_str = ','.join(f'{k}={v}' for k, v in sorted(labels.items()))
+    return f'{name}{{{label_str}}}'
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile of *values* (``q`` in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class _Histogram:
+    __slots__ = ('count', 'total', 'max', 'window')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.window = deque(maxlen=HISTOGRAM_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.window.append(value)
+
+    def summary(self) -> dict:
+        values = list(self.window)
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+        }
+
+
+class Metrics:
+    """In-process counters and histograms, exposed as JSON on ``/metrics``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._histograms: dict[str, _Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(value)
+
+    def histogram(self, name: str, **labels) -> dict | None:
+        with self._lock:
+            histogram = self._histograms.get(_key(name, labels))
+            return histogram.summary() if histogram else None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {k: h.summary() for k, h in self._histograms.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = Metrics()
@@ -1,15 +1,24 @@
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import HTTPConnection
 from fastapi.responses import RedirectResponse
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2AuthorizationCodeBearer
-from gradio.context import LocalContext
+import asyncio
+import hashlib
+import hmac
+import logging
 import os
 import jwt
 import httpx
 from datetime import datetime, timezone
+from toshokan.frontend import tracing
+from toshokan.frontend.middleware.static import is_static_path
 
 
 COGNITO_INTEGRATE = os.environ.get('COGNITO_INTEGRATE', 'false').lower() == 'true'
+# Keys that scripts send in the X-API-Key header to use /metrics and the JSON API (/api/v1)
+API_KEYS = tuple(key.strip() for key in os.environ.get('API_KEYS', '').split(',') if key.strip())
+# Without Cognito, let requests without a key use them too (local development)
+API_ALLOW_UNAUTHENTICATED = os.environ.get('API_ALLOW_UNAUTHENTICATED', 'false').lower() == 'true'
 
 if COGNITO_INTEGRATE:
     ENVIRONMENT = os.environ['ENVIRONMENT']
@@ -26,6 +35,16 @@ else:
         "", "", "", "", "", "", "", ""
     )
 
+_jwks_client = None
+
+
+def _get_jwks_client() -> jwt.PyJWKClient:
+    global _jwks_client
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(JWKS_URL)
+    return _jwks_client
+
+
 oauth2_scheme = OAuth2AuthorizationCodeBearer(authorizationUrl=f"{COGNITO_DOMAIN}/login", tokenUrl=f"{COGNITO_DOMAIN}/oauth2/token")
 
 
@@ -35,8 +54,8 @@ async def get_current_user(
 ):
     # Verify the JWT token
     try:
-        jwks_client = jwt.PyJWKClient(JWKS_URL)
-        signing_key = jwks_client.get_signing_key_from_jwt(id_token)
+        # the JWKS is cached by the client; fetching it blocks, so off the event loop
+        signing_key = await asyncio.to_thread(_get_jwks_client().get_signing_key_from_jwt, id_token)
 
         if signing_key:
 
@@ -62,71 +81,144 @@ async def get_current_user(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Could not validate credentials")
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-
-        if not COGNITO_INTEGRATE:
-            LocalContext.session_info = {"cognito_id": "dev_user", "email": "dev_user@example.com"}
-            return await call_next(request)
-
-        # List of routes that don't require authentication
-        open_routes = [
-            "/login",
-            "/login_done",
-            "/logout_done",
-            "/logout",
-            "/health",
-            "/favicon.ico",
-            "/dashboard/favicon.ico"
-            ]
-
-        if request.url.path in open_routes:
-            # Skip middleware and continue to the requested route
-            return await call_next(request)
-
-        response_session_close = RedirectResponse(url="/login")
-        response_session_close.delete_cookie(key="id_token")
-        response_session_close.delete_cookie(key="access_token")
-        response_session_close.delete_cookie(key="refresh_token")
-
-        try:
-            # Perform the token validation logic here
-            id_token = request.cookies.get("id_token")
-            access_token = request.cookies.get("access_token")
-
-            if not id_token or not access_token:
-                return response_session_close
+# Routes that don't require authentication
+OPEN_ROUTES = frozenset({
+    "/login",
+    "/login_done",
+    "/logout_done",
+    "/logout",
+    "/health",
+    "/ready",
+    # authenticated by the refresh token cookie it exchanges
+    "/refresh_tokens",
+    "/favicon.ico",
+    "/dashboard/favicon.ico",
+})
+
+# Routes for scripts, which can authenticate with an API key instead of the login cookies
+API_ROUTE_PREFIXES = ("/metrics", "/api/")
+
+DEV_SESSION_INFO = {"cognito_id": "dev_user", "email": "dev_user@example.com"}
+
+
+def api_key_identity(connection: HTTPConnection) -> dict | None:
+    """The identity of the request's API key, or None without a valid one."""
+    api_key = connection.headers.get("x-api-key")
+    if not api_key or not any(hmac.compare_digest(api_key.encode(), key.encode()) for key in API_KEYS):
+        return None
+    # keys are only kept hashed; the id is also the user fair queuing and the API cache go by
+    return {"cognito_id": f"api-key-{hashlib.sha256(api_key.encode()).hexdigest()[:12]}", "email": None}
+
+
+def require_api_access(request: Request):
+    """Dependency of the script routes: a signed-in user, a valid API key, or local development."""
+    if getattr(request.state, "session_info", None) is not None:
+        return
+    session_info = api_key_identity(request)
+    if session_info is not None:
+        request.state.session_info = session_info
+        return
+    if not COGNITO_INTEGRATE and API_ALLOW_UNAUTHENTICATED:
+        return
+    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="API key required", headers={"WWW-Authenticate": "X-API-Key"})
+
+
+def login_redirect() -> RedirectResponse:
+    response = RedirectResponse(url="/login")
+    response.delete_cookie(key="id_token")
+    response.delete_cookie(key="access_token")
+    response.delete_cookie(key="refresh_token")
+    return response
+
+
+async def authenticate(connection: HTTPConnection, set_cookies: list[str] | None = None) -> dict | None:
+    """The identity of the request's session cookies, or None when the user has to log in again.
+
+    When the tokens had to be refreshed, the ``Set-Cookie`` headers with the
+    new ones are appended to *set_cookies*, for the response to the browser.
+    """
+    if not COGNITO_INTEGRATE:
+        return DEV_SESSION_INFO
 
-            # Decode token without verification to check expiration
-            payload = jwt.decode(id_token, options={"verify_signature": False})
-            exp = payload.get("exp")
-            if exp and datetime.fromtimestamp(exp, timezone.utc) <= datetime.now(timezone.utc):
-
-                # Token has expired, attempt to refresh
-                refresh_response = await httpx.AsyncClient().get(f"https://{APP_HOST}:{APP_PORT}/refresh_tokens")
-
-                if refresh_response.status_code != 200:
-                    # Refresh failed, redirect to login
-                    return response_session_close
-
-                if refresh_response.status_code == 200:
-                    # Update tokens from the refreshed cookies
-                    cookies = refresh_response.cookies
-                    id_token = cookies.get("id_token")
-                    access_token = cookies.get("access_token")
-                else:
-                    # Refresh failed, redirect to login
-                    return response_session_close
-
-            user = await get_current_user(id_token, access_token)
-
-            session_info = user
-            LocalContext.session_info = session_info
-
-            response = await call_next(request)
-
-            return response
-
-        except Exception as e:
-            print(f"HTTPException: {e}")
-            return response_session_close
+    try:
+        id_token = connection.cookies.get("id_token")
+        access_token = connection.cookies.get("access_token")
+
+        if not id_token or not access_token:
+            return None
+
+        # Decode token without verification to check expiration
+        payload = jwt.decode(id_token, options={"verify_signature": False})
+        exp = payload.get("exp")
+        if exp and datetime.fromtimestamp(exp, timezone.utc) <= datetime.now(timezone.utc):
+
+            # Token has expired, attempt to refresh
+            with tracing.span('auth.refresh_tokens'):
+                async with httpx.AsyncClient() as client:
+                    refresh_response = await client.get(
+                        f"https://{APP_HOST}:{APP_PORT}/refresh_tokens",
+                        cookies={"refresh_token": connection.cookies.get("refresh_token", "")},
+                    )
+
+            if refresh_response.status_code != 200:
+                # Refresh failed, redirect to login
+                return None
+
+            # Update tokens from the refreshed cookies
+            cookies = refresh_response.cookies
+            id_token = cookies.get("id_token")
+            access_token = cookies.get("access_token")
+            if set_cookies is not None:
+                set_cookies.extend(refresh_response.headers.get_list("set-cookie"))
+
+        with tracing.span('auth.verify_token'):
+            return await get_current_user(id_token, access_token)
+
+    except Exception as e:
+        logging.warning(f"Authentication failed: {e!r}")
+        return None
+
+
+class AuthMiddleware:
+    """Checks the session cookies and puts the user in the request scope.
+
+    The identity is stored in ``scope['state']['session_info']``, which is
+    what ``request.state.session_info`` reads. A pure ASGI middleware: the
+    response, including Gradio's event stream, goes straight to the client.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        path = scope['path']
+        if path in OPEN_ROUTES or (scope['method'] in ('GET', 'HEAD') and is_static_path(path)):
+            # Gradio's own JS/CSS bundles are public; user files (file=) are not static
+            return await self.app(scope, receive, send)
+
+        connection = HTTPConnection(scope)
+        session_info = api_key_identity(connection) if path.startswith(API_ROUTE_PREFIXES) else None
+        refreshed_cookies = []
+        if session_info is None:
+            session_info = await authenticate(connection, refreshed_cookies)
+        if session_info is None:
+            return await login_redirect()(scope, receive, send)
+
+        # per-request, used to key fair queuing in the LLM gateway
+        scope.setdefault('state', {})['session_info'] = session_info
+        if not refreshed_cookies:
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookies(message):
+            # the browser keeps the refreshed tokens instead of refreshing on every request
+            if message['type'] == 'http.response.start':
+                message = {**message, 'headers': [
+                    *message.get('headers', []),
+                    *((b'set-cookie', cookie.encode('latin-1')) for cookie in refreshed_cookies),
+                ]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookies)
@@ -0,0 +1,242 @@
+"""Compression and browser caching for the dashboard's static assets.
+
+Gradio's JS/CSS bundles are content-hashed (``Index-CYFTcOx-.js``), so
+they're served with ``immutable`` caching. Gradio compresses them again on
+every request; here they're compressed once and kept in memory. Other static files get ``STATIC_MAX_AGE_SECONDS``. Other responses
+are compressed when they're sent in one piece (pages, config, JSON);
+streamed responses (the queue's server-sent events, NDJSON batches, file
+downloads) pass through untouched so nothing is held back.
+
+Brotli is used when the ``brotli`` package is installed and the browser
+accepts it, gzip otherwise.
+"""
+import asyncio
+import gzip
+import os
+import re
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+
+STATIC_ASSETS_ENABLED = os.environ.get('STATIC_ASSETS_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', '6'))
+# Memory for compressed static assets
+STATIC_CACHE_MAX_BYTES = int(os.environ.get('STATIC_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Browser cache lifetime of static files without a content hash
+STATIC_MAX_AGE_SECONDS = int(os.environ.get('STATIC_MAX_AGE_SECONDS', '86400'))
+
+# Gradio's routes for files shipped with it; none of them serves user data
+STATIC_PREFIXES = ('/assets/', '/static/', '/svelte/')
+STATIC_FILES = ('/favicon.ico',)
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+HASHED_NAME = re.compile(r'-[\w-]{8}\.(?:js|mjs|css)(?:\.map)?$')
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript', 'application/json', 'image/svg+xml')
+# large bodies are compressed off the event loop
+INLINE_COMPRESSION_MAX_BYTES = 256 * 1024
+
+
+def is_static_path(path: str, prefix: str = '/dashboard') -> bool:
+    """Whether *path* is one of Gradio's bundled assets, which are public.
+
+    Anything that could step outside the asset directories (``..``, encoded
+    separators) or reach Gradio's file routes (``file=``) is not static.
+    """
+    if '..' in path or '%' in path or '=' in path or '//' in path:
+        return False
+    if path in STATIC_FILES:
+        return True
+    if not path.startswith(prefix + '/'):
+        return False
+    path = path[len(prefix):]
+    return path in STATIC_FILES or path.startswith(STATIC_PREFIXES)
+
+
+def _accepted_encoding(headers: list[tuple[bytes, bytes]]) -> str | None:
+    for name, value in headers:
+        if name == b'accept-encoding':
+            accepted = {part.split(';')[0].strip() for part in value.decode('latin-1').lower().split(',')}
+            if brotli is not None and 'br' in accepted:
+                return 'br'
+            if 'gzip' in accepted:
+                return 'gzip'
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESSION_LEVEL)
+    return gzip.compress(body, compresslevel=COMPRESSION_LEVEL)
+
+
+def _header(headers: list[tuple[bytes, bytes]], name: bytes) -> bytes | None:
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+def _etag_matches(if_none_match: bytes | None, etag: bytes) -> bool:
+    # weak comparison, as for GET requests
+    if if_none_match is None:
+        return False
+    candidates = {tag.strip().removeprefix(b'W/') for tag in if_none_match.split(b',')}
+    return b'*' in candidates or etag.removeprefix(b'W/') in candidates
+
+
+def _with_headers(headers: list[tuple[bytes, bytes]], **updates) -> list[tuple[bytes, bytes]]:
+    names = {name.replace('_', '-').encode() for name in updates}
+    kept = [(key, value) for key, value in headers if key not in names]
+    return kept + [(name.replace('_', '-').encode(), value.encode()) for name, value in updates.items() if value is not None]
+
+
+class _AssetCache:
+    """Compressed static responses, least recently used dropped beyond ``max_bytes``."""
+
+    def __init__(self, max_bytes: int = STATIC_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[tuple, tuple[list, bytes]] = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, headers, body):
+        if len(body) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous[1])
+        self._entries[key] = (headers, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, (_, dropped) = self._entries.popitem(last=False)
+            self.size -= len(dropped)
+
+
+class StaticAssetsMiddleware:
+    """Compresses responses and sets cache headers on static assets."""
+
+    def __init__(self, app, prefix: str = '/dashboard'):
+        self.app = app
+        self.prefix = prefix
+        self.cache = _AssetCache()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return await self.app(scope, receive, send)
+
+        path = scope['path']
+        encoding = _accepted_encoding(scope['headers'])
+        if is_static_path(path, self.prefix):
+            cache_control = IMMUTABLE if HASHED_NAME.search(path) else f'public, max-age={STATIC_MAX_AGE_SECONDS}'
+            if scope['method'] == 'GET':
+                return await self._static(scope, receive, send, encoding, cache_control)
+            return await self.app(scope, receive, self._adding_headers(send, cache_control=cache_control))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        await self._compressing(scope, receive, send, encoding)
+
+    @staticmethod
+    def _adding_headers(send, **headers):
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start' and message['status'] == 200:
+                message = {**message, 'headers': _with_headers(message['headers'], **headers)}
+            await send(message)
+        return send_with_headers
+
+    async def _static(self, scope, receive, send, encoding, cache_control):
+        key = (scope['path'], scope['query_string'], encoding)
+        cached = self.cache.get(key)
+        if cached is None:
+            # uncompressed from Gradio, to compress (and cache) here
+            headers = [(name, value) for name, value in scope['headers'] if name != b'accept-encoding']
+            start, body = await self._collect({**scope, 'headers': headers}, receive)
+            headers = start['headers']
+            if start['status'] != 200 or _header(headers, b'content-encoding') is not None:
+                await send(start)
+                await send({'type': 'http.response.body', 'body': body})
+                return
+            content_type = (_header(headers, b'content-type') or b'').decode('latin-1')
+            content_encoding = None
+            if encoding is not None and content_type.startswith(COMPRESSIBLE_TYPES) and len(body) >= COMPRESSION_MIN_BYTES:
+                body = await asyncio.to_thread(_compress, body, encoding)
+                content_encoding = encoding
+            etag = _header(headers, b'etag')
+            if content_encoding is not None and etag is not None and not etag.startswith(b'W/'):
+                # the compressed bytes differ from the file the strong ETag describes
+                etag = b'W/' + etag
+            headers = _with_headers(
+                headers, cache_control=cache_control, content_encoding=content_encoding,
+                content_length=str(len(body)), vary='Accept-Encoding',
+                etag=etag.decode('latin-1') if etag is not None else None,
+            )
+            self.cache.put(key, headers, body)
+            cached = headers, body
+
+        headers, body = cached
+        etag = _header(headers, b'etag')
+        if etag is not None and _etag_matches(_header(scope['headers'], b'if-none-match'), etag):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': _with_headers(
+                [], etag=etag.decode('latin-1'), cache_control=cache_control, vary='Accept-Encoding')})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _collect(self, scope, receive):
+        """Run the app and gather the whole response (static files are bounded)."""
+        start = None
+        chunks = []
+
+        async def collect(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                start = message
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.app(scope, receive, collect)
+        return start, b''.join(chunks)
+
+    async def _compressing(self, scope, receive, send, encoding):
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                # held back until the first body part shows whether it's streamed
+                start = message
+                return
+            if start is None:
+                return await send(message)
+            pending, start = start, None
+            body = message.get('body', b'')
+            headers = pending['headers']
+            content_type = (_header(headers, b'content-type') or b'').decode('latin-1')
+            if (
+                message['type'] != 'http.response.body'
+                or message.get('more_body', False)
+                or len(body) < COMPRESSION_MIN_BYTES
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+                or _header(headers, b'content-encoding') is not None
+            ):
+                await send(pending)
+                return await send(message)
+            if len(body) > INLINE_COMPRESSION_MAX_BYTES:
+                body = await asyncio.to_thread(_compress, body, encoding)
+            else:
+                body = _compress(body, encoding)
+            await send({**pending, 'headers': _with_headers(
+                headers, content_encoding=encoding, content_length=str(len(body)), vary='Accept-Encoding')})
+            await send({**message, 'body': body})
+
+        await self.app(scope, receive, send_compressed)
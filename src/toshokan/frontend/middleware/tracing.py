@@ -0,0 +1,22 @@
+from toshokan.frontend import tracing
+
+
+class TracingMiddleware:
+    """Opens the root span of every HTTP request; only added when tracing is on."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        with tracing.server_span(scope['method'], scope['path'], headers) as span:
+
+            async def send_with_status(message):
+                if message['type'] == 'http.response.start':
+                    span.set_attribute('http.response.status_code', message['status'])
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
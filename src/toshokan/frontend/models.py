@@ -1,204 +1,200 @@
 from .openrouter import ChatOpenRouter
+from toshokan.frontend.transport import shared_transport
+from collections import OrderedDict
 import os
-
-
-def ensure_openrouter_api_key(
-    model: ChatOpenRouter
-) -> bool:
-    return os.environ.get('OPENROUTER_API_KEY') is not None
+import threading
+import time
+import httpx
+
+
+# Maximum number of API keys that keep a warm set of model clients
+MODEL_POOL_MAX_KEYS = int(os.environ.get('MODEL_POOL_MAX_KEYS', '64'))
+# Seconds after which an unused key has its clients dropped
+MODEL_POOL_IDLE_SECONDS = float(os.environ.get('MODEL_POOL_IDLE_SECONDS', '300'))
+
+# dropdown name -> (openrouter model name, temperature)
+MODEL_SPECS = {
+    'anthropic/claude-3.5-sonnet': ('anthropic/claude-3.5-sonnet', 0.0),
+    'anthropic/claude-3-opus': ('anthropic/claude-3-opus', 0.0),
+    'ai21/jamba-1-5-large': ('ai21/jamba-1-5-large', 0.0),
+    'google/gemini-pro-1.5': ('google/gemini-pro-1.5', 0.0),
+    'openai/gpt-4o-2024-11-20': ('openai/gpt-4o-2024-11-20', 0.0),
+    'openai/gpt-4o': ('openai/gpt-4o', 0.0),
+    'openai/gpt-4o (0.7)': ('openai/gpt-4o', 0.7),
+    'openai/gpt-4o-mini-2024-07-18': ('openai/gpt-4o-mini-2024-07-18', 0.0),
+    'openai/o3-mini': ('openai/o3-mini', 0.0),
+    'meta-llama/llama-3.1-70b-instruct': ('meta-llama/llama-3.1-70b-instruct', 0.0),
+    'meta-llama/llama-3.1-405b-instruct': ('meta-llama/llama-3.1-405b-instruct', 0.0),
+    'deepseek/deepseek-chat': ('deepseek/deepseek-chat', 0.0),
+    'mistralai/mixtral-8x22b-instruct': ('mistralai/mixtral-8x22b-instruct', 0.0),
+    'mistralai/mistral-large': ('mistralai/mistral-large', 0.0),
+    'qwen/qwen-turbo': ('qwen/qwen-turbo', 0.0),
+}
 
 
 def get_available_model_names():
     """Return just the model names for dropdown without initializing models"""
-    return [
-        'anthropic/claude-3.5-sonnet',
-        'anthropic/claude-3-opus', 
-        'ai21/jamba-1-5-large',
-        'google/gemini-pro-1.5',
-        'openai/gpt-4o-2024-11-20',
-        'openai/gpt-4o',
-        'openai/gpt-4o (0.7)',
-        'openai/gpt-4o-mini-2024-07-18',
-        'openai/o3-mini',
-        'meta-llama/llama-3.1-70b-instruct',
-        'meta-llama/llama-3.1-405b-instruct',
-        'deepseek/deepseek-chat',
-        'mistralai/mixtral-8x22b-instruct',
-        'mistralai/mistral-large',
-        'qwen/qwen-turbo'
-    ]
-
-
-def reload_models():
-    models = {}
-
-    # Always use the current environment variable value
-    api_key = os.environ.get('OPENROUTER_API_KEY')
-
-    models['anthropic/claude-3.5-sonnet'] = ChatOpenRouter(
-        model_name='anthropic/claude-3.5-sonnet',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'anthropic/claude-3.5-sonnet'
-        }
-    )
-    models['anthropic/claude-3-opus'] = ChatOpenRouter(
-        model_name='anthropic/claude-3-opus',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'anthropic/claude-3-opus'
-        }
-    )
+    return list(MODEL_SPECS)
 
-    models['ai21/jamba-1-5-large'] = ChatOpenRouter(
-        model_name='ai21/jamba-1-5-large',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'ai21/jamba-1-5-large'
-        }
-    )
 
-    models['google/gemini-pro-1.5'] = ChatOpenRouter(
-        model_name='google/gemini-pro-1.5',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'google/gemini-pro-1.5'
-        }
-    )
+def upstream_model_name(
+    model_name: str,
+) -> str:
+    """The provider's id of a dropdown model; variants with another temperature share it."""
+    return MODEL_SPECS[model_name][0]
 
-    models['openai/gpt-4o-2024-11-20'] = ChatOpenRouter(
-        model_name='openai/gpt-4o-2024-11-20',
-        temperature=0.0,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'openai/gpt-4o-2024-11-20'
-        }
-    )
-
-    models['openai/gpt-4o'] = ChatOpenRouter(
-        model_name='openai/gpt-4o',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'openai/gpt-4o'
-        }
-    )
 
-    models['openai/gpt-4o (0.7)'] = ChatOpenRouter(
-        model_name='openai/gpt-4o',
-        temperature=0.7,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'openai/gpt-4o'
-        }
-    )
-    models['openai/gpt-4o-mini-2024-07-18'] = ChatOpenRouter(
-        model_name='openai/gpt-4o-mini-2024-07-18',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'openai/gpt-4o-mini-2024-07-18'
-        }
-    )
+def resolve_api_key(
+    runtime_config: dict,
+) -> str | None:
+    """Return the user's OpenRouter key, falling back to the server-wide one from the env."""
+    return runtime_config.get('openrouter_api_key') or os.environ.get('OPENROUTER_API_KEY')
 
-    models['openai/o3-mini'] = ChatOpenRouter(
-        model_name='openai/o3-mini',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'openai/o3-mini'
-        }
-    )
 
-    models['openai/gpt-4o-mini-2024-07-18'] = ChatOpenRouter(
-        model_name='openai/gpt-4o-mini-2024-07-18',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'openai/gpt-4o-2024-08-06'
-        }
-    )
-
-    models['meta-llama/llama-3.1-70b-instruct'] = ChatOpenRouter(
-        model_name='meta-llama/llama-3.1-70b-instruct',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'meta-llama/llama-3.1-70b-instruct'
-        }
-    )
-
-    models['meta-llama/llama-3.1-405b-instruct'] = ChatOpenRouter(
-        model_name='meta-llama/llama-3.1-405b-instruct',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'meta-llama/llama-3.1-405b-instruct'
-        }
-    )
-
-    models['deepseek/deepseek-chat'] = ChatOpenRouter(
-        model_name='deepseek/deepseek-chat',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'deepseek/deepseek-chat'
-        }
-    )
-
-    models['mistralai/mixtral-8x22b-instruct'] = ChatOpenRouter(
-        model_name='mistralai/mixtral-8x22b-instruct',
-        temperature=0.0,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'mistralai/mixtral-8x22b-instruct'
-        }
-    )
-
-    models['mistralai/mistral-large'] = ChatOpenRouter(
-        model_name='mistralai/mistral-large',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'mistralai/mistral-large'
-        }
-    )
-
-    models['qwen/qwen-turbo'] = ChatOpenRouter(
-        model_name='qwen/qwen-turbo',
-        temperature=0.0,
-        openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'qwen/qwen-turbo'
-        }
-    )
-
-    models['deepseek/deepseek-chat'] = ChatOpenRouter(
-        model_name='deepseek/deepseek-chat',
-        temperature=0.0,
+def ensure_openrouter_api_key(
+    runtime_config: dict,
+) -> bool:
+    return resolve_api_key(runtime_config) is not None
+
+
+def create_model(
+    model_name: str,
+    api_key: str | None,
+    http_client: httpx.Client | None = None,
+    http_async_client: httpx.AsyncClient | None = None,
+) -> ChatOpenRouter:
+    openrouter_model_name, temperature = MODEL_SPECS[model_name]
+    return ChatOpenRouter(
+        model_name=openrouter_model_name,
+        temperature=temperature,
         openai_api_key=api_key,
-        metadata={
-            'ls_provider': 'openrouter',
-            'ls_model_name': 'deepseek/deepseek-chat'
-        }
-    )
-
-    return models
+        http_client=http_client,
+        http_async_client=http_async_client,
+        # the connect and default read timeouts of the shared transport; TASK_PROFILES override the read timeout
+        timeout=shared_transport.timeout,
+        # retried with backoff by the provider limiters, see throttling.py
+        max_retries=0,
+        # ask OpenRouter to report the cost of each call in its usage block
+        extra_body={'usage': {'include': True}},
+        metadata={
+            'ls_provider': 'openrouter',
+            'ls_model_name': openrouter_model_name
+        }
+    )
+
+
+class _PoolEntry:
+    __slots__ = ('models', 'last_used')
+
+    def __init__(self):
+        self.models: dict[str, ChatOpenRouter] = {}
+        self.last_used = time.monotonic()
+
+
+class ModelPool:
+    """Model clients pooled per API key.
+
+    The clients of all keys send their requests through the shared transport,
+    so connections are reused across keys and models; the key only travels in
+    the request headers. At most ``max_keys`` keys are
+    kept (least recently used are evicted first) and keys idle for longer than
+    ``idle_seconds`` are reaped by a background thread. *factory* builds the
+    clients and defaults to :func:`create_model`.
+    """
+
+    def __init__(
+        self,
+        max_keys: int = MODEL_POOL_MAX_KEYS,
+        idle_seconds: float = MODEL_POOL_IDLE_SECONDS,
+        factory=create_model,
+    ):
+        self.factory = factory
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self._entries: OrderedDict[str, _PoolEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper: threading.Thread | None = None
+        self.evictions = 0
+
+    def get(
+        self,
+        api_key: str,
+        model_name: str,
+    ) -> ChatOpenRouter:
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry is None:
+                entry = self._entries[api_key] = _PoolEntry()
+                while len(self._entries) > self.max_keys:
+                    _, old_entry = self._entries.popitem(last=False)
+                    evicted.append(old_entry)
+            else:
+                self._entries.move_to_end(api_key)
+            entry.last_used = time.monotonic()
+
+            model = entry.models.get(model_name)
+            if model is None:
+                model = entry.models[model_name] = self.factory(
+                    model_name, api_key, shared_transport.http_client, shared_transport.http_async_client)
+
+        self._close(evicted)
+        self._ensure_reaper()
+        return model
+
+    def reap(self) -> int:
+        """Drop keys that have been idle for longer than ``idle_seconds``."""
+        deadline = time.monotonic() - self.idle_seconds
+        idle = []
+        with self._lock:
+            for api_key, entry in list(self._entries.items()):
+                if entry.last_used < deadline:
+                    idle.append(self._entries.pop(api_key))
+        self._close(idle)
+        return len(idle)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'keys': len(self._entries),
+                'models': sum(len(e.models) for e in self._entries.values()),
+                'max_keys': self.max_keys,
+                'evictions': self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        self._close(entries, count=False)
+
+    def _close(self, entries, count=True):
+        for entry in entries:
+            # the connections belong to the shared transport and stay open
+            entry.models.clear()
+        if count:
+            self.evictions += len(entries)
+
+    def _ensure_reaper(self):
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name='model-pool-reaper', daemon=True)
+                self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(self.idle_seconds / 4, 1.0))
+            self.reap()
+
+
+model_pool = ModelPool()
+
+
+def get_model(
+    runtime_config: dict,
+    model_name: str | None = None,
+) -> ChatOpenRouter:
+    """Return a pooled client for *model_name* (the user's selected model by default)."""
+    return model_pool.get(resolve_api_key(runtime_config), model_name or runtime_config['model_name'])
@@ -4,11 +4,15 @@ import os
 from langchain_openai import ChatOpenAI
 
 
+# Overridable so the app can be pointed at a local mock server
+OPENROUTER_API_BASE = os.environ.get('OPENROUTER_API_BASE', 'https://openrouter.ai/api/v1')
+
+
 class ChatOpenRouter(ChatOpenAI):
     def __init__(self,
                  model_name: str,
                  openai_api_key: Optional[SecretStr] = None,
-                 openai_api_base: str = 'https://openrouter.ai/api/v1',
+                 openai_api_base: str = OPENROUTER_API_BASE,
                  **kwargs):
         # Set a dummy API key if none provided to avoid validation errors
         # The actual key will be set when the model is used
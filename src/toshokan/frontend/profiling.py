@@ -0,0 +1,124 @@
+"""Time-boxed profiles of the live process, for the admin endpoints in ``app.py``.
+
+Nothing runs until a profile is requested: the sampler thread and
+tracemalloc only exist for the duration of one profile.
+"""
+import os
+import sys
+import sysconfig
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from functools import lru_cache
+
+
+# Comma-separated emails allowed to use the profiling endpoints
+PROFILING_ADMIN_EMAILS = frozenset(
+    email.strip().lower() for email in os.environ.get('PROFILING_ADMIN_EMAILS', '').split(',') if email.strip()
+)
+# Without Cognito nobody is signed in; set to allow profiling anyway (local development)
+PROFILING_ALLOW_UNAUTHENTICATED = os.environ.get('PROFILING_ALLOW_UNAUTHENTICATED', 'false').lower() == 'true'
+PROFILING_MAX_SECONDS = float(os.environ.get('PROFILING_MAX_SECONDS', '60'))
+
+MIN_INTERVAL_SECONDS = 0.001
+
+_STDLIB_PREFIX = sysconfig.get_paths()['stdlib'] + os.sep
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def is_admin(session_info: dict | None) -> bool:
+    if session_info is None:
+        return PROFILING_ALLOW_UNAUTHENTICATED
+    return (session_info.get('email') or '').lower() in PROFILING_ADMIN_EMAILS
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    if filename.startswith(_STDLIB_PREFIX):
+        return filename[len(_STDLIB_PREFIX):]
+    for marker in ('site-packages/', 'src/'):
+        index = filename.rfind(marker)
+        if index >= 0:
+            return filename[index + len(marker):]
+    return os.path.basename(filename)
+
+
+def _frame_label(code) -> str:
+    return f'{code.co_qualname} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+
+
+def sample_stacks(seconds: float, interval: float) -> tuple[Counter, int]:
+    """Sample the stacks of all other threads every *interval* for *seconds*.
+
+    Returns folded stacks (root first, ``;``-separated, prefixed with the
+    thread name) with their sample counts, and the number of sampling rounds.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy('A profile is already running')
+    try:
+        own_id = threading.get_ident()
+        stacks = Counter()
+        rounds = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, f'thread-{thread_id}'))
+                stacks[';'.join(reversed(labels))] += 1
+            rounds += 1
+            time.sleep(interval)
+        return stacks, rounds
+    finally:
+        _running.release()
+
+
+def folded(stacks: Counter) -> str:
+    """Brendan Gregg's folded format, read by flamegraph.pl, speedscope and inferno."""
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+def allocation_snapshot(seconds: float, limit: int = 50, frames: int = 16) -> dict:
+    """Memory allocated during the next *seconds* and still alive, by call site."""
+    if tracemalloc.is_tracing():
+        raise ProfilerBusy('tracemalloc is already tracing')
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy('A profile is already running')
+    try:
+        tracemalloc.start(frames)
+        try:
+            time.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        _running.release()
+
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    statistics = snapshot.statistics('traceback')
+    return {
+        'seconds': seconds,
+        'traced_bytes': traced,
+        'peak_bytes': peak,
+        'call_sites': [
+            {
+                'size_bytes': statistic.size,
+                'count': statistic.count,
+                # innermost frame first
+                'traceback': [f'{_short_path(frame.filename)}:{frame.lineno}' for frame in reversed(statistic.traceback)],
+            }
+            for statistic in statistics[:limit]
+        ],
+    }
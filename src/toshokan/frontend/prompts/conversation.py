@@ -32,6 +32,11 @@ Important rules to keep in mind:
 - In addition to formal correctness, you can add notes about sounding natural.
 """
 
+CONVERSATION_SYSTEM_ANNOTATED_PROMPT = CONVERSATION_SYSTEM_PROMPT + """
+Together with your response, list every word in your response that contains a kanji which is in
+neither known_kanji nor scheduled_kanji, with its hiragana notation and an explanation in English.
+"""
+
 CONVERSATION_SYSTEM_INITIALIZE_PROMPT = """
 You are an experienced Japanese teacher. You are working with a student who is learning Japanese.
 
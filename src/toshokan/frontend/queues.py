@@ -0,0 +1,87 @@
+import inspect
+import logging
+import os
+import gradio as gr
+
+
+# Concurrent LLM-backed events. The gateway limits actual model calls; this
+# bounds the worker threads parked in handlers and must stay below the
+# threadpool size (40 by default) so unqueued UI events always get a thread.
+GRADIO_LLM_CONCURRENCY = int(os.environ.get('GRADIO_LLM_CONCURRENCY', 32))
+# Concurrent configuration and progress file saves/loads and CSV uploads
+GRADIO_IO_CONCURRENCY = int(os.environ.get('GRADIO_IO_CONCURRENCY', 4))
+# Events waiting in all queues together before new ones are turned away
+GRADIO_QUEUE_MAX_SIZE = int(os.environ.get('GRADIO_QUEUE_MAX_SIZE', 512))
+
+# Event listener settings. LLM events share one concurrency group and show
+# their queue position and ETA; pure UI updates skip the queue altogether in
+# the browser. API clients (gradio_client) always go through the queue, where
+# UI events get their own unbounded group instead of gradio's default of 1.
+LLM_EVENT = {'concurrency_id': 'llm', 'concurrency_limit': GRADIO_LLM_CONCURRENCY, 'show_progress': 'full'}
+IO_EVENT = {'concurrency_id': 'io', 'concurrency_limit': GRADIO_IO_CONCURRENCY}
+UI_EVENT = {'queue': False, 'concurrency_id': 'ui', 'concurrency_limit': None}
+
+# Private Gradio internals hooked in tracing.instrument_blocks, as of
+# Gradio 5.38 to 5.50; other versions run without event tracing
+PUSH_PARAMETERS = ['self', 'body', 'request', 'username']
+PROCESS_API_PARAMETERS = ('block_fn', 'request', 'event_id')
+
+
+def _parameters(function) -> list[str] | None:
+    try:
+        return list(inspect.signature(function).parameters)
+    except (TypeError, ValueError):
+        return None
+
+
+def queue_internals_supported(
+    blocks: gr.Blocks,
+    feature: str,
+    process_api: bool = False,
+) -> bool:
+    """Whether the queue internals *feature* wraps look as expected; warns when they don't.
+
+    Gradio's own methods are checked, not wrappers installed on the instance.
+    """
+    queue = getattr(blocks, '_queue', None)
+    push = getattr(type(queue), 'push', None)
+    supported = (
+        push is not None
+        and _parameters(push) == PUSH_PARAMETERS
+        and 'queue_full' in str(inspect.signature(push).return_annotation)
+        and isinstance(getattr(queue, 'event_queue_per_concurrency_id', None), dict)
+    )
+    if supported and process_api:
+        parameters = _parameters(type(blocks).process_api) or []
+        supported = all(name in parameters for name in PROCESS_API_PARAMETERS) and hasattr(queue, 'event_analytics')
+    if not supported:
+        logging.warning(f'{feature} turned off: the queue internals of Gradio {gr.__version__} are not the ones it was written for')
+    return supported
+
+
+def configure_queue(
+    blocks: gr.Blocks,
+) -> gr.Blocks:
+    """Enable the queue with the global size limit.
+
+    Each event's concurrency group and limit are set on its listener (see
+    ``LLM_EVENT`` and ``IO_EVENT``); a full queue is reported to the client
+    as "queue is full". Bursts of model calls are bounded further by the
+    LLM gateway's queue limits.
+    """
+    return blocks.queue(max_size=GRADIO_QUEUE_MAX_SIZE, status_update_rate='auto')
+
+
+def queue_stats(blocks: gr.Blocks) -> dict:
+    """Waiting and running events per concurrency group."""
+    event_queues = getattr(getattr(blocks, '_queue', None), 'event_queue_per_concurrency_id', None)
+    if not isinstance(event_queues, dict):
+        return {}
+    return {
+        concurrency_id: {
+            'queued': len(event_queue.queue),
+            'running': event_queue.current_concurrency,
+            'limit': event_queue.concurrency_limit,
+        }
+        for concurrency_id, event_queue in event_queues.items()
+    }
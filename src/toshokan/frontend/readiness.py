@@ -0,0 +1,160 @@
+"""Readiness: whether this instance should be sent more traffic.
+
+``/health`` only says the process is up. ``/ready`` goes unready (503)
+while the instance is saturated, so load balancers and autoscalers route
+around it instead of piling more users onto a blocked event loop or a
+full worker pool.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+
+# Longest the event loops may have been late within the last few seconds
+READY_MAX_LOOP_LAG_MS = float(os.environ.get('READY_MAX_LOOP_LAG_MS', '250'))
+# Share of the worker threads (Gradio's sync handlers) that may be busy
+READY_MAX_THREADPOOL_UTILIZATION = float(os.environ.get('READY_MAX_THREADPOOL_UTILIZATION', '0.9'))
+# Gradio events waiting in all queues together
+READY_MAX_QUEUED_EVENTS = int(os.environ.get('READY_MAX_QUEUED_EVENTS', '64'))
+# Model calls waiting for an LLM gateway slot
+READY_MAX_GATEWAY_QUEUED = int(os.environ.get('READY_MAX_GATEWAY_QUEUED', '32'))
+# Stay unready until the model clients for the server's key are created
+READY_REQUIRE_WARM_MODELS = os.environ.get('READY_REQUIRE_WARM_MODELS', 'false').lower() == 'true'
+# Models whose clients are created at startup; defaults to the dashboard's default and LLM_FAST_MODEL
+READY_WARM_MODELS = [name.strip() for name in os.environ.get('READY_WARM_MODELS', '').split(',') if name.strip()]
+
+LOOP_LAG_INTERVAL_SECONDS = 0.25
+LOOP_LAG_SAMPLES = 20
+LLM_LOOP_PROBE_TIMEOUT_SECONDS = 1.0
+
+
+class LoopLagMonitor:
+    """Measures how late the running event loop wakes up from a short sleep."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS, samples: int = LOOP_LAG_SAMPLES):
+        self.interval = interval
+        self._lags = deque(maxlen=samples)
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started_at = loop.time()
+            await asyncio.sleep(self.interval)
+            self._lags.append(max(0.0, loop.time() - started_at - self.interval))
+
+    @property
+    def lag(self) -> float:
+        """Worst lag in the last ``samples`` intervals, seconds."""
+        return max(self._lags, default=0.0)
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+_warm_models: set[str] = set()
+
+
+def warm_model_clients():
+    """Create the pooled clients for the server's key and open the provider connections,
+    so the first users don't pay for it."""
+    from toshokan.frontend.models import model_pool, resolve_api_key
+    from toshokan.frontend.routing import LLM_FAST_MODEL
+    from toshokan.frontend.transport import shared_transport
+
+    api_key = resolve_api_key({})
+    started_at = time.monotonic()
+    if api_key is not None:
+        for model_name in READY_WARM_MODELS or ['openai/gpt-4o', LLM_FAST_MODEL]:
+            model_pool.get(api_key, model_name)
+            _warm_models.add(model_name)
+        logging.info(f'Model clients warm after {time.monotonic() - started_at:.2f}s')
+    shared_transport.warm()
+
+
+def warm_token_encoding():
+    """Load the tokenizer that counts prompt tokens, so no request waits for its download."""
+    from toshokan.frontend.compaction import load_token_encoding
+
+    load_token_encoding()
+
+
+async def _llm_loop_lag() -> float | None:
+    """Time for the background LLM loop to run a no-op, if it's been started."""
+    from toshokan.frontend import aio
+
+    loop = aio.get_loop_if_started()
+    if loop is None:
+        return None
+    started_at = time.monotonic()
+    try:
+        await asyncio.wait_for(
+            asyncio.wrap_future(asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop)),
+            LLM_LOOP_PROBE_TIMEOUT_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        pass
+    return time.monotonic() - started_at
+
+
+def _threadpool() -> dict:
+    from anyio.to_thread import current_default_thread_limiter
+
+    limiter = current_default_thread_limiter()
+    return {'busy': limiter.borrowed_tokens, 'size': limiter.total_tokens}
+
+
+async def check(dashboard_ready: bool, blocks=None) -> dict:
+    """Collect the load signals; ``ready`` is false when any is over its threshold."""
+    loop_lag = loop_lag_monitor.lag
+    if not dashboard_ready:
+        # the modules below are imported with the dashboard, don't block the loop on them
+        return {'ready': False, 'reasons': ['dashboard is still loading'], 'event_loop_lag_ms': loop_lag * 1000}
+
+    from toshokan.frontend.gateway import gateway
+    from toshokan.frontend.models import model_pool
+    from toshokan.frontend.queues import queue_stats
+
+    reasons = []
+    llm_loop_lag = await _llm_loop_lag()
+    for name, lag in (('event loop', loop_lag), ('LLM event loop', llm_loop_lag)):
+        if lag is not None and lag * 1000 > READY_MAX_LOOP_LAG_MS:
+            reasons.append(f'{name} lag {lag * 1000:.0f}ms > {READY_MAX_LOOP_LAG_MS:.0f}ms')
+
+    threadpool = _threadpool()
+    utilization = threadpool['busy'] / threadpool['size'] if threadpool['size'] else 0.0
+    if utilization > READY_MAX_THREADPOOL_UTILIZATION:
+        reasons.append(f"worker threads {threadpool['busy']}/{threadpool['size']} busy")
+
+    queues = queue_stats(blocks) if blocks is not None else {}
+    queued_events = sum(group['queued'] for group in queues.values())
+    if queued_events > READY_MAX_QUEUED_EVENTS:
+        reasons.append(f'{queued_events} events queued > {READY_MAX_QUEUED_EVENTS}')
+
+    gateway_stats = gateway.stats()
+    if gateway_stats['queued'] > READY_MAX_GATEWAY_QUEUED:
+        reasons.append(f"{gateway_stats['queued']} model calls queued > {READY_MAX_GATEWAY_QUEUED}")
+
+    models_warm = bool(_warm_models)
+    if READY_REQUIRE_WARM_MODELS and not models_warm:
+        reasons.append('model clients are not warm yet')
+
+    return {
+        'ready': not reasons,
+        'reasons': reasons,
+        'event_loop_lag_ms': loop_lag * 1000,
+        'llm_event_loop_lag_ms': llm_loop_lag * 1000 if llm_loop_lag is not None else None,
+        'threadpool': {**threadpool, 'utilization': utilization},
+        'queues': queues,
+        'gateway': {'in_flight': gateway_stats['in_flight'], 'queued': gateway_stats['queued'], 'max_concurrency': gateway_stats['max_concurrency']},
+        'models': {'warm': sorted(_warm_models), **model_pool.stats()},
+    }
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, NamedTuple
+from toshokan.frontend.metrics import metrics, percentile
+from toshokan.frontend.models import get_available_model_names
+from toshokan.frontend.throttling import is_transient
+
+
+# Models tried, in order, when the selected one is slow or failing
+LLM_FALLBACK_MODELS = [
+    name.strip()
+    for name in os.environ.get('LLM_FALLBACK_MODELS', 'openai/gpt-4o-mini-2024-07-18,anthropic/claude-3.5-sonnet,openai/gpt-4o').split(',')
+    if name.strip()
+]
+# Latency quantile of the primary model after which a hedge request is sent
+LLM_HEDGE_QUANTILE = float(os.environ.get('LLM_HEDGE_QUANTILE', '95'))
+# Observations needed before the quantile replaces the task's static hedge delay
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.environ.get('LLM_HEDGE_MIN_DELAY_SECONDS', '1'))
+# Consecutive failed or slow calls after which a model is routed around
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', '3'))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('LLM_BREAKER_COOLDOWN_SECONDS', '30'))
+
+
+class TaskPolicy(NamedTuple):
+    deadline: float
+    hedge_after: float
+    fallbacks: tuple[str, ...] | None = None
+
+
+# deadline: seconds before the call is given up on
+# hedge_after: hedge delay used until enough latency samples exist
+# fallbacks: None means LLM_FALLBACK_MODELS, () disables fallback
+TASK_POLICIES = {
+    'exercise': TaskPolicy(deadline=90, hedge_after=20),
+    'conversation': TaskPolicy(deadline=60, hedge_after=12),
+    'conversation_annotated': TaskPolicy(deadline=75, hedge_after=15),
+    'conversation_situation': TaskPolicy(deadline=30, hedge_after=8),
+    'kanji_listing': TaskPolicy(deadline=30, hedge_after=6),
+    'kanji_annotation': TaskPolicy(deadline=30, hedge_after=8),
+    'word': TaskPolicy(deadline=60, hedge_after=12),
+    'breakdown': TaskPolicy(deadline=60, hedge_after=15),
+    'aux': TaskPolicy(deadline=90, hedge_after=20),
+}
+DEFAULT_TASK_POLICY = TaskPolicy(deadline=60, hedge_after=12)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class LatencyTracker:
+    """Rolling window of call latencies per (model, task).
+
+    Calls that lost a hedge or missed the deadline are recorded with the time
+    they had run when cancelled, a lower bound of their latency; leaving them
+    out would bias the quantile towards the fast calls.
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: dict[tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, task: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get((model_name, task))
+            if samples is None:
+                samples = self._samples[(model_name, task)] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def quantile(self, model_name: str, task: str, q: float) -> float | None:
+        with self._lock:
+            samples = list(self._samples.get((model_name, task), ()))
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(samples, q)
+
+
+class CircuitBreaker:
+    """Routes around models after ``failures`` consecutive bad calls.
+
+    A bad call is a transient error (timeout, connection error, 429, 5xx), a
+    deadline miss, or losing a hedge race after running past its hedge
+    threshold. Errors caused by the request or a session's key don't count:
+    one user's bad key mustn't route everyone around a model. An open
+    breaker lets traffic through again after ``cooldown`` seconds; one more
+    bad call re-opens it, a good one closes it.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN_SECONDS):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._consecutive: dict[str, int] = {}
+        self._opened_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def is_available(self, model_name: str) -> bool:
+        with self._lock:
+            opened_at = self._opened_at.get(model_name)
+        return opened_at is None or time.monotonic() - opened_at >= self.cooldown
+
+    def record_success(self, model_name: str):
+        with self._lock:
+            self._consecutive.pop(model_name, None)
+            self._opened_at.pop(model_name, None)
+
+    def record_failure(self, model_name: str):
+        with self._lock:
+            count = self._consecutive[model_name] = self._consecutive.get(model_name, 0) + 1
+            if count < self.failures:
+                return
+            self._opened_at[model_name] = time.monotonic()
+        metrics.inc('llm_breaker_open_total', model=model_name)
+        logging.warning(f'Circuit breaker open for {model_name} after {count} bad calls')
+
+    def open_models(self) -> list[str]:
+        with self._lock:
+            return [m for m in self._opened_at if time.monotonic() - self._opened_at[m] < self.cooldown]
+
+
+latency_tracker = LatencyTracker()
+circuit_breaker = CircuitBreaker()
+
+
+def get_task_policy(task: str) -> TaskPolicy:
+    return TASK_POLICIES.get(task, DEFAULT_TASK_POLICY)
+
+
+def candidate_models(
+    primary: str,
+    policy: TaskPolicy,
+) -> list[str]:
+    """The primary followed by its fallbacks, skipping models whose breaker is open."""
+    available = set(get_available_model_names())
+    fallbacks = LLM_FALLBACK_MODELS if policy.fallbacks is None else policy.fallbacks
+    chain = [primary] + [m for m in fallbacks if m != primary and m in available]
+    healthy = [m for m in chain if circuit_breaker.is_available(m)]
+    # if everything is failing the primary is still the best guess
+    return healthy or [primary]
+
+
+def hedge_delay(
+    model_name: str,
+    task: str,
+    policy: TaskPolicy,
+) -> float:
+    observed = latency_tracker.quantile(model_name, task, LLM_HEDGE_QUANTILE)
+    if observed is None:
+        return policy.hedge_after
+    return min(max(observed, LLM_HEDGE_MIN_DELAY_SECONDS), policy.deadline / 2)
+
+
+async def hedged_call(
+    candidates: list[str],
+    make_call: Callable[[str], Awaitable],
+    task: str,
+    policy: TaskPolicy,
+):
+    """Call ``candidates[0]``, hedging to the next candidate when it's slow.
+
+    A hedge is sent when the running call passes the model's latency
+    quantile for *task*, or straight away when it fails. The first
+    successful response wins and the other calls are cancelled, which
+    closes their HTTP requests. Returns ``(model_name, result)``.
+    """
+    loop = asyncio.get_running_loop()
+    deadline_at = loop.time() + policy.deadline
+    remaining = iter(candidates)
+    # task -> (model, started at, hedge threshold)
+    pending: dict[asyncio.Task, tuple[str, float, float]] = {}
+    last_error: BaseException | None = None
+
+    def start_next() -> float | None:
+        model_name = next(remaining, None)
+        if model_name is None:
+            return None
+        if pending:
+            metrics.inc('llm_hedge_total', task=task, model=model_name)
+        delay = hedge_delay(model_name, task, policy)
+        pending[asyncio.ensure_future(make_call(model_name))] = (model_name, loop.time(), delay)
+        return loop.time() + delay
+
+    next_hedge_at = start_next()
+    try:
+        while pending:
+            wake_at = deadline_at if next_hedge_at is None else min(next_hedge_at, deadline_at)
+            done, _ = await asyncio.wait(pending, timeout=max(0.0, wake_at - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+
+            for finished in done:
+                model_name, started_at, _ = pending.pop(finished)
+                if finished.exception() is not None:
+                    last_error = finished.exception()
+                    if is_transient(last_error):
+                        circuit_breaker.record_failure(model_name)
+                    metrics.inc('llm_call_errors_total', task=task, model=model_name)
+                    logging.warning(f'{task} call to {model_name} failed: {last_error!r}')
+                    continue
+
+                elapsed = loop.time() - started_at
+                latency_tracker.record(model_name, task, elapsed)
+                circuit_breaker.record_success(model_name)
+                metrics.observe('llm_call_seconds', elapsed, task=task, model=model_name)
+                if model_name != candidates[0]:
+                    metrics.inc('llm_fallback_wins_total', task=task, model=model_name)
+                for loser, (loser_name, loser_started_at, threshold) in pending.items():
+                    loser.cancel()
+                    loser_elapsed = loop.time() - loser_started_at
+                    latency_tracker.record(loser_name, task, loser_elapsed)
+                    # a hedge that just started and lost to a call already in flight isn't slow
+                    if loser_elapsed > threshold:
+                        circuit_breaker.record_failure(loser_name)
+                pending.clear()
+                return model_name, finished.result()
+
+            if loop.time() >= deadline_at:
+                for model_name, started_at, _ in pending.values():
+                    latency_tracker.record(model_name, task, loop.time() - started_at)
+                    circuit_breaker.record_failure(model_name)
+                metrics.inc('llm_deadline_exceeded_total', task=task)
+                raise DeadlineExceeded(f'No model answered the {task} request within {policy.deadline:.0f}s')
+
+            if next_hedge_at is not None and (not pending or loop.time() >= next_hedge_at):
+                next_hedge_at = start_next()
+
+        raise last_error
+    finally:
+        for leftover in pending:
+            leftover.cancel()
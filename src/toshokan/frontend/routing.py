@@ -0,0 +1,117 @@
+import os
+import threading
+from typing import NamedTuple
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from toshokan.frontend.models import MODEL_SPECS
+
+
+# Small, fast model used for auxiliary structured sub-tasks
+LLM_FAST_MODEL = os.environ.get('LLM_FAST_MODEL', 'openai/gpt-4o-mini-2024-07-18')
+if LLM_FAST_MODEL not in MODEL_SPECS:
+    raise ValueError(f'LLM_FAST_MODEL must be one of the models in MODEL_SPECS, not {LLM_FAST_MODEL!r}')
+
+
+class ModelProfile(NamedTuple):
+    model_name: str | None = None
+    temperature: float | None = None
+    max_tokens: int | None = None
+    timeout: float | None = None
+
+
+# model_name None means the model the user selected in the Library tab;
+# other None fields leave the model's defaults in place. timeout applies to
+# each provider request, the task's overall deadline is in resilience.py.
+# Structured tasks get no max_tokens: a cut-off answer fails to parse, and
+# their output grows with the input (a long sentence has many kanji).
+TASK_PROFILES = {
+    'exercise': ModelProfile(),
+    'conversation': ModelProfile(),
+    'conversation_annotated': ModelProfile(),
+    'word': ModelProfile(),
+    'breakdown': ModelProfile(),
+    'aux': ModelProfile(),
+    'kanji_listing': ModelProfile(LLM_FAST_MODEL, temperature=0.0, timeout=15),
+    'kanji_annotation': ModelProfile(LLM_FAST_MODEL, temperature=0.0, timeout=20),
+    'conversation_situation': ModelProfile(LLM_FAST_MODEL, timeout=20),
+}
+
+
+def get_task_profile(task: str) -> ModelProfile:
+    return TASK_PROFILES.get(task, ModelProfile())
+
+
+def resolve_task_model(
+    task: str,
+    runtime_config: dict,
+) -> str:
+    return get_task_profile(task).model_name or runtime_config['model_name']
+
+
+def profile_call_kwargs(
+    profile: ModelProfile,
+) -> dict:
+    """Per-call overrides passed through to the provider request."""
+    return {
+        key: value
+        for key, value in (('temperature', profile.temperature), ('max_tokens', profile.max_tokens), ('timeout', profile.timeout))
+        if value is not None
+    }
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Collects token usage (and OpenRouter's reported cost) of the calls it's attached to."""
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+    def on_llm_end(self, response: LLMResult, **kwargs):
+        token_usage = (response.llm_output or {}).get('token_usage') or {}
+        self.input_tokens += token_usage.get('prompt_tokens') or 0
+        self.output_tokens += token_usage.get('completion_tokens') or 0
+        self.cost += token_usage.get('cost') or 0.0
+
+
+class TaskUsageLedger:
+    """Latency and cost totals per task, to see where time and money go."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks: dict[str, dict] = {}
+
+    def record(self, task: str, model_name: str, seconds: float, usage: UsageCallback):
+        with self._lock:
+            entry = self._tasks.get(task)
+            if entry is None:
+                entry = self._tasks[task] = {'calls': 0, 'seconds': 0.0, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0, 'models': {}}
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['input_tokens'] += usage.input_tokens
+            entry['output_tokens'] += usage.output_tokens
+            entry['cost'] += usage.cost
+            entry['models'][model_name] = entry['models'].get(model_name, 0) + 1
+
+    def average_tokens(self, task: str, output_only: bool = False) -> float:
+        """Tokens of an average *task* call so far, to estimate what a skipped call saved."""
+        with self._lock:
+            entry = self._tasks.get(task)
+            if not entry:
+                return 0.0
+            tokens = entry['output_tokens'] if output_only else entry['input_tokens'] + entry['output_tokens']
+            return tokens / entry['calls']
+
+    def report(self) -> dict:
+        with self._lock:
+            tasks = {task: {**entry, 'models': dict(entry['models'])} for task, entry in self._tasks.items()}
+        total_seconds = sum(e['seconds'] for e in tasks.values()) or 1.0
+        total_cost = sum(e['cost'] for e in tasks.values()) or 1.0
+        for entry in tasks.values():
+            entry['avg_seconds'] = entry['seconds'] / entry['calls']
+            entry['latency_share'] = entry['seconds'] / total_seconds
+            entry['cost_share'] = entry['cost'] / total_cost
+        return tasks
+
+
+task_usage = TaskUsageLedger()
@@ -22,3 +22,9 @@ class ConversationKanjiResponse(BaseModel):
 class ConversationResponse(BaseModel):
     response: str = Field(description="Your response to the user's message (in Japanese)")
     notes: str = Field(description="Notes to the user about the response (in English)")
+
+
+class ConversationAnnotatedResponse(BaseModel):
+    response: str = Field(description="Your response to the user's message (in Japanese)")
+    notes: str = Field(description="Notes to the user about the response (in English)")
+    unknown_kanji: list[UnknownKanji] = Field(description="Words in your response containing kanji that are neither known nor scheduled")
@@ -0,0 +1,25 @@
+import gradio as gr
+
+
+ANONYMOUS_USER_ID = 'anonymous'
+
+
+def get_session_info(
+    request: gr.Request | None,
+) -> dict | None:
+    """Return the identity ``AuthMiddleware`` attached to the request, if any."""
+    if request is None or request.request is None:
+        return None
+    return getattr(request.request.state, 'session_info', None)
+
+
+def get_user_id(
+    request: gr.Request | None,
+) -> str:
+    session_info = get_session_info(request)
+    if session_info:
+        return session_info['cognito_id']
+    # Without auth every browser session is its own user
+    if request is not None and request.session_hash:
+        return request.session_hash
+    return ANONYMOUS_USER_ID
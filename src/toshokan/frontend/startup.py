@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable
+from starlette.responses import HTMLResponse
+
+
+# Serve /health right away and build the dashboard in the background
+FAST_START = os.environ.get('FAST_START', 'false').lower() == 'true'
+
+STARTING_PAGE = """<!doctype html>
+<html>
+<head><meta charset="utf-8"><meta http-equiv="refresh" content="2"><title>Toshokan (図書館)</title></head>
+<body style="font-family: sans-serif; text-align: center; margin-top: 20vh">
+<h2>Toshokan (図書館)</h2>
+<p>Starting up, this page will reload in a moment...</p>
+</body>
+</html>
+"""
+
+
+class DeferredMount:
+    """ASGI app mounted in place of the Gradio app until it's been built.
+
+    Until :meth:`load` finishes, requests are answered with a 503 page that
+    reloads itself; afterwards they go straight to the Gradio app. The app
+    is built in a worker thread so the event loop keeps serving /health.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.load_seconds: float | None = None
+        self.failed = False
+        self._stop = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.app is not None
+
+    async def __call__(self, scope, receive, send):
+        if self.app is not None:
+            await self.app(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await send({'type': 'websocket.close', 'code': 1013})
+        elif self.failed:
+            response = HTMLResponse('The dashboard failed to start, see the server logs.', status_code=500)
+            await response(scope, receive, send)
+        else:
+            response = HTMLResponse(STARTING_PAGE, status_code=503, headers={'Retry-After': '2'})
+            await response(scope, receive, send)
+
+    def start(self, build_host: Callable, path: str):
+        """Start loading; *build_host* returns a FastAPI app with Gradio mounted at *path*."""
+        self._task = asyncio.create_task(self.load(build_host, path))
+
+    async def load(self, build_host: Callable, path: str):
+        started_at = time.monotonic()
+        try:
+            host = await asyncio.to_thread(build_host)
+            gradio_app = next(route.app for route in host.routes if getattr(route, 'path', None) == path)
+            # gradio starts its queue from the host app's lifespan
+            async with host.router.lifespan_context(host):
+                self.app = gradio_app
+                self.load_seconds = time.monotonic() - started_at
+                logging.info(f'Dashboard ready after {self.load_seconds:.2f}s')
+                await self._stop.wait()
+        except Exception:
+            self.failed = True
+            logging.exception('Building the dashboard failed')
+            raise
+
+    async def close(self):
+        self._stop.set()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
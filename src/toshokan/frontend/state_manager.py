@@ -1,20 +1,27 @@
-from typing import Optional
 import json
-import pandas as pd
+import os
 import gradio as gr
 from gradio_agentchatbot_5 import ChatMessage
-
-
-# df conversion helpers
-
-def _serialize_chat_message(chat_message: ChatMessage) -> dict:
-    """Convert a ChatMessage object to a serializable dictionary."""
-    return {
-        'role': chat_message.role,
-        'content': chat_message.content,
-        'metadata': getattr(chat_message, 'metadata', {})
-    }
-
+from toshokan.frontend.archive import (
+    ArchiveError,
+    exercise_progress_exporter,
+    is_archive,
+    read_config,
+    read_exercise_progress,
+    session_export_dir,
+    write_config,
+)
+from toshokan.frontend.catalog import (
+    Catalog,
+    CatalogError,
+    catalog_from_rows,
+    LESSON_COLUMNS,
+    SELECTED_LESSON_COLUMNS,
+    EXERCISE_TYPE_COLUMNS,
+)
+
+
+# legacy (plain JSON) progress files
 
 def _deserialize_chat_message(data: dict) -> ChatMessage:
     """Convert a dictionary back to a ChatMessage object."""
@@ -25,20 +32,6 @@ def _deserialize_chat_message(data: dict) -> ChatMessage:
     )
 
 
-def _serialize_chat_data(chat_data) -> list[dict]:
-    """Convert chat data (list of ChatMessage objects) to serializable format."""
-    if not chat_data:
-        return []
-    serialized = []
-    for message in chat_data:
-        if isinstance(message, ChatMessage):
-            serialized.append(_serialize_chat_message(message))
-        else:
-            # If it's already a dict or other serializable format
-            serialized.append(message)
-    return serialized
-
-
 def _deserialize_chat_data(serialized_data: list[dict]) -> list[ChatMessage]:
     """Convert serialized chat data back to ChatMessage objects."""
     if not serialized_data:
@@ -53,45 +46,44 @@ def _deserialize_chat_data(serialized_data: list[dict]) -> list[ChatMessage]:
     return chat_messages
 
 
-def _df_to_records(df: Optional[pd.DataFrame]) -> list[dict]:
-    """Safely convert a DataFrame to a list-of-dicts records representation.
+def _session_id(request: gr.Request | None) -> str:
+    return getattr(request, 'session_hash', None) or 'default'
+
 
-    Returns an empty list if *df* is ``None`` or empty.
-    """
-    if df is not None and isinstance(df, pd.DataFrame) and not df.empty:
-        return df.to_dict(orient="records")
-    return []
+def _read_export(path: str, reader) -> dict:
+    """Read a compressed export, or a plain JSON file saved by older versions."""
+    if not is_archive(path):
+        with open(path, 'r') as file:
+            return json.load(file)
+    try:
+        return reader(path)
+    except (ArchiveError, OSError, ValueError) as e:
+        raise gr.Error(f'Could not read the file: {e}')
 
 
-def _records_to_df(records: list[dict]) -> pd.DataFrame:
-    """Convert a list of dicts into a DataFrame – returns an empty DF for
-    falsy/empty input so callers can always rely on getting a DataFrame.
-    """
-    return pd.DataFrame(records or [])
+def _read_catalog(path: str, columns: tuple[str, ...]) -> Catalog:
+    try:
+        return Catalog.from_csv(path, columns)
+    except CatalogError as e:
+        raise gr.Error(f'Could not load the CSV file, {e}')
 
 
 def load_csv_into_df_lessons(
     lessons_file_path: str,
 ):
-    columns = ['Lesson', 'Description']
-    lessons_df = pd.read_csv(lessons_file_path, names=columns)
-    return lessons_df
+    return _read_catalog(lessons_file_path, LESSON_COLUMNS).rows()
 
 
 def load_csv_into_df_lessons_selected_for_conversation(
     lessons_selected_for_conversation_file_path: str,
 ):
-    columns = ['Lesson']
-    lessons_selected_for_conversation_df = pd.read_csv(lessons_selected_for_conversation_file_path, names=columns)
-    return lessons_selected_for_conversation_df
+    return _read_catalog(lessons_selected_for_conversation_file_path, SELECTED_LESSON_COLUMNS).rows()
 
 
 def load_csv_into_df_exercise_types(
     exercise_types_file_path: str,
 ):
-    columns = ['Exercise Type', 'Description']
-    exercise_types_df = pd.read_csv(exercise_types_file_path, names=columns)
-    return exercise_types_df
+    return _read_catalog(exercise_types_file_path, EXERCISE_TYPE_COLUMNS).rows()
 
 
 def load_csv_into_txt(
@@ -103,37 +95,36 @@ def load_csv_into_txt(
 
 def save_config(
     config: dict,
-    lessons_df: pd.DataFrame,
-    lessons_df_selected_for_conversation: pd.DataFrame,
-    exercise_types_df: pd.DataFrame,
+    lessons_df: list[list],
+    lessons_df_selected_for_conversation: list[list],
+    exercise_types_df: list[list],
     known_kanji_txt: str,
     scheduled_kanji_txt: str,
+    request: gr.Request = None,
 ) -> gr.DownloadButton:
 
-    config['lessons_df'] = _df_to_records(lessons_df)
-    config['lessons_df_selected_for_conversation'] = _df_to_records(lessons_df_selected_for_conversation)
-    config['exercise_types_df'] = _df_to_records(exercise_types_df)
+    config['lessons_df'] = catalog_from_rows(lessons_df, LESSON_COLUMNS).records()
+    config['lessons_df_selected_for_conversation'] = catalog_from_rows(lessons_df_selected_for_conversation, SELECTED_LESSON_COLUMNS).records()
+    config['exercise_types_df'] = catalog_from_rows(exercise_types_df, EXERCISE_TYPE_COLUMNS).records()
     config['known_kanji_txt'] = known_kanji_txt
     config['scheduled_kanji_txt'] = scheduled_kanji_txt
 
-    # save config to json file in /tmp/
-    with open('/tmp/toshokan_config.json', 'w') as file:
-        json.dump(config, file)
+    path = os.path.join(session_export_dir(_session_id(request)), 'toshokan_config.jsonl.gz')
+    write_config(path, config)
 
     return gr.DownloadButton(
-        value='/tmp/toshokan_config.json'
+        value=path
     )
 
 
 def load_config(
     config_file_path: str,
-) -> tuple[dict, pd.DataFrame, pd.DataFrame, pd.DataFrame, str, str]:
-    with open(config_file_path, 'r') as file:
-        config = json.load(file)
+) -> tuple[dict, list[list], list[list], list[list], str, str]:
+    config = _read_export(config_file_path, read_config)
 
-    lessons_df = _records_to_df(config['lessons_df'])
-    lessons_df_selected_for_conversation = _records_to_df(config['lessons_df_selected_for_conversation'])
-    exercise_types_df = _records_to_df(config['exercise_types_df'])
+    lessons_df = Catalog.from_records(config['lessons_df'], LESSON_COLUMNS).rows()
+    lessons_df_selected_for_conversation = Catalog.from_records(config['lessons_df_selected_for_conversation'], SELECTED_LESSON_COLUMNS).rows()
+    exercise_types_df = Catalog.from_records(config['exercise_types_df'], EXERCISE_TYPE_COLUMNS).rows()
     known_kanji_txt = config['known_kanji_txt']
     scheduled_kanji_txt = config['scheduled_kanji_txt']
 
@@ -169,28 +160,22 @@ def exercise_state_to_chat(
 
 def save_exercise_progress(
     exercise_state: dict,
+    request: gr.Request = None,
 ):
-    # Serialize the exercise_state to handle ChatMessage objects
-    serialized_state = {}
-    for key, value in exercise_state.items():
-        if isinstance(value, list):
-            # Check if it's a list of ChatMessage objects
-            serialized_state[key] = _serialize_chat_data(value)
-        else:
-            serialized_state[key] = value
-
-    # save exercise_chat to json file in /tmp/
-    with open('/tmp/toshokan_exercise_progress.json', 'w') as file:
-        json.dump(serialized_state, file)
+    # appends to this session's previous export when it can
+    path = exercise_progress_exporter.export(exercise_state, _session_id(request))
 
     return gr.DownloadButton(
-        value='/tmp/toshokan_exercise_progress.json'
+        value=path
     )
 
 
 def load_exercise_progress(
     exercise_progress_path_file: str,
 ):
+    if is_archive(exercise_progress_path_file):
+        return _read_export(exercise_progress_path_file, read_exercise_progress)
+
     with open(exercise_progress_path_file, 'r') as file:
         serialized_state = json.load(file)
 
@@ -0,0 +1,256 @@
+"""Adaptive concurrency towards the provider, per (provider, model, API key).
+
+Each limiter allows ``limit`` requests in flight and adjusts it with AIMD:
+every successful response raises it by ``1 / limit`` (about one per round
+of requests), and a 429 or 503 cuts it by ``LLM_AIMD_DECREASE`` (once per
+round, not once per failed request of a burst). Rate-limit headers are read
+from every response: when the provider says no requests are left, or sends
+``Retry-After``, new requests wait until the reset time.
+
+Requests over the limit wait for a free slot rather than fail; the task's
+deadline in ``hedged_call`` still applies. Throttled and transient failures
+are retried with full-jitter exponential backoff, so the model clients are
+created with ``max_retries=0``.
+"""
+import asyncio
+import contextvars
+import email.utils
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+import openai
+from toshokan.frontend.metrics import metrics
+
+
+LLM_AIMD_INITIAL_LIMIT = float(os.environ.get('LLM_AIMD_INITIAL_LIMIT', '8'))
+LLM_AIMD_MIN_LIMIT = float(os.environ.get('LLM_AIMD_MIN_LIMIT', '1'))
+LLM_AIMD_MAX_LIMIT = float(os.environ.get('LLM_AIMD_MAX_LIMIT', '64'))
+# Factor the limit is multiplied by when the provider throttles
+LLM_AIMD_DECREASE = float(os.environ.get('LLM_AIMD_DECREASE', '0.5'))
+# Attempts per model call, the first included
+LLM_RETRY_MAX_ATTEMPTS = int(os.environ.get('LLM_RETRY_MAX_ATTEMPTS', '4'))
+LLM_RETRY_BASE_SECONDS = float(os.environ.get('LLM_RETRY_BASE_SECONDS', '0.5'))
+LLM_RETRY_MAX_SECONDS = float(os.environ.get('LLM_RETRY_MAX_SECONDS', '8'))
+
+# Limiters kept; idle ones of the least recently used keys are dropped beyond this
+MAX_LIMITERS = 1024
+
+THROTTLE_STATUSES = frozenset({429, 503})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_DURATION_PART = re.compile(r'([\d.]+)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+# the limiter of the model call running in this task, for the transport's response hook
+current_limiter: contextvars.ContextVar['AdaptiveLimiter | None'] = contextvars.ContextVar('current_limiter', default=None)
+
+
+class ProviderThrottled(Exception):
+    pass
+
+
+def _seconds_until(value: str | None) -> float | None:
+    """Seconds until a reset given as a delay ("1.5s", "6m0s", "30"), an epoch or an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if parts:
+            return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+        try:
+            return email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    if number > 1e12:  # epoch milliseconds (OpenRouter)
+        return number / 1000 - time.time()
+    if number > 1e9:
+        return number - time.time()
+    return number
+
+
+def _status_of(error: BaseException) -> int | None:
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, openai.APITimeoutError):
+        # slow rather than failing; hedging covers that
+        return False
+    # connection errors include stale keep-alive connections
+    return isinstance(error, openai.APIConnectionError) or _status_of(error) in RETRY_STATUSES
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether *error* is about the model's health rather than the request or its key.
+
+    Timeouts, connection errors, 429 and 5xx count; a 400, 401 or 402 caused
+    by one session's key or prompt says nothing about the model.
+    """
+    if isinstance(error, (ProviderThrottled, TimeoutError, openai.APIConnectionError)):
+        return True
+    status = _status_of(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    """Full jitter: uniform in [0, min(max, base * 2**attempt)], but not before Retry-After."""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, LLM_RETRY_MAX_SECONDS))
+    return delay
+
+
+class AdaptiveLimiter:
+    """AIMD limit on the requests in flight to one model with one key.
+
+    Only used from the LLM event loop (see ``aio``).
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model_name: str,
+        key_id: str,
+        initial: float = LLM_AIMD_INITIAL_LIMIT,
+        minimum: float = LLM_AIMD_MIN_LIMIT,
+        maximum: float = LLM_AIMD_MAX_LIMIT,
+    ):
+        self.name = f'{provider}|{model_name}|{key_id}'
+        self.model_name = model_name
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.queued = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._decreased_at = 0.0
+        self._waiters: list[asyncio.Future] = []
+
+    def _can_start(self) -> bool:
+        return self.in_flight < max(1, int(self.limit)) and time.monotonic() >= self.blocked_until
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the time the request was let through."""
+        self.queued += 1
+        try:
+            while not self._can_start():
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                blocked_for = self.blocked_until - time.monotonic()
+                try:
+                    await asyncio.wait_for(waiter, blocked_for if blocked_for > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started_at: float, throttled: bool = False, succeeded: bool = False):
+        # synchronous, so a cancelled call can't skip it
+        self.in_flight -= 1
+        if throttled:
+            self.throttled += 1
+            # one cut per round: requests that started before the last cut saw the old limit
+            if started_at >= self._decreased_at:
+                self.limit = max(self.minimum, self.limit * LLM_AIMD_DECREASE)
+                self._decreased_at = time.monotonic()
+                logging.info(f'Provider throttled {self.name}, concurrency limit now {self.limit:.1f}')
+        elif succeeded:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def observe_headers(self, headers):
+        """Honour the provider's rate-limit headers of a response."""
+        retry_after = _seconds_until(headers.get('retry-after'))
+        remaining = headers.get('x-ratelimit-remaining') or headers.get('x-ratelimit-remaining-requests')
+        if retry_after is None and remaining is not None and remaining.strip() == '0':
+            retry_after = _seconds_until(headers.get('x-ratelimit-reset') or headers.get('x-ratelimit-reset-requests'))
+        if retry_after is not None and retry_after > 0:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    async def call(self, make_request):
+        """Run ``make_request()`` within the limit, retrying throttled and transient failures."""
+        for attempt in range(LLM_RETRY_MAX_ATTEMPTS):
+            started_at = await self.acquire()
+            token = current_limiter.set(self)
+            throttled = succeeded = False
+            try:
+                result = await make_request()
+                succeeded = True
+                return result
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                throttled = _status_of(e) in THROTTLE_STATUSES
+                if attempt + 1 == LLM_RETRY_MAX_ATTEMPTS:
+                    if throttled:
+                        raise ProviderThrottled(f'{self.name} is rate limited, try again in a moment') from e
+                    raise
+                error = e
+            finally:
+                current_limiter.reset(token)
+                self.release(started_at, throttled=throttled, succeeded=succeeded)
+
+            response = getattr(error, 'response', None)
+            retry_after = _seconds_until(response.headers.get('retry-after')) if response is not None else None
+            delay = backoff_delay(attempt, retry_after)
+            metrics.inc('llm_retries_total', model=self.model_name, status=str(_status_of(error) or 'connection'))
+            logging.info(f'Retrying {self.name} in {delay:.2f}s after {error!r}')
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            'limit': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'blocked_for': max(0.0, round(self.blocked_until - time.monotonic(), 2)),
+            'throttled': self.throttled,
+        }
+
+
+class ProviderLimits:
+    """The limiters, created on first use."""
+
+    def __init__(self, max_limiters: int = MAX_LIMITERS):
+        self.max_limiters = max_limiters
+        self._limiters: OrderedDict[tuple, AdaptiveLimiter] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model_name: str, api_key: str | None) -> AdaptiveLimiter:
+        """The limiter of *model_name*, the provider's model id (not the dropdown name), and *api_key*."""
+        # keys are only kept hashed; the stats show a short prefix of the hash
+        key_id = hashlib.sha256((api_key or '').encode()).hexdigest()[:8]
+        with self._lock:
+            limiter = self._limiters.get((provider, model_name, key_id))
+            if limiter is None:
+                limiter = self._limiters[(provider, model_name, key_id)] = AdaptiveLimiter(provider, model_name, key_id)
+                for old_key, old in list(self._limiters.items()):
+                    if len(self._limiters) <= self.max_limiters:
+                        break
+                    if old.in_flight == 0 and old.queued == 0:
+                        del self._limiters[old_key]
+            else:
+                self._limiters.move_to_end((provider, model_name, key_id))
+            return limiter
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {limiter.name: limiter.stats() for limiter in self._limiters.values()}
+
+
+provider_limits = ProviderLimits()
@@ -0,0 +1,235 @@
+"""OpenTelemetry spans for user actions, from the HTTP request to the provider calls.
+
+Tracing is optional: it's off unless ``TRACING_EXPORTER`` is set, and needs
+``opentelemetry-sdk`` (plus ``opentelemetry-exporter-otlp`` for ``otlp``).
+While it's off the helpers here cost a global lookup.
+
+A traced user action looks like::
+
+    POST /dashboard/gradio_api/queue/join      (TracingMiddleware)
+      auth.verify_token
+      gradio.event run_the_conversation_chat   (from queue join to the response)
+        gradio.queue_wait
+        convert_messages
+        llm.invoke                             (toshokan.task=conversation)
+          llm.gateway_wait
+          chat openai/gpt-4o                   (LangChain callback, one per provider call)
+        llm.invoke                             (toshokan.task=kanji_listing)
+          ...
+"""
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from functools import wraps
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+try:
+    from opentelemetry import context as otel_context, propagate, trace
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:  # tracing is optional
+    trace = None
+
+
+# none, otlp (OTEL_EXPORTER_OTLP_* settings), file (JSON lines) or console
+TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', 'none').lower()
+# Share of user actions traced; spans follow their parent's decision
+TRACING_SAMPLE_RATIO = float(os.environ.get('TRACING_SAMPLE_RATIO', '0.05'))
+TRACING_FILE = os.environ.get('TRACING_FILE', os.path.join(tempfile.gettempdir(), 'toshokan_traces.jsonl'))
+
+# queue joins whose event hasn't started yet
+MAX_PENDING_EVENTS = 4096
+
+_tracer = None
+_NO_SPAN = nullcontext()
+_event_contexts: OrderedDict = OrderedDict()
+
+
+def _span_exporter(exporter: str):
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    if exporter == 'otlp':
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if exporter == 'file':
+        out = open(TRACING_FILE, 'a', encoding='utf-8')
+        return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + '\n')
+    if exporter == 'console':
+        return ConsoleSpanExporter()
+    raise ValueError(f'Unknown TRACING_EXPORTER {exporter!r}')
+
+
+def configure_tracing(
+    exporter: str = TRACING_EXPORTER,
+    sample_ratio: float = TRACING_SAMPLE_RATIO,
+) -> bool:
+    """Set up the tracer provider; returns whether tracing is on."""
+    global _tracer
+    if exporter == 'none':
+        return False
+    try:
+        from opentelemetry.sdk.resources import Resource, SERVICE_NAME
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        span_exporter = _span_exporter(exporter)
+    except (ImportError, ValueError) as e:
+        logging.warning(f'Tracing is off: {e}')
+        return False
+
+    provider = TracerProvider(
+        resource=Resource.create({SERVICE_NAME: os.environ.get('OTEL_SERVICE_NAME', 'toshokan')}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer('toshokan')
+    logging.info(f'Tracing {sample_ratio:.0%} of requests to {exporter}')
+    return True
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def _attributes(attributes: dict) -> dict:
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+def span(name: str, **attributes):
+    """Context manager for a child span of the current one."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.start_as_current_span(name, attributes=_attributes(attributes))
+
+
+def traced(name: str):
+    """Run the decorated function in a span called *name*."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _tracer.start_as_current_span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def set_attributes(**attributes):
+    """Add attributes to the current span."""
+    if _tracer is not None:
+        trace.get_current_span().set_attributes(_attributes(attributes))
+
+
+def record_span(name: str, start: float, end: float, **attributes):
+    """A span for a stage that's measured rather than wrapped, with ``time.time()`` bounds."""
+    if _tracer is not None:
+        _tracer.start_span(name, start_time=int(start * 1e9), attributes=_attributes(attributes)).end(end_time=int(end * 1e9))
+
+
+def server_span(method: str, path: str, headers: dict):
+    """Root span of an HTTP request, continuing the caller's trace if it sent one."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.start_as_current_span(
+        f'{method} {path}', context=propagate.extract(headers), kind=SpanKind.SERVER,
+        attributes={'http.request.method': method, 'url.path': path},
+    )
+
+
+class SpanCallback(BaseCallbackHandler):
+    """Spans for the provider calls LangChain makes, under the current ``llm.invoke`` span."""
+
+    run_inline = True
+
+    def __init__(self, task: str):
+        self.task = task
+        self._spans = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, invocation_params=None, **kwargs):
+        model = (invocation_params or {}).get('model') or (invocation_params or {}).get('model_name')
+        self._spans[run_id] = _tracer.start_span(f'chat {model}', kind=SpanKind.CLIENT, attributes=_attributes({
+            'gen_ai.operation.name': 'chat',
+            'gen_ai.request.model': model,
+            'toshokan.task': self.task,
+        }))
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        llm_output = response.llm_output or {}
+        token_usage = llm_output.get('token_usage') or {}
+        span.set_attributes(_attributes({
+            'gen_ai.response.model': llm_output.get('model_name'),
+            'gen_ai.usage.input_tokens': token_usage.get('prompt_tokens'),
+            'gen_ai.usage.output_tokens': token_usage.get('completion_tokens'),
+            'toshokan.cost': token_usage.get('cost'),
+        }))
+        span.end()
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, repr(error)))
+        span.end()
+
+
+def langchain_callbacks(task: str) -> list:
+    return [SpanCallback(task)] if _tracer is not None else []
+
+
+def instrument_blocks(blocks):
+    """Trace the events of *blocks*: each runs in a span parented to its queue join request."""
+    if _tracer is None:
+        return blocks
+    from toshokan.frontend.queues import queue_internals_supported
+    from toshokan.frontend.session import get_user_id
+
+    if not queue_internals_supported(blocks, 'Event tracing', process_api=True):
+        return blocks
+
+    queue = blocks._queue
+    push = queue.push
+    process_api = blocks.process_api
+
+    async def traced_push(body, request, username):
+        result = await push(body, request, username)
+        ok, event_id, _ = result
+        if ok:
+            _event_contexts[event_id] = otel_context.get_current()
+            while len(_event_contexts) > MAX_PENDING_EVENTS:
+                _event_contexts.popitem(last=False)
+        return result
+
+    async def traced_process_api(*args, **kwargs):
+        event_id = kwargs.get('event_id')
+        block_fn = kwargs.get('block_fn', args[0] if args else None)
+        request = kwargs.get('request')
+        joined_at = (queue.event_analytics.get(event_id) or {}).get('time') if event_id else None
+        with _tracer.start_as_current_span(
+            f'gradio.event {getattr(block_fn, "name", block_fn)}',
+            context=_event_contexts.pop(event_id, None),
+            start_time=int(joined_at * 1e9) if joined_at else None,
+            attributes=_attributes({
+                'gradio.concurrency_id': getattr(block_fn, 'concurrency_id', None),
+                'session.id': getattr(request, 'session_hash', None),
+                'enduser.id': get_user_id(request) if request is not None and not isinstance(request, list) else None,
+            }),
+        ):
+            if joined_at:
+                record_span('gradio.queue_wait', joined_at, time.time())
+            return await process_api(*args, **kwargs)
+
+    queue.push = traced_push
+    blocks.process_api = traced_process_api
+    return blocks
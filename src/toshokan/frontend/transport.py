@@ -0,0 +1,162 @@
+"""One HTTP connection pool for all provider traffic.
+
+Every model client, whatever the model or the user's key, sends its requests
+through the same pair of httpx clients, so a connection opened for one call
+is reused by the next. Connections to the provider are opened at startup
+(:meth:`SharedTransport.warm`) and, while there's no traffic, kept open with
+a cheap request every ``LLM_HTTP_PING_SECONDS``.
+
+The clients speak HTTP/2 (``h2`` comes with the ``httpx[http2]``
+dependency), multiplexing concurrent calls over few connections;
+``LLM_HTTP2=false`` falls back to HTTP/1.1 with keep-alive.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import httpx
+from toshokan.frontend import aio
+from toshokan.frontend.metrics import metrics
+from toshokan.frontend.cassettes import LLM_CASSETTE_MODE, cassette_transports
+from toshokan.frontend.openrouter import OPENROUTER_API_BASE
+from toshokan.frontend.throttling import current_limiter
+
+
+LLM_HTTP2 = os.environ.get('LLM_HTTP2', 'true').lower() == 'true'
+LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', '64'))
+LLM_HTTP_MAX_KEEPALIVE = int(os.environ.get('LLM_HTTP_MAX_KEEPALIVE', '32'))
+# Idle connections are closed after this long
+LLM_HTTP_KEEPALIVE_SECONDS = float(os.environ.get('LLM_HTTP_KEEPALIVE_SECONDS', '120'))
+LLM_HTTP_CONNECT_TIMEOUT = float(os.environ.get('LLM_HTTP_CONNECT_TIMEOUT', '5'))
+# Default for calls without a per-task timeout (TASK_PROFILES)
+LLM_HTTP_READ_TIMEOUT = float(os.environ.get('LLM_HTTP_READ_TIMEOUT', '120'))
+# Connections opened at startup
+LLM_HTTP_WARM_CONNECTIONS = int(os.environ.get('LLM_HTTP_WARM_CONNECTIONS', '2'))
+# Ping the provider after this long without traffic; 0 turns pings off
+LLM_HTTP_PING_SECONDS = float(os.environ.get('LLM_HTTP_PING_SECONDS', '30'))
+
+
+def _http2_available() -> bool:
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logging.warning('HTTP/2 is off: the h2 package is missing, install httpx[http2]')
+        return False
+    return True
+
+
+class SharedTransport:
+    """The httpx clients all model clients share, with connection reuse stats."""
+
+    def __init__(self, base_url: str = OPENROUTER_API_BASE):
+        self.base_url = base_url
+        self.http2 = _http2_available()
+        self.timeout = httpx.Timeout(LLM_HTTP_READ_TIMEOUT, connect=LLM_HTTP_CONNECT_TIMEOUT)
+        limits = httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_SECONDS,
+        )
+        transport = async_transport = None
+        if LLM_CASSETTE_MODE != 'off':
+            # recording or replaying the model calls, see cassettes.py
+            transport, async_transport = cassette_transports(self.http2, limits)
+        self.http_client = httpx.Client(
+            http2=self.http2, limits=limits, timeout=self.timeout, transport=transport,
+            event_hooks={'request': [self._on_request], 'response': [self._on_response]},
+        )
+        self.http_async_client = httpx.AsyncClient(
+            http2=self.http2, limits=limits, timeout=self.timeout, transport=async_transport,
+            event_hooks={'request': [self._on_async_request], 'response': [self._on_async_response]},
+        )
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.pings = 0
+        self.last_request_at = time.monotonic()
+        self._pinger = None
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+            self.last_request_at = time.monotonic()
+        metrics.inc('llm_http_requests_total')
+
+    def _count_connection(self, event_name: str):
+        if event_name == 'connection.connect_tcp.complete':
+            with self._lock:
+                self.connections_opened += 1
+            metrics.inc('llm_http_connections_opened_total')
+
+    def _on_request(self, request: httpx.Request):
+        self._count_request()
+        request.extensions['trace'] = lambda event_name, info: self._count_connection(event_name)
+
+    async def _on_async_request(self, request: httpx.Request):
+        self._count_request()
+
+        async def trace(event_name, info):
+            self._count_connection(event_name)
+
+        request.extensions['trace'] = trace
+
+    def _on_response(self, response: httpx.Response):
+        metrics.inc('llm_http_responses_total', version=response.http_version)
+        limiter = current_limiter.get()
+        if limiter is not None:
+            limiter.observe_headers(response.headers)
+
+    async def _on_async_response(self, response: httpx.Response):
+        self._on_response(response)
+
+    async def _ping(self):
+        try:
+            await self.http_async_client.head(self.base_url)
+        except httpx.HTTPError as e:
+            logging.debug(f'Provider ping failed: {e}')
+
+    def warm(self, connections: int = LLM_HTTP_WARM_CONNECTIONS):
+        """Open connections to the provider, and keep them warm from now on."""
+        async def open_connections():
+            await asyncio.gather(*(self._ping() for _ in range(connections)))
+
+        started_at = time.monotonic()
+        aio.run(open_connections())
+        logging.info(f'{self.connections_opened} provider connections open after {time.monotonic() - started_at:.2f}s')
+        self.start_pings()
+
+    def start_pings(self, interval: float = LLM_HTTP_PING_SECONDS):
+        if interval <= 0 or self._pinger is not None:
+            return
+        self._pinger = aio.submit(self._ping_loop(interval))
+
+    async def _ping_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_request_at >= interval:
+                self.pings += 1
+                await self._ping()
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests, opened = self.requests, self.connections_opened
+        return {
+            'http2': self.http2,
+            'requests': requests,
+            'connections_opened': opened,
+            # share of requests (pings included) that went over an open connection
+            'reuse_ratio': max(0.0, 1 - opened / requests) if requests else None,
+            'pings': self.pings,
+        }
+
+    def close(self):
+        if self._pinger is not None:
+            self._pinger.cancel()
+        self.http_client.close()
+        aio.submit(self.http_async_client.aclose())
+
+
+shared_transport = SharedTransport()